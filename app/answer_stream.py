@@ -0,0 +1,486 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+import audio_decode
+import transcription
+
+
+SAMPLE_RATE = 16000
+
+STATUS_STREAMING = 'streaming'   # 接收分片中
+STATUS_FINISHING = 'finishing'   # 作答结束，转写剩余音频中
+
+# 清理过期会话、接手未处理完的会话的最小间隔（秒）
+SWEEP_INTERVAL = 60
+
+# 无法按 Cluster 增量解码的格式，收到的数据比上次解码时增加到该倍数后才重新解码完整前缀
+FULL_DECODE_GROWTH = 1.5
+
+
+class StreamSession:
+    """分片上传会话的状态，保存在会话目录的 state.json 中，所有 worker 读写同一份"""
+
+    def __init__(self, interview_id, question_id):
+        self.interview_id = interview_id
+        self.question_id = question_id
+        self.next_seq = 0
+        self.received_bytes = 0
+        # 已经解码并转写过完整片段的字节数，小于 received_bytes 时还有新分片需要处理
+        self.processed_bytes = 0
+        # 已经转写过的音频样本数，之后只转写新增部分
+        self.committed_samples = 0
+        self.partial_texts = []
+        # webm 容器头的字节数：None 表示尚未确定，0 表示无法按 Cluster 增量解码
+        self.header_bytes = None
+        # 已解码并保存到 audio.pcm 的完整 Cluster 的结束位置（字节）和样本数
+        self.cluster_offset = 0
+        self.cluster_samples = 0
+        # 无法按 Cluster 增量解码时，上一次解码完整前缀时的字节数
+        self.full_decode_bytes = 0
+        self.status = STATUS_STREAMING
+        self.error = None
+        # 作答结束时保存的完整录音的哈希（与录音存储相同的 SHA-256），回写结果时据此确认回答没有被重新录制
+        self.audio_hash = None
+        self.last_activity = time.time()
+
+    @classmethod
+    def from_state(cls, state):
+        session = cls(state['interview_id'], state['question_id'])
+        session.__dict__.update(state)
+        return session
+
+    def partial_text(self):
+        return "".join(self.partial_texts)
+
+    def pending(self):
+        """是否还有需要转写的音频"""
+        if self.status == STATUS_FINISHING:
+            return True
+        return self.status == STATUS_STREAMING and self.processed_bytes < self.received_bytes
+
+    def to_dict(self):
+        return {
+            "question_id": self.question_id,
+            "status": self.status,
+            "received_seq": self.next_seq - 1,
+            "received_bytes": self.received_bytes,
+            "segments": len(self.partial_texts),
+            "transcribed_seconds": round(self.committed_samples / SAMPLE_RATE, 2),
+            "partial_text": self.partial_text(),
+            "error": self.error,
+        }
+
+
+class AnswerStreamManager:
+    """
+    分片上传回答音频并增量转写
+
+    候选人作答时浏览器按时间切片持续上传音频分片。每收到新分片，后台线程
+    解码新收到的音频，把尚未转写且已完整的片段送去转写，保存部分转写结果；
+    作答结束时只需转写最后剩余的一小段，answer_text 几乎立即可用。
+
+    webm 分片只有第一片带容器头，但容器头之后的每个 Cluster 都可以拼上容器头单独解码：
+    已完整收到的 Cluster 只解码一次，结果保存在 audio.pcm 中，每次只重新解码正在接收的最后一个 Cluster，
+    解码量与录音总长度成正比。无法识别 Cluster 的格式只能解码完整前缀，收到的数据增加到上次解码时的
+    FULL_DECODE_GROWTH 倍才重新解码，总解码量同样与录音长度成正比。
+
+    会话保存在 root 下按 (面试ID, 问题ID) 命名的目录中（收到的音频 audio.webm 和状态 state.json），
+    gunicorn 的各个 worker 共用：同一回答的分片无论落到哪个 worker 都按顺序追加。修改状态时持有
+    会话目录下 lock 文件的排他锁；转写由持有 worker.lock 的线程执行，同一会话同一时间只有一个线程在转写，
+    其他 worker 收到分片后只追加数据。持有转写锁的 worker 退出后锁随之释放，未处理完的会话由
+    其他 worker 在收到分片或查询状态时接手。
+
+    Args:
+        decode_fn: 解码函数，接收音频二进制数据，返回 16kHz float32 数组
+        transcribe_fn: 转写函数，接收 16kHz float32 数组，返回文本
+        on_finished: 作答结束并转写完成后的回调 on_finished(session, text)，转写失败时 text 为 None
+        find_cut_fn: 切点查找函数 find_cut_fn(audio, min_offset)，返回停顿位置或 None；
+            为空时按固定长度切分
+        root: 会话目录，多个 worker 需使用同一目录
+        segment_seconds: 增量转写的最短片段长度（秒），超过两倍仍未找到停顿时按该长度强制切分
+        lookahead_seconds: 片段末尾之后至少还需收到的音频长度，避免截断未完整编码的帧
+        idle_timeout: 会话空闲超过该秒数后被清理
+        max_workers: 增量转写线程数
+        max_bytes: 单个回答最多接收的字节数，超过时 append 抛出 ValueError
+    """
+
+    def __init__(self, decode_fn, transcribe_fn, on_finished, find_cut_fn=None, root="answer_streams",
+                 segment_seconds=10, lookahead_seconds=1, idle_timeout=1800, max_workers=4, max_bytes=20 * 1024 * 1024):
+        self.decode_fn = decode_fn
+        self.transcribe_fn = transcribe_fn
+        self.on_finished = on_finished
+        self.find_cut_fn = find_cut_fn
+        self.root = root
+        self.segment_samples = int(segment_seconds * SAMPLE_RATE)
+        self.lookahead_samples = int(lookahead_seconds * SAMPLE_RATE)
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="answer-stream")
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        self._running = 0
+        self._idle = threading.Condition()
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, interview_id, question_id, seq, data):
+        """
+        追加一个音频分片
+
+        分片必须按 seq 从 0 开始依次上传；重复上传已接收的分片会被忽略，
+        便于客户端在网络失败时重试。
+
+        Returns:
+            (是否接受, 会话状态)
+
+        Raises:
+            ValueError: 收到的音频超过 max_bytes
+        """
+        self._sweep()
+        directory = self._directory(interview_id, question_id)
+        os.makedirs(directory, exist_ok=True)
+        with self._locked(directory):
+            session = self._load(directory)
+            if session is None or (seq == 0 and session.status in (transcription.STATUS_DONE, transcription.STATUS_FAILED)):
+                if seq != 0:
+                    return False, None
+                session = StreamSession(interview_id, question_id)
+                open(self._audio_path(directory), "wb").close()
+                open(self._pcm_path(directory), "wb").close()
+
+            if session.status != STATUS_STREAMING:
+                return False, session.to_dict()
+            if seq < session.next_seq:
+                return True, session.to_dict()
+            if seq > session.next_seq:
+                return False, session.to_dict()
+            if session.received_bytes + len(data) > self.max_bytes:
+                raise ValueError(f"回答录音超过 {self.max_bytes} 字节")
+            with open(self._audio_path(directory), "ab") as f:
+                f.write(data)
+            session.next_seq += 1
+            session.received_bytes += len(data)
+            session.last_activity = time.time()
+            self._save(directory, session)
+        self._schedule(directory)
+        return True, session.to_dict()
+
+    def finish(self, interview_id, question_id, persist_fn):
+        """
+        结束上传：先调用 persist_fn(audio_data) 保存完整音频，
+        再转写剩余音频，完成后调用 on_finished(session, text)
+
+        Returns:
+            persist_fn 的返回值，会话不存在或没有音频时返回 None
+        """
+        directory = self._directory(interview_id, question_id)
+        if not os.path.isdir(directory):
+            return None
+
+        with self._locked(directory):
+            session = self._load(directory)
+            if session is None or session.status != STATUS_STREAMING or not session.received_bytes:
+                return None
+            # 持有会话锁保存音频，确保转写结果一定在音频保存之后写入
+            audio_data = self._read_audio(directory, 0, session.received_bytes)
+            result = persist_fn(audio_data)
+            if result is None:
+                return None
+            session.audio_hash = hashlib.sha256(audio_data).hexdigest()
+            session.status = STATUS_FINISHING
+            session.last_activity = time.time()
+            self._save(directory, session)
+        self._schedule(directory)
+        return result
+
+    def status(self, interview_id, question_id):
+        self._sweep()
+        session = self._load(self._directory(interview_id, question_id))
+        return session.to_dict() if session else None
+
+    def drain(self, timeout):
+        """等待本进程正在执行的转写完成，超时返回 False；进程退出前调用"""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _directory(self, interview_id, question_id):
+        return os.path.join(self.root, f"{int(interview_id)}-{int(question_id)}")
+
+    def _audio_path(self, directory):
+        return os.path.join(directory, "audio.webm")
+
+    def _pcm_path(self, directory):
+        return os.path.join(directory, "audio.pcm")
+
+    @contextmanager
+    def _locked(self, directory):
+        # flock 的锁属于打开的文件，同一进程的不同线程各自打开也会互斥
+        with open(os.path.join(directory, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _load(self, directory):
+        try:
+            with open(os.path.join(directory, "state.json"), encoding="utf-8") as f:
+                return StreamSession.from_state(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def _save(self, directory, session):
+        # 调用方需持有会话锁；先写临时文件再替换，不加锁读取状态也不会读到半个文件
+        path = os.path.join(directory, "state.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(session.__dict__, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _update(self, directory, fn):
+        with self._locked(directory):
+            session = self._load(directory)
+            if session is not None:
+                fn(session)
+                self._save(directory, session)
+            return session
+
+    def _read_audio(self, directory, start, end):
+        with open(self._audio_path(directory), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def _schedule(self, directory):
+        with self._idle:
+            self._running += 1
+        self._executor.submit(self._process, directory)
+
+    def _process(self, directory):
+        try:
+            while self._run_locked(directory):
+                # 释放转写锁之后再检查一次：持有锁期间其他 worker 追加的分片可能因拿不到锁而没有被处理
+                session = self._load(directory)
+                if session is None or not session.pending():
+                    break
+        except FileNotFoundError:
+            # 会话已被清理
+            pass
+        except Exception as e:
+            print(f"分片上传会话 {os.path.basename(directory)} 处理失败: {str(e)}")
+        finally:
+            with self._idle:
+                self._running -= 1
+                self._idle.notify_all()
+
+    def _run_locked(self, directory):
+        """持有转写锁时处理会话，返回 True；其他线程或 worker 正在处理时返回 False，由它处理新分片"""
+        with open(os.path.join(directory, "worker.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self._run(directory)
+        return True
+
+    def _run(self, directory):
+        while True:
+            session = self._load(directory)
+            if session is None or not session.pending():
+                return
+            finishing = session.status == STATUS_FINISHING
+            received = session.received_bytes
+
+            try:
+                self._transcribe_available(directory, session, finishing)
+            except Exception as e:
+                print(f"问题ID: {session.question_id} 增量转写失败: {str(e)}")
+                if finishing:
+                    self._complete(directory, None, str(e))
+                    return
+
+            if finishing:
+                self._complete(directory, self._load(directory).partial_text())
+                return
+
+            def mark_processed(current):
+                current.processed_bytes = max(current.processed_bytes, received)
+            self._update(directory, mark_processed)
+
+    def _transcribe_available(self, directory, session, finishing):
+        # audio 从 committed_samples 开始，offset 为其中已转写到的位置
+        audio = self._decode_available(directory, session, finishing)
+        if audio is None:
+            return
+        offset = 0
+        while True:
+            remaining = len(audio) - offset
+            if finishing:
+                if remaining <= 0:
+                    break
+                end = len(audio)
+            elif remaining >= self.segment_samples + self.lookahead_samples:
+                end = self._find_cut(audio, offset)
+                if end is None:
+                    break
+            else:
+                break
+
+            text = self.transcribe_fn(audio[offset:end])
+            offset = end
+
+            def commit(current, text=text, committed=session.committed_samples + offset):
+                current.partial_texts.append(text)
+                current.committed_samples = committed
+            self._update(directory, commit)
+
+    def _decode_available(self, directory, session, finishing):
+        """返回从 committed_samples 开始的已收到音频，暂时不需要解码时返回 None"""
+        if session.header_bytes is None:
+            head = self._read_audio(directory, 0, session.received_bytes)
+            offsets = audio_decode.webm_cluster_offsets(head)
+            if offsets:
+                header_bytes = offsets[0]
+            elif head.startswith(audio_decode.WEBM_EBML_ID) and not finishing:
+                # webm 容器头已收到，第一个 Cluster 还不完整
+                return None
+            else:
+                header_bytes = 0
+
+            def set_header(current):
+                current.header_bytes = header_bytes
+                current.cluster_offset = header_bytes
+            session = self._update(directory, set_header)
+
+        if session.header_bytes:
+            return self._decode_clusters(directory, session)
+        return self._decode_prefix(directory, session, finishing)
+
+    def _decode_clusters(self, directory, session):
+        header = self._read_audio(directory, 0, session.header_bytes)
+        data = self._read_audio(directory, session.cluster_offset, session.received_bytes)
+
+        # 之后已经出现新的 Cluster，说明之前的 Cluster 都已完整收到：解码一次，结果追加到 audio.pcm
+        offsets = audio_decode.webm_cluster_offsets(data, 1)
+        if offsets:
+            complete = offsets[-1]
+            samples = self.decode_fn(header + data[:complete]).astype(np.float32)
+            with open(self._pcm_path(directory), "r+b") as f:
+                # 截掉上次写入后未能记录到状态中的样本
+                f.truncate(session.cluster_samples * 4)
+                f.seek(0, os.SEEK_END)
+                samples.tofile(f)
+
+            def add_cluster(current):
+                current.cluster_offset += complete
+                current.cluster_samples += len(samples)
+            session = self._update(directory, add_cluster)
+            data = data[complete:]
+
+        # 正在接收的最后一个 Cluster 每次从头重新解码，已完整收到的帧解码结果与上次相同
+        tail = self.decode_fn(header + data) if data else np.zeros(0, dtype=np.float32)
+        start = min(session.committed_samples, session.cluster_samples)
+        saved = np.fromfile(self._pcm_path(directory), dtype=np.float32,
+                            count=session.cluster_samples - start, offset=start * 4)
+        return np.concatenate([saved, tail])[session.committed_samples - start:]
+
+    def _decode_prefix(self, directory, session, finishing):
+        if not finishing and session.received_bytes < session.full_decode_bytes * FULL_DECODE_GROWTH:
+            return None
+        audio = self.decode_fn(self._read_audio(directory, 0, session.received_bytes))
+
+        def set_decoded(current, received=session.received_bytes):
+            current.full_decode_bytes = received
+        self._update(directory, set_decoded)
+        return audio[session.committed_samples:]
+
+    def _find_cut(self, audio, committed):
+        # 尽量在停顿处切分，避免把一个词切成两半
+        window_end = len(audio) - self.lookahead_samples
+        if self.find_cut_fn is not None:
+            cut = self.find_cut_fn(audio[committed:window_end], self.segment_samples)
+            if cut is not None:
+                return committed + cut
+            if window_end - committed < 2 * self.segment_samples:
+                return None
+        return committed + self.segment_samples
+
+    def _complete(self, directory, text, error=None):
+        # 先回写结果再更新状态：回写前 worker 退出时会话仍是 finishing，由其他 worker 接手重新完成
+        session = self._load(directory)
+        try:
+            self.on_finished(session, text)
+        except Exception as e:
+            print(f"问题ID: {session.question_id} 保存转写结果失败: {str(e)}")
+
+        def mark_complete(current):
+            current.status = transcription.STATUS_FAILED if error else transcription.STATUS_DONE
+            current.error = error
+            current.last_activity = time.time()
+        self._update(directory, mark_complete)
+        # 音频已由 persist_fn 保存，会话目录只保留状态供查询
+        os.remove(self._audio_path(directory))
+        os.remove(self._pcm_path(directory))
+
+    def _sweep(self):
+        """清理空闲超时的会话，接手其他 worker 退出时未处理完的会话；每 SWEEP_INTERVAL 秒最多执行一次"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(directory):
+                continue
+            try:
+                session = self._load(directory)
+            except ValueError:
+                continue
+            if session is None:
+                continue
+            if session.pending():
+                # 正在被处理时拿不到转写锁，直接返回
+                self._schedule(directory)
+            elif now - session.last_activity > self.idle_timeout:
+                self._remove(directory)
+
+    def _remove(self, directory):
+        with self._locked(directory):
+            with open(os.path.join(directory, "worker.lock"), "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+                # 先移走再删除，之后收到的分片会新建会话目录
+                trash = os.path.join(self.root, f".expired-{os.path.basename(directory)}-{uuid.uuid4().hex[:8]}")
+                os.rename(directory, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+
+
+def create_manager_from_env(decode_fn, transcribe_fn, on_finished, find_cut_fn=None):
+    """
+    根据环境变量创建分片转写管理器：STREAM_SPOOL_PATH、STREAM_SEGMENT_SECONDS、STREAM_WORKERS、
+    STREAM_MAX_BYTES（单个回答最多接收的字节数，默认20MB）
+    """
+    return AnswerStreamManager(
+        decode_fn,
+        transcribe_fn,
+        on_finished,
+        find_cut_fn=find_cut_fn,
+        root=os.getenv("STREAM_SPOOL_PATH", "answer_streams"),
+        segment_seconds=float(os.getenv("STREAM_SEGMENT_SECONDS", "10")),
+        max_workers=int(os.getenv("STREAM_WORKERS", "4")),
+        max_bytes=int(os.getenv("STREAM_MAX_BYTES", str(20 * 1024 * 1024))),
+    )
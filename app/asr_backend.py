@@ -0,0 +1,165 @@
+import os
+
+import torch
+import whisper
+
+
+# tiny：最小的模型，适合资源受限的设备，速度快但精度较低。
+# base：基础模型，平衡了速度和精度，适合一般用途。
+# small：中等规模模型，精度高于 base，适合需要更好性能的场景。
+# medium：中大型模型，精度进一步提高，适合高质量转录。
+# large：最大模型，精度最高，适合专业级应用，但需要更多计算资源。
+
+BACKENDS = ("whisper", "whisper-int8")
+
+# 解码预设：贪心/束搜索，是否在结果质量差时以更高温度重新解码
+DECODE_PRESETS = {
+    "greedy": {"beam_size": None, "temperature_fallback": True},
+    "greedy-nofallback": {"beam_size": None, "temperature_fallback": False},
+    "beam": {"beam_size": 5, "temperature_fallback": True},
+    "beam-nofallback": {"beam_size": 5, "temperature_fallback": False},
+}
+
+FALLBACK_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+class AsrBackend:
+    """
+    已加载的语音识别模型及其解码配置
+
+    Args:
+        model: Whisper 模型
+        backend: 后端名称，见 BACKENDS
+        model_size: 模型规格，如 base、large-v3
+        device: 运行设备
+        preset: 解码预设名称，见 DECODE_PRESETS
+        language: 解码语言
+    """
+
+    def __init__(self, model, backend, model_size, device, preset, language="zh"):
+        if preset not in DECODE_PRESETS:
+            raise ValueError(f"未知的解码预设: {preset}，可选: {', '.join(DECODE_PRESETS)}")
+        self.model = model
+        self.backend = backend
+        self.model_size = model_size
+        self.device = device
+        self.preset = preset
+        self.language = language
+        self.beam_size = DECODE_PRESETS[preset]["beam_size"]
+        self.temperature_fallback = DECODE_PRESETS[preset]["temperature_fallback"]
+
+    @property
+    def fp16(self):
+        return self.device == "cuda" and self.backend == "whisper"
+
+    def decoding_options(self):
+        """单窗口批量解码使用的 DecodingOptions"""
+        return whisper.DecodingOptions(
+            language=self.language,
+            fp16=self.fp16,
+            beam_size=self.beam_size,
+            temperature=0.0,
+        )
+
+    def transcribe(self, audio):
+        """整段转写（超过 30 秒的音频或批量解码质量差时使用）"""
+        result = self.model.transcribe(
+            audio,
+            language=self.language,
+            fp16=self.fp16,
+            beam_size=self.beam_size,
+            best_of=5 if self.temperature_fallback else None,
+            temperature=FALLBACK_TEMPERATURES if self.temperature_fallback else 0.0,
+        )
+        return result["text"]
+
+    def fingerprint(self):
+        """标识模型与解码配置，配置不同的转写结果不可混用"""
+        return f"{self.backend}:{self.model_size}:{self.preset}:{self.language}"
+
+    def describe(self):
+        return {
+            "backend": self.backend,
+            "model": self.model_size,
+            "device": self.device,
+            "preset": self.preset,
+            "torch_threads": torch.get_num_threads(),
+        }
+
+
+def quantize_int8(model):
+    """
+    对 Whisper 的全连接层做 int8 动态量化（仅 CPU）
+
+    whisper.model.Linear 继承自 nn.Linear，只是在前向时把权重转换为输入的精度，
+    fp32 推理时两者等价；量化工具只识别 nn.Linear 本身，因此先还原类型再量化。
+    """
+    for module in model.modules():
+        if isinstance(module, whisper.model.Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def configure_threads(num_threads=None, interop_threads=None):
+    """设置 torch 计算线程数，未指定时保持默认"""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # 已经开始并行计算后无法再修改
+            print("无法设置 torch interop 线程数，保持默认值")
+
+
+def resolve_device(backend="whisper", device=None):
+    """未指定设备时自动选择：有 GPU 且使用原始精度后端时用 cuda，否则用 cpu"""
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() and backend == "whisper" else "cpu"
+    return device
+
+
+def load_backend(backend="whisper", model_size=None, device=None, preset="greedy", language="zh"):
+    """
+    加载语音识别后端
+
+    Args:
+        backend: whisper（原始精度）或 whisper-int8（CPU 动态量化）
+        model_size: 模型规格，为空时 GPU 使用 large-v3，CPU 使用 base
+        device: cuda 或 cpu，为空时自动选择
+        preset: 解码预设
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的语音识别后端: {backend}，可选: {', '.join(BACKENDS)}")
+    device = resolve_device(backend, device)
+    if backend == "whisper-int8" and device != "cpu":
+        raise ValueError("whisper-int8 后端仅支持 CPU")
+    if model_size is None:
+        # https://huggingface.co/openai/whisper-large-v3
+        model_size = "large-v3" if device == "cuda" else "base"
+
+    model = whisper.load_model(model_size, device=device)
+    if backend == "whisper-int8":
+        model = quantize_int8(model)
+    model.eval()
+
+    print(f"语音识别后端: {backend}，模型: {model_size}，设备: {device}，解码预设: {preset}")
+    return AsrBackend(model, backend, model_size, device, preset, language)
+
+
+def load_backend_from_env():
+    """
+    根据环境变量加载语音识别后端
+
+    ASR_BACKEND、ASR_MODEL、ASR_DEVICE、ASR_DECODE_PRESET、ASR_THREADS、ASR_INTEROP_THREADS
+    """
+    configure_threads(
+        int(os.getenv("ASR_THREADS", "0")) or None,
+        int(os.getenv("ASR_INTEROP_THREADS", "0")) or None,
+    )
+    return load_backend(
+        backend=os.getenv("ASR_BACKEND", "whisper"),
+        model_size=os.getenv("ASR_MODEL") or None,
+        device=os.getenv("ASR_DEVICE") or None,
+        preset=os.getenv("ASR_DECODE_PRESET", "greedy"),
+    )
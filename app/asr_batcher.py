@@ -0,0 +1,233 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+import whisper
+from whisper.audio import HOP_LENGTH, N_FFT, N_SAMPLES, mel_filters
+
+import latency_stats
+
+
+# 批量解码结果质量较差时，回退到带温度回退的单条 transcribe
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+
+
+class _PendingClip:
+    def __init__(self, audio):
+        self.audio = audio
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+def batch_log_mel_spectrogram(audio_batch, n_mels, device):
+    """
+    一次性计算一批音频的 log-mel 频谱
+
+    与 whisper.log_mel_spectrogram 相同，但动态范围裁剪按每条音频分别计算，
+    避免批内音量差异互相影响。
+
+    Args:
+        audio_batch: 形状为 (batch, N_SAMPLES) 的 float32 张量
+        n_mels: mel 滤波器数量（large-v3 为 128，其余为 80）
+        device: 计算设备
+
+    Returns:
+        形状为 (batch, n_mels, 3000) 的张量
+    """
+    audio_batch = audio_batch.to(device)
+    window = torch.hann_window(N_FFT).to(device)
+    stft = torch.stft(audio_batch, N_FFT, HOP_LENGTH, window=window, return_complex=True)
+    magnitudes = stft[..., :-1].abs() ** 2
+
+    filters = mel_filters(device, n_mels)
+    mel_spec = filters @ magnitudes
+
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+    log_spec = (log_spec + 4.0) / 4.0
+    return log_spec
+
+
+class BatchingTranscriber:
+    """
+    Whisper 微批量推理引擎
+
+    调用方线程通过 transcribe() 提交音频并阻塞等待结果；后台批处理线程在
+    window_ms 时间窗口内收集待处理的音频，合并计算 log-mel 频谱后一次性解码，
+    再将结果分别返回给提交它的调用方。超过 30 秒的音频无法放进单个解码窗口，
+    由批处理线程逐条整段转写。
+    whisper 解码时会在模型上挂载 kv-cache 钩子，多个线程同时使用同一个模型会互相干扰，
+    因此所有模型调用（批量解码、长音频、温度回退）都只在批处理线程中执行。
+
+    Args:
+        backend: 已加载的语音识别后端（asr_backend.AsrBackend）
+        window_ms: 收集批次的时间窗口（毫秒）
+        max_batch_size: 单批最多音频数
+        stats_window: 统计等待时间所用的最近样本数
+    """
+
+    def __init__(self, backend, window_ms=50, max_batch_size=8, stats_window=1000):
+        self.backend = backend
+        self.model = backend.model
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+
+        self._stats_lock = threading.Lock()
+        self._started_at = time.time()
+        self._completed = 0
+        self._batches = 0
+        self._fallbacks = 0
+        self._long_clips = 0
+        self._busy_seconds = 0.0
+        self._waits = deque(maxlen=stats_window)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="asr-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """已提交的音频处理完后停止批处理线程；基准测试切换配置前调用，释放上一个模型"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def transcribe(self, audio):
+        """
+        转写一段 16kHz 单声道 float32 音频，阻塞直到结果返回
+
+        Returns:
+            识别出的文本
+        """
+        return self.transcribe_many([audio])[0]
+
+    def transcribe_many(self, audios):
+        """
+        同时提交多段音频（例如同一回答按停顿切出的片段），它们会进入同一批次解码
+
+        Returns:
+            与输入顺序一致的文本列表
+        """
+        clips = [_PendingClip(audio) for audio in audios]
+        for clip in clips:
+            self._queue.put(clip)
+        return [clip.future.result() for clip in clips]
+
+    def stats(self):
+        """返回吞吐量与等待时间统计，用于调整批处理窗口"""
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            completed = self._completed
+            batches = self._batches
+            busy = self._busy_seconds
+            result = {
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "completed": completed,
+                "batches": batches,
+                "avg_batch_size": round(completed / batches, 2) if batches else 0,
+                "fallbacks": self._fallbacks,
+                "long_clips": self._long_clips,
+                "pending": self._queue.qsize(),
+                **self.backend.describe(),
+                "uptime_seconds": round(time.time() - self._started_at, 1),
+            }
+
+        threads = result["torch_threads"]
+        # 每核吞吐量：单位解码时间内完成的回答数 / 推理线程数
+        result["answers_per_sec_per_core"] = round(completed / busy / threads, 3) if busy else 0
+        result["wait_ms_p50"] = round(latency_stats.percentile(waits, 0.50) * 1000, 1)
+        result["wait_ms_p99"] = round(latency_stats.percentile(waits, 0.99) * 1000, 1)
+        return result
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = []
+            stopping = False
+            for clip in self._collect_batch():
+                if clip is None:
+                    stopping = True
+                elif len(clip.audio) > N_SAMPLES:
+                    self._run_long(clip)
+                else:
+                    batch.append(clip)
+            if batch:
+                self._run_batch(batch)
+            if stopping:
+                return
+
+    def _run_long(self, clip):
+        with self._stats_lock:
+            self._long_clips += 1
+            self._waits.append(time.perf_counter() - clip.enqueued_at)
+        try:
+            clip.future.set_result(self._transcribe_single(clip.audio))
+        except Exception as e:
+            clip.future.set_exception(e)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            texts = self._decode_batch([clip.audio for clip in batch])
+        except Exception as e:
+            for clip in batch:
+                clip.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        with self._stats_lock:
+            self._batches += 1
+            self._completed += len(batch)
+            self._busy_seconds += finished - started
+            for clip in batch:
+                self._waits.append(started - clip.enqueued_at)
+
+        for clip, text in zip(batch, texts):
+            clip.future.set_result(text)
+
+    def _decode_batch(self, audios):
+        padded = torch.stack([whisper.pad_or_trim(torch.from_numpy(audio)) for audio in audios])
+        mel = batch_log_mel_spectrogram(padded, self.model.dims.n_mels, self.model.device)
+
+        results = whisper.decode(self.model, mel, self.backend.decoding_options())
+
+        texts = []
+        for audio, result in zip(audios, results):
+            poor = result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+            if poor and self.backend.temperature_fallback:
+                with self._stats_lock:
+                    self._fallbacks += 1
+                texts.append(self._transcribe_single(audio))
+            else:
+                texts.append(result.text)
+        return texts
+
+    def _transcribe_single(self, audio):
+        return self.backend.transcribe(audio)
+
+
+def create_batcher_from_env(backend):
+    """根据环境变量创建批处理引擎：ASR_BATCH_WINDOW_MS、ASR_BATCH_SIZE"""
+    return BatchingTranscriber(
+        backend,
+        window_ms=float(os.getenv("ASR_BATCH_WINDOW_MS", "50")),
+        max_batch_size=int(os.getenv("ASR_BATCH_SIZE", "8")),
+    )
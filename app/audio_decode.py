@@ -0,0 +1,171 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import latency_stats
+
+
+SAMPLE_RATE = 16000
+
+# 从标准输入读取任意格式音频，输出 16kHz 单声道 16 位 PCM 到标准输出
+FFMPEG_COMMAND = [
+    "ffmpeg", "-hide_banner", "-loglevel", "error", "-threads", "0",
+    "-i", "pipe:0",
+    "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+    "pipe:1",
+]
+
+STAGES = ("acquire", "decode", "convert", "total")
+
+# WebM（Matroska）文件头、Cluster 元素和 Cluster 中第一个子元素 Timecode 的 ID
+WEBM_EBML_ID = b"\x1a\x45\xdf\xa3"
+WEBM_CLUSTER_ID = b"\x1f\x43\xb6\x75"
+WEBM_TIMECODE_ID = 0xE7
+
+
+def webm_cluster_offsets(data, start=0):
+    """
+    返回 data 中从 start 开始各个 WebM Cluster 元素的起始位置
+
+    MediaRecorder 生成的 webm 由容器头（EBML、Segment、Tracks）和一串 Cluster 组成，容器头拼上任意
+    Cluster 开始的数据都可以单独解码。Cluster ID 之后应紧跟元素长度和 Timecode 元素，
+    据此排除音频数据中偶然出现的相同字节；最后一个 Cluster 的开头尚未收全时不会被识别。
+    """
+    offsets = []
+    position = data.find(WEBM_CLUSTER_ID, start)
+    while position != -1:
+        size_at = position + len(WEBM_CLUSTER_ID)
+        if size_at < len(data) and data[size_at]:
+            # EBML 变长整数：首字节前导零的个数加一即长度字节数
+            child_at = size_at + 9 - data[size_at].bit_length()
+            if child_at < len(data) and data[child_at] == WEBM_TIMECODE_ID:
+                offsets.append(position)
+        position = data.find(WEBM_CLUSTER_ID, position + 1)
+    return offsets
+
+
+class DecoderPool:
+    """
+    常驻 ffmpeg 解码进程池
+
+    预先启动若干个等待标准输入的 ffmpeg 进程，解码时取出一个已就绪的进程，
+    通过管道写入上传的音频、读取 PCM 输出并直接转换为 float32 numpy 数组，
+    全程不落盘。每个进程解码一段音频后退出，后台线程随即补充新的进程，
+    进程启动开销不再出现在请求路径上。
+
+    Args:
+        size: 保持就绪的解码进程数量
+        timeout: 单次解码超时时间（秒）
+        stats_window: 统计各阶段耗时所用的最近样本数
+    """
+
+    def __init__(self, size=4, timeout=60, stats_window=1000):
+        self.size = size
+        self.timeout = timeout
+        self._ready = queue.Queue()
+        self._refill = queue.Queue()
+        self._thread = None
+
+        self._stats_lock = threading.Lock()
+        self._decoded = 0
+        self._failed = 0
+        self._bytes_in = 0
+        self._audio_seconds = 0.0
+        self._timings = {stage: deque(maxlen=stats_window) for stage in STAGES}
+
+    def start(self):
+        for _ in range(self.size):
+            self._ready.put(self._spawn())
+        self._thread = threading.Thread(target=self._refill_loop, name="decoder-refill", daemon=True)
+        self._thread.start()
+
+    def decode(self, audio_data):
+        """
+        将上传的音频二进制数据解码为 16kHz 单声道 float32 数组
+
+        Raises:
+            RuntimeError: ffmpeg 解码失败
+        """
+        started = time.perf_counter()
+        try:
+            process = self._ready.get_nowait()
+        except queue.Empty:
+            # 就绪进程用完时直接启动一个新进程
+            process = self._spawn()
+        self._refill.put(None)
+        acquired = time.perf_counter()
+
+        try:
+            out, err = process.communicate(input=audio_data, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            self._record_failure()
+            raise RuntimeError("音频解码超时")
+        decoded = time.perf_counter()
+
+        if process.returncode != 0:
+            self._record_failure()
+            raise RuntimeError(f"音频解码失败: {err.decode(errors='ignore').strip()}")
+
+        audio = np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+        finished = time.perf_counter()
+
+        with self._stats_lock:
+            self._decoded += 1
+            self._bytes_in += len(audio_data)
+            self._audio_seconds += len(audio) / SAMPLE_RATE
+            self._timings["acquire"].append(acquired - started)
+            self._timings["decode"].append(decoded - acquired)
+            self._timings["convert"].append(finished - decoded)
+            self._timings["total"].append(finished - started)
+        return audio
+
+    def stats(self):
+        """返回解码次数与各阶段耗时统计（毫秒）"""
+        with self._stats_lock:
+            result = {
+                "pool_size": self.size,
+                "ready": self._ready.qsize(),
+                "decoded": self._decoded,
+                "failed": self._failed,
+                "bytes_in": self._bytes_in,
+                "audio_seconds": round(self._audio_seconds, 1),
+            }
+            for stage, values in self._timings.items():
+                ordered = sorted(values)
+                result[f"{stage}_ms_avg"] = round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0
+                result[f"{stage}_ms_p99"] = round(latency_stats.percentile(ordered, 0.99) * 1000, 2)
+        return result
+
+    def _spawn(self):
+        return subprocess.Popen(
+            FFMPEG_COMMAND,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def _refill_loop(self):
+        while True:
+            self._refill.get()
+            if self._ready.qsize() < self.size:
+                try:
+                    self._ready.put(self._spawn())
+                except OSError as e:
+                    print(f"启动解码进程失败: {str(e)}")
+                    time.sleep(1)
+
+    def _record_failure(self):
+        with self._stats_lock:
+            self._failed += 1
+
+
+def create_pool_from_env():
+    """根据环境变量创建解码进程池：AUDIO_DECODER_POOL_SIZE"""
+    return DecoderPool(size=int(os.getenv("AUDIO_DECODER_POOL_SIZE", "4")))
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import re
+import tempfile
+
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class AudioStore:
+    """
+    按内容寻址的回答录音存储
+
+    录音以 SHA-256 命名保存在文件系统中，按哈希前两级目录分片
+    （如 ab/cd/abcd...），数据库只记录哈希和长度。内容相同的录音只保存一份。
+
+    Args:
+        root: 存储根目录
+    """
+
+    def __init__(self, root="audio_store"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, audio_hash):
+        if not HASH_PATTERN.match(audio_hash or ""):
+            raise ValueError(f"无效的音频哈希: {audio_hash}")
+        return os.path.join(self.root, audio_hash[:2], audio_hash[2:4], audio_hash)
+
+    def exists(self, audio_hash):
+        return os.path.exists(self.path(audio_hash))
+
+    def put(self, data):
+        """
+        保存录音，返回 (哈希, 字节数)
+
+        先写入同目录下的临时文件再原子重命名，并发写入相同内容也不会读到半个文件。
+        """
+        audio_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(audio_hash)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        return audio_hash, len(data)
+
+    def read(self, audio_hash):
+        with open(self.path(audio_hash), "rb") as f:
+            return f.read()
+
+    def remove(self, audio_hash):
+        try:
+            os.remove(self.path(audio_hash))
+        except FileNotFoundError:
+            pass
+
+    def iter_hashes(self):
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if HASH_PATTERN.match(name):
+                    yield name
+
+
+def create_store_from_env():
+    """根据环境变量创建录音存储：AUDIO_STORE_PATH"""
+    return AudioStore(os.getenv("AUDIO_STORE_PATH", "audio_store"))
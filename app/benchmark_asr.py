@@ -0,0 +1,193 @@
+"""
+语音识别后端基准测试
+
+对每种后端配置转写同一组参考音频，报告实时率（RTF，处理耗时 / 音频时长，
+越小越快）、字错误率（CER，相对参考文本的编辑距离 / 参考字数）和单条音频的等待时间。
+与线上服务相同，音频经 asr_batcher.BatchingTranscriber 微批量解码：--concurrency 个线程
+同时提交，模拟多个候选人同时作答，RTF 按墙钟时间计算；--concurrency 1 即逐条转写。
+
+参考集为一个 JSON 清单，音频路径相对清单所在目录：
+
+    [
+        {"audio": "q1.webm", "text": "我主要负责后端接口的开发"},
+        ...
+    ]
+
+参考集取自真实的面试回答：--export 从数据库中导出最近已转写的回答录音和当前转写文本，
+人工校对 manifest.json 中的文本后即可作为参考集。录音包含候选人的声音，不要提交到代码仓库。
+Whisper 输出的中文可能是繁体，参考文本需与模型输出使用相同字形。
+
+用法：
+
+    python benchmark_asr.py --export asr_reference --limit 50
+    python benchmark_asr.py asr_reference/manifest.json \\
+        --modes whisper:base:greedy whisper-int8:base:greedy whisper-int8:small:beam
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import whisper
+
+import asr_backend
+import asr_batcher
+import audio_store
+import db
+import latency_stats
+
+
+SAMPLE_RATE = 16000
+
+# 计算字错误率前去掉标点和空白
+PUNCTUATION = re.compile(r"[\s，。！？、；：,.!?;:\"'“”‘’（）()《》<>\-—…]+")
+
+
+def normalize_text(text):
+    return PUNCTUATION.sub("", text).lower()
+
+
+def edit_distance(reference, hypothesis):
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_char != hyp_char),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def load_reference_set(manifest_path):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding="utf-8") as f:
+        entries = json.load(f)
+    samples = []
+    for entry in entries:
+        audio = whisper.load_audio(os.path.join(base_dir, entry["audio"]))
+        samples.append((entry["audio"], audio, entry["text"]))
+    return samples
+
+
+def export_reference_set(output_dir, limit):
+    """导出最近 limit 条已转写的回答录音和转写文本，返回导出的条数"""
+    store = audio_store.create_store_from_env()
+    rows = db.get_connection().execute('''
+        SELECT id, answer_audio_hash, answer_text FROM interview_questions
+        WHERE answer_audio_hash IS NOT NULL AND answer_text IS NOT NULL AND answer_text != ''
+        ORDER BY id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+
+    os.makedirs(output_dir, exist_ok=True)
+    entries = []
+    for row in rows:
+        name = f"{row['id']}.webm"
+        shutil.copyfile(store.path(row['answer_audio_hash']), os.path.join(output_dir, name))
+        entries.append({"audio": name, "text": row['answer_text']})
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    return len(entries)
+
+
+def parse_mode(mode):
+    """解析 backend:model:preset 形式的配置"""
+    parts = mode.split(":")
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError(f"配置格式应为 backend:model:preset，实际为 {mode}")
+    return tuple(parts)
+
+
+def run_mode(samples, backend_name, model_size, preset, concurrency=8, window_ms=50, batch_size=8, verbose=False):
+    backend = asr_backend.load_backend(backend_name, model_size=model_size, preset=preset)
+    batcher = asr_batcher.BatchingTranscriber(backend, window_ms=window_ms, max_batch_size=batch_size)
+    batcher.start()
+
+    # 预热一次，避免首次推理的初始化开销计入结果
+    batcher.transcribe(samples[0][1][:SAMPLE_RATE * 5])
+
+    def timed_transcribe(audio):
+        started = time.perf_counter()
+        text = batcher.transcribe(audio)
+        return text, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_transcribe, [audio for _, audio, _ in samples]))
+    elapsed = time.perf_counter() - started
+    batch_stats = batcher.stats()
+    batcher.stop()
+
+    audio_seconds = sum(len(audio) for _, audio, _ in samples) / SAMPLE_RATE
+    errors = 0
+    reference_chars = 0
+    for (name, _, reference), (hypothesis, _) in zip(samples, results):
+        reference = normalize_text(reference)
+        hypothesis = normalize_text(hypothesis)
+        errors += edit_distance(reference, hypothesis)
+        reference_chars += len(reference)
+        if verbose:
+            print(f"  {name}: {hypothesis}")
+
+    latencies = sorted(latency for _, latency in results)
+    return {
+        "mode": f"{backend_name}:{model_size}:{preset}",
+        "rtf": elapsed / audio_seconds if audio_seconds else 0.0,
+        "cer": errors / reference_chars if reference_chars else 0.0,
+        "audio_seconds": audio_seconds,
+        "elapsed_seconds": elapsed,
+        # 预热的一条不计入
+        "avg_batch_size": (batch_stats["completed"] - 1) / max(batch_stats["batches"] - 1, 1),
+        "latency_p50": latency_stats.percentile(latencies, 0.50),
+        "latency_p99": latency_stats.percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语音识别后端基准测试")
+    parser.add_argument("manifest", nargs="?", help="参考集 JSON 清单路径")
+    parser.add_argument("--export", metavar="DIR", help="从数据库导出最近的回答录音和转写文本到 DIR，生成待校对的参考集")
+    parser.add_argument("--limit", type=int, default=50, help="导出的回答数")
+    parser.add_argument("--modes", nargs="+", type=parse_mode,
+                        default=[("whisper", "base", "greedy"), ("whisper-int8", "base", "greedy")],
+                        help="待测试的配置，格式 backend:model:preset")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时提交转写的线程数，模拟同时作答的候选人数")
+    parser.add_argument("--window-ms", type=float, default=50, help="批处理时间窗口（毫秒），同 ASR_BATCH_WINDOW_MS")
+    parser.add_argument("--batch-size", type=int, default=8, help="单批最多音频数，同 ASR_BATCH_SIZE")
+    parser.add_argument("--threads", type=int, default=None, help="torch 计算线程数")
+    parser.add_argument("--verbose", action="store_true", help="打印每条音频的识别结果")
+    args = parser.parse_args()
+
+    if args.export:
+        count = export_reference_set(args.export, args.limit)
+        print(f"已导出 {count} 条回答到 {args.export}，请人工校对 manifest.json 中的文本后再用于基准测试")
+        return
+    if not args.manifest:
+        parser.error("需要参考集清单路径，或使用 --export 导出参考集")
+
+    asr_backend.configure_threads(args.threads)
+    samples = load_reference_set(args.manifest)
+    print(f"参考集: {len(samples)} 条音频，torch 线程数: {torch.get_num_threads()}")
+
+    print(f"并发数: {args.concurrency}，批处理窗口: {args.window_ms} 毫秒，单批最多: {args.batch_size} 条")
+
+    results = []
+    for backend_name, model_size, preset in args.modes:
+        results.append(run_mode(samples, backend_name, model_size, preset, args.concurrency,
+                                args.window_ms, args.batch_size, args.verbose))
+
+    print(f"\n{'配置':<32}{'RTF':>8}{'CER':>8}{'音频(秒)':>10}{'耗时(秒)':>10}{'平均批大小':>10}{'p50(毫秒)':>10}{'p99(毫秒)':>10}")
+    for result in results:
+        print(f"{result['mode']:<32}{result['rtf']:>8.3f}{result['cer']:>8.3f}"
+              f"{result['audio_seconds']:>10.1f}{result['elapsed_seconds']:>10.1f}{result['avg_batch_size']:>10.2f}"
+              f"{result['latency_p50'] * 1000:>10.0f}{result['latency_p99'] * 1000:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sqlite3
+
+import db
+
+
+if not hasattr(sqlite3.Connection, 'blobopen'):
+    raise RuntimeError("分块读取 BLOB 需要 Python 3.11 及以上版本（sqlite3.Connection.blobopen）")
+
+
+CHUNK_SIZE = int(os.getenv("BLOB_CHUNK_SIZE", str(64 * 1024)))
+
+
+class BlobReader:
+    """
+    分块读取数据库中的一个 BLOB 字段，不把整个文件读入内存
+
+    使用独立的数据库连接并开启读事务，读取长度和之后的每个分块都来自同一个快照，
+    下载过程中报告被重新生成也不会读到前后不一致的内容。
+    使用 SQLite 增量 BLOB I/O（Connection.blobopen，需要 Python 3.11+）。substr() 每次调用都会把整个 BLOB
+    读入内存，不能用来分段读取。
+
+    用法：
+        reader = BlobReader('interviews', 'report_content', interview_id)
+        if reader.length is None: ...  # 记录不存在或字段为空
+        for chunk in reader.iter_range(start, end): ...
+        reader.close()
+
+    Args:
+        table: 表名，必须是 INTEGER PRIMARY KEY 表，id 即 rowid
+        column: BLOB 字段名
+        rowid: 记录 id
+        chunk_size: 每次读取的字节数
+        info_columns: 与 BLOB 长度在同一快照中读取的其他字段（如 revision），保存在 info 中
+    """
+
+    def __init__(self, table, column, rowid, chunk_size=CHUNK_SIZE, info_columns=()):
+        self.table = table
+        self.column = column
+        self.rowid = rowid
+        self.chunk_size = chunk_size
+        self._conn = db.connect()
+        self._conn.execute('BEGIN')
+        # length() 只读取记录头中的长度，不会加载 BLOB 内容
+        select = ', '.join((f'length({column}) AS length',) + tuple(info_columns))
+        row = self._conn.execute(f'SELECT {select} FROM {table} WHERE id = ?', (rowid,)).fetchone()
+        self.length = row['length'] if row and row['length'] else None
+        self.info = dict(row) if row else {}
+
+    def iter_range(self, start, end):
+        """按块返回 [start, end) 范围内的数据"""
+        with self._conn.blobopen(self.table, self.column, self.rowid, readonly=True) as blob:
+            blob.seek(start)
+            while start < end:
+                chunk = blob.read(min(self.chunk_size, end - start))
+                if not chunk:
+                    break
+                start += len(chunk)
+                yield chunk
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,117 @@
+"""
+候选人端面试接口的 ASGI 版本
+
+面试过程中候选人端请求的大部分时间花在接收录音上传和等待转写上，同步 worker 在此期间一直被占用。
+这里用 Starlette 异步实现 info、get_question、submit_answer、toggle_voice_reading 四个接口：
+上传在事件循环中异步接收，数据库读写和转写入队放到线程中执行，一个进程即可同时接收数百个慢速上传。
+处理逻辑与返回的 JSON 和 server.py 中的 Flask 路由相同，其余接口（管理端、分片上传、静态页面）仍由
+Flask 应用处理，挂载在同一个进程中。
+
+运行：python candidate_api.py，或 gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker candidate_api:app
+"""
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import server
+
+
+def _interview_info(token):
+    session = server.sessions.get(token)
+    return server.interview_info_result(session) if session else None
+
+
+def _next_question(token, current_question_id):
+    interview = server.sessions.get(token)
+    if not interview:
+        return None
+    return server.next_question(server.get_db(), interview['id'], current_question_id)
+
+
+def _submit_answer(token, question_id, audio_data):
+    interview = server.sessions.get(token)
+    if not interview:
+        return {"error": "面试不存在"}, 404
+    return server.submit_answer_audio(server.get_db(), interview['id'], question_id, audio_data)
+
+
+def _set_voice_reading(token, enabled):
+    return server.set_voice_reading(server.get_db(), token, enabled)
+
+
+def _json_response(content, status_code=200):
+    # 接口按 token 返回该面试自己的数据，与 server.py 中的 Flask 路由一样只允许浏览器缓存
+    return JSONResponse(content, status_code=status_code, headers={'Cache-Control': server.PRIVATE_CACHE_CONTROL})
+
+
+# API: 获取面试信息
+async def get_interview_info(request):
+    result = await asyncio.to_thread(_interview_info, request.path_params['token'])
+    if result is None:
+        return _json_response({"error": "面试不存在"}, status_code=404)
+    return _json_response(result)
+
+
+# API: 获取下一个问题
+async def get_next_question(request):
+    try:
+        current_question_id = int(request.query_params.get('current_id', 0))
+    except ValueError:
+        current_question_id = 0
+
+    result = await asyncio.to_thread(_next_question, request.path_params['token'], current_question_id)
+    if result is None:
+        return _json_response({"id": 0, "text": "面试无效"}, status_code=404)
+    return _json_response(result)
+
+
+# API: 提交答案
+async def submit_answer(request):
+    # 上传在事件循环中异步接收，慢速客户端不占用线程
+    async with request.form() as form:
+        question_id = form.get('question_id')
+        audio_answer = form.get('audio_answer')
+        if not question_id or audio_answer is None or isinstance(audio_answer, str):
+            return _json_response({"error": "缺少必要参数"}, status_code=400)
+        audio_data = await audio_answer.read()
+
+    # 保存音频和转写入队可能等待磁盘和队列，在线程中执行
+    result, status = await asyncio.to_thread(_submit_answer, request.path_params['token'], question_id, audio_data)
+    return _json_response(result, status_code=status)
+
+
+# API: 切换语音朗读
+async def toggle_voice_reading(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return _json_response({"error": "请求格式错误"}, status_code=400)
+    enabled = data.get('enabled', False)
+
+    result = await asyncio.to_thread(_set_voice_reading, request.path_params['token'], enabled)
+    return _json_response(result)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/interview/{token}/info', get_interview_info, methods=['GET']),
+        Route('/api/interview/{token}/get_question', get_next_question, methods=['GET']),
+        Route('/api/interview/{token}/submit_answer', submit_answer, methods=['POST']),
+        Route('/api/interview/{token}/toggle_voice_reading', toggle_voice_reading, methods=['POST']),
+        # 其余接口交给 Flask 应用
+        Mount('/', app=WSGIMiddleware(server.app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    server.start_background_services()
+    uvicorn.run(app, host='0.0.0.0', port=8000)
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# 数据库配置，server.py 和两个后台任务脚本共用
+DB_PATH = os.getenv("DB_PATH", "interview_system.db")
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+_local = threading.local()
+
+
+def connect(path=None):
+    """
+    新建一个数据库连接并设置 PRAGMA
+
+    - WAL 日志模式：读写互不阻塞，三个进程可以同时访问同一个数据库文件
+    - busy_timeout：遇到写锁时等待而不是立即报 database is locked
+    - synchronous=NORMAL：WAL 模式下仍能保证数据库一致性，写入时少一次 fsync
+    - cache_size / mmap_size：增大页缓存，读取走内存映射
+
+    连接工作在自动提交模式下，单条语句即一个事务；多条写语句需放在 transaction() 中。
+    """
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def get_connection():
+    """
+    返回当前线程复用的数据库连接
+
+    每个线程只建立一次连接，调用方不需要也不应该关闭它。
+    进程 fork 之后会重新建立连接，不与父进程共用。
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def close_connection():
+    """关闭当前线程的连接；fork 子进程前在父进程中调用，子进程不会继承打开的连接"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """
+    短写事务：BEGIN IMMEDIATE 一开始就获取写锁，避免读事务升级为写事务时死锁
+
+    用法：
+        with db.transaction() as conn:
+            conn.execute(...)
+            conn.execute(...)
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        # 已在事务中（嵌套调用），由外层负责提交
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,51 @@
+import json
+
+import queries
+
+
+def parse_score(value):
+    """大模型返回的分数可能是数字或字符串，无法解析时返回 None"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def save(conn, interview_id, candidate_id, position_id, evaluation_result):
+    """保存评估结果 JSON 及各项分数，重新生成报告时覆盖旧结果"""
+    evaluation_result = evaluation_result or {}
+    conn.execute('''
+        INSERT OR REPLACE INTO evaluations (
+            interview_id, candidate_id, position_id,
+            technical_score, communication_score, overall_score, recommendation,
+            evaluation, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, strftime('%s', 'now'))
+    ''', (
+        interview_id, candidate_id, position_id,
+        parse_score(evaluation_result.get('technical_score')),
+        parse_score(evaluation_result.get('communication_score')),
+        parse_score(evaluation_result.get('overall_score')),
+        evaluation_result.get('recommendation'),
+        json.dumps(evaluation_result, ensure_ascii=False),
+    ))
+
+
+def ranking(conn, position_id, limit):
+    """
+    按综合评分从高到低返回岗位的前 limit 名候选人
+
+    沿 (position_id, overall_score) 索引顺序读取，同一候选人有多场面试时只取评分最高的一场，
+    凑够 limit 名后立即停止，不需要排序整个岗位的评估结果。
+    """
+    items = []
+    seen = set()
+    for row in conn.execute(queries.POSITION_RANKING, (position_id,)):
+        if row['candidate_id'] in seen:
+            continue
+        seen.add(row['candidate_id'])
+        item = dict(row)
+        item['rank'] = len(items) + 1
+        items.append(item)
+        if len(items) >= limit:
+            break
+    return items
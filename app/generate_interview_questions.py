@@ -1,77 +1,69 @@
-import sqlite3
+import asyncio
 import time
 import schedule
 import threading
 import json
-import io
 from datetime import datetime
-from openai import OpenAI
-import PyPDF2
 from dotenv import load_dotenv
 import os
+import db
+import job_queue
+import migrations
+import llm_client
+import resume_text
+import question_bank
+import interview_state
 
 # 加载环境变量
 load_dotenv()
 
-# 初始化OpenAI客户端
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_BASE_URL")
-)
+# 初始化大模型客户端：异步调用，限制并发数和速率，失败自动重试
+llm = llm_client.create_client_from_env()
+
+# 升级前上传、或上传后未能提取的简历在进程池中补提取，受同样的超时限制；在 main 中启动
+resume_extractor = resume_text.create_extractor_from_env()
+
+# 提示词版本：修改下面的提示词或题目数量时加一，已缓存的试题和题库随之失效
+PROMPT_VERSION = 2
+
+# 每场面试的题目 = 从岗位通用题库抽取的题目 + 针对简历单独生成的题目
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", "10"))
+QUESTION_BANK_PICK = int(os.getenv("QUESTION_BANK_PICK", "4"))
+RESUME_QUESTION_COUNT = int(os.getenv("RESUME_QUESTION_COUNT", "6"))
+
+# 流式生成：每解析出一道完整的题目就写入数据库，第一题写入后候选人即可开始面试
+QUESTION_STREAMING = os.getenv("QUESTION_STREAMING", "1") == "1"
+
+# 返回json格式参考
+JSON_FORMAT = {"questions": [
+     {"question": "请介绍一下你的专业背景和技能", "score_standard": "清晰度5分，相关性5分，深度5分"},
+     {"question": "你认为自己最适合这个岗位的原因是什么？", "score_standard": "匹配度5分，自我认知5分，表达5分"},
+     {"question": "描述一个你解决过的技术挑战", "score_standard": "复杂度5分，解决方案5分，结果5分"},
+     {"question": "你如何看待团队合作？", "score_standard": "协作能力5分，沟通能力5分，角色意识5分"},
+     {"question": "你对这个行业的未来趋势有什么看法？", "score_standard": "了解程度5分，前瞻性5分，分析能力5分"}
+]}
+
+# 同一岗位的题库只生成一次，并发的任务等待第一个生成完成
+bank_locks = {}
     
-# 从PDF二进制数据中提取文本内容
-def extract_text_from_pdf(pdf_content):
-    try:
-        # 如果输入是None或空值，返回空字符串
-        if pdf_content is None or pdf_content == b'':
-            return "无简历内容"
-            
-        # 创建BytesIO对象处理二进制数据
-        pdf_file = io.BytesIO(pdf_content)
-        
-        # 创建PDF阅读器
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        # 提取所有页面的文本
-        text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n"
-        
-        # 如果没有提取到文本，尝试使用另一种方法
-        if not text.strip():
-            return "无法从PDF中提取文本内容"
-            
-        return text
-    except Exception as e:
-        print(f"PDF文本提取错误: {str(e)}")
-        # 如果pdf解析失败，尝试作为纯文本处理
-        try:
-            if isinstance(pdf_content, bytes):
-                return pdf_content.decode('utf-8', errors='ignore')
-            return str(pdf_content)
-        except:
-            return "无法解析简历内容"
-
-# 连接到SQLite数据库
+# 当前线程复用的数据库连接
 def get_db_connection():
-    return sqlite3.connect('interview_system.db')
+    return db.get_connection()
 
-# 获取未开始的面试列表
-def get_pending_interviews():
+# 获取面试信息
+def get_interview(interview_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # 获取所有状态为0(未开始)的面试
     cursor.execute('''
-        SELECT i.id, i.candidate_id, i.interviewer, i.start_time
+        SELECT i.id, i.candidate_id, i.interviewer, i.start_time, i.status, i.questions_complete,
+               (SELECT COUNT(*) FROM interview_questions q WHERE q.interview_id = i.id) AS question_count
         FROM interviews i
-        WHERE i.status = 0
-    ''')
+        WHERE i.id = ?
+    ''', (interview_id,))
     
-    interviews = cursor.fetchall()
-    conn.close()
-    return interviews
+    interview = cursor.fetchone()
+    return interview
 
 # 获取候选人信息
 def get_candidate_info(candidate_id):
@@ -79,13 +71,12 @@ def get_candidate_info(candidate_id):
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT c.id, c.name, c.email, c.resume_content, c.position_id
+        SELECT c.id, c.name, c.email, c.position_id
         FROM candidates c
         WHERE c.id = ?
     ''', (candidate_id,))
     
     candidate = cursor.fetchone()
-    conn.close()
     return candidate
 
 # 获取岗位信息
@@ -94,127 +85,257 @@ def get_position_info(position_id):
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT p.id, p.name, p.requirements, p.responsibilities
+        SELECT p.id, p.name, p.requirements, p.responsibilities, p.revision
         FROM positions p
         WHERE p.id = ?
     ''', (position_id,))
     
     position = cursor.fetchone()
-    conn.close()
     return position
 
-# 根据简历内容和岗位信息生成面试问题
-def generate_questions(resume_content, position_name, requirements, responsibilities):
-    # 解析简历内容 : 抽取pdf中resume_content的文本内容
+# 大模型返回的 JSON 对象中取出题目列表
+def parse_questions(result):
+    if isinstance(result, dict):
+        result = next((value for value in result.values() if isinstance(value, list)), [])
+    return [q for q in result if isinstance(q, dict) and q.get('question') and q.get('score_standard')]
+
+# 调用大模型生成题目，限流和重试由 llm 处理；重试仍失败时抛出，由任务队列稍后重新执行
+async def ask_questions(system_prompt, user_prompt):
     try:
-        resume_text = extract_text_from_pdf(resume_content)
-    except:
-        resume_text = "无法解析简历内容"
-    
-    print("resume_text:", resume_text)
-
-    # 返回json格式参考
-    json_format = [
-         {"question": "请介绍一下你的专业背景和技能", "score_standard": "清晰度5分，相关性5分，深度5分"},
-         {"question": "你认为自己最适合这个岗位的原因是什么？", "score_standard": "匹配度5分，自我认知5分，表达5分"},
-         {"question": "描述一个你解决过的技术挑战", "score_standard": "复杂度5分，解决方案5分，结果5分"},
-         {"question": "你如何看待团队合作？", "score_standard": "协作能力5分，沟通能力5分，角色意识5分"},
-         {"question": "你对这个行业的未来趋势有什么看法？", "score_standard": "了解程度5分，前瞻性5分，分析能力5分"}
-    ]
-    # 调用OpenAI API生成面试问题
+        result = await llm.chat_json(
+            #"gpt-4", # 或其他适合的模型
+            "qwen-turbo",
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+        )
+    except Exception as e:
+        print(f"生成面试问题时出错: {str(e)}")
+        raise
+    questions = parse_questions(result)
+    print("questions:", questions)
+    return questions
+
+# 根据岗位信息生成通用题库，不涉及简历，同一岗位的所有候选人共用
+async def generate_bank_questions(position_name, requirements, responsibilities):
+    return await ask_questions(
+        "你是一名专业的招聘面试官，请根据岗位要求生成考察该岗位通用能力的技术面试问题，每个问题附带评分标准,返回标准的json格式。",
+        f"岗位名称: {position_name}\n岗位要求: {requirements}\n岗位职责: {responsibilities}\n\n请生成{QUESTION_BANK_SIZE}个面试问题和评分标准，JSON格式参考 {JSON_FORMAT} ，每个问题满分10分。"
+    )
+
+# 针对候选人经历出题的提示词
+def resume_prompts(context, count):
+    return (
+        "你是一名专业的招聘面试官，请根据岗位要求和候选人简历生成针对候选人经历的技术面试问题，每个问题附带评分标准,返回标准的json格式。",
+        f"岗位名称: {context['position_name']}\n岗位要求: {context['requirements']}\n岗位职责: {context['responsibilities']}\n候选人简历: {context['resume']}\n\n请生成{count}个面试问题和评分标准，JSON格式参考 {JSON_FORMAT} ，每个问题满分10分。"
+    )
+
+# 根据简历内容和岗位信息生成针对候选人经历的面试问题
+async def generate_questions(context, count):
+    print("resume_text:", context['resume'])
+    return (await ask_questions(*resume_prompts(context, count)))[:count]
+
+# 流式生成针对简历的面试问题，每解析出一道完整的题目就返回
+async def stream_questions(context, count):
+    print("resume_text:", context['resume'])
+    system_prompt, user_prompt = resume_prompts(context, count)
+    produced = 0
     try:
-        response = client.chat.completions.create(
-            #model="gpt-4", # 或其他适合的模型
-            model="qwen-turbo",
-            messages=[
-                {"role": "system", "content": "你是一名专业的招聘面试官，请根据岗位要求和候选人简历生成5个针对性的技术面试问题，每个问题附带评分标准,返回标准的json格式。"},
-                {"role": "user", "content": f"岗位名称: {position_name}\n岗位要求: {requirements}\n岗位职责: {responsibilities}\n候选人简历: {resume_text}\n\n请生成10个面试问题和评分标准，JSON格式参考 {json_format} ，每个问题满分10分。"}
+        async for question in llm.chat_json_stream(
+            "qwen-turbo",
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
             ],
-            response_format={"type": "json_object"},
-            stream = False
+            required_keys=("question", "score_standard")
+        ):
+            print("question:", question)
+            yield question
+            produced += 1
+            if produced >= count:
+                return
+    except Exception as e:
+        print(f"生成面试问题时出错: {str(e)}")
+        raise
+
+# 读取岗位题库，没有或岗位已修改时生成并保存
+async def get_position_bank(context):
+    position_id = context['position_id']
+    lock = bank_locks.setdefault(position_id, asyncio.Lock())
+    async with lock:
+        bank = await asyncio.to_thread(
+            lambda: question_bank.get_bank(get_db_connection(), position_id, context['position_revision'], PROMPT_VERSION)
         )
+        if bank:
+            return bank
+        print(f"为岗位ID: {position_id} 生成通用题库")
+        bank = await generate_bank_questions(context['position_name'], context['requirements'], context['responsibilities'])
+        if bank:
+            await asyncio.to_thread(
+                lambda: question_bank.save_bank(get_db_connection(), position_id, context['position_revision'], PROMPT_VERSION, bank)
+            )
+        return bank
+
+# 同时执行多个协程，其中一个失败时取消其余的，避免任务失败后仍在写入题目
+async def run_all(*coroutines):
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+# 组合一场面试的试题并写入数据库，返回写入的题目：岗位和简历都没变时直接复用上次的结果，
+# 否则从题库抽取通用题，再调用大模型只生成针对简历的题目
+async def build_questions(context):
+    interview_id = context['interview_id']
+    key = question_bank.cache_key(context['position_id'], context['position_revision'], context['resume'], PROMPT_VERSION)
+    questions = await asyncio.to_thread(lambda: question_bank.get_cached(get_db_connection(), key))
+    if questions:
+        print(f"面试ID: {interview_id} 命中试题缓存")
+        await asyncio.to_thread(save_questions, interview_id, questions, True)
+        return questions
+
+    if not QUESTION_STREAMING:
+        bank, resume_questions = await run_all(get_position_bank(context), generate_questions(context, RESUME_QUESTION_COUNT))
+        questions = question_bank.pick(bank, QUESTION_BANK_PICK) + resume_questions
+        if not questions:
+            raise RuntimeError("大模型未返回面试问题")
+        await asyncio.to_thread(save_questions, interview_id, questions, True)
+    else:
+        # 题库中抽取的通用题和流式生成的题目谁先就绪谁先写入
+        questions = []
         
-        # 解析响应内容
-        questions_json = response.choices[0].message.content
-        questions = json.loads(questions_json)
-        print("questions:", questions)
+        async def add(batch):
+            if batch and await asyncio.to_thread(save_questions, interview_id, batch):
+                questions.extend(batch)
         
-        return questions
+        async def add_bank_questions():
+            await add(question_bank.pick(await get_position_bank(context), QUESTION_BANK_PICK))
+        
+        async def add_resume_questions():
+            async for question in stream_questions(context, RESUME_QUESTION_COUNT):
+                await add([question])
+        
+        await run_all(add_bank_questions(), add_resume_questions())
+        if not questions:
+            raise RuntimeError("大模型未返回面试问题")
+        await asyncio.to_thread(save_questions, interview_id, [], True)
 
-    except Exception as e:
-        print(f"生成面试问题时出错: {str(e)}")
- 
+    await asyncio.to_thread(
+        lambda: question_bank.save_cached(get_db_connection(), key, context['position_id'], context['position_revision'], questions)
+    )
+    return questions
 
-# 将生成的问题保存到数据库
-def save_questions(interview_id, questions):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for question in questions:
-        # 将score_standard转换为JSON字符串(如果是字典类型)
-        score_standard = question['score_standard']
-        if isinstance(score_standard, dict):
-            score_standard = json.dumps(score_standard, ensure_ascii=False)
-            
+# 上次执行中途失败时，已写入的题目可能已被作答，保留它们只补齐剩余的题目
+async def complete_questions(context):
+    count = QUESTION_BANK_PICK + RESUME_QUESTION_COUNT - context['question_count']
+    questions = await generate_questions(context, count) if count > 0 else []
+    await asyncio.to_thread(save_questions, context['interview_id'], questions, True)
+    return questions
+
+# 将生成的问题保存到数据库，complete 为 True 时标记试题已全部生成；
+# 面试已不在生成试题阶段（已生成完毕、已结束或已删除）时不保存并返回 False
+def save_questions(interview_id, questions, complete=False):
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        
+        # 写入第一批题目时面试状态更新为"试题已备好"(1)，候选人即可开始作答
         cursor.execute('''
-            INSERT INTO interview_questions (interview_id, question, score_standard)
-            VALUES (?, ?, ?)
-        ''', (interview_id, question['question'], score_standard))
+            UPDATE interviews
+            SET status = CASE WHEN status = 0 THEN 1 ELSE status END,
+                question_count = (SELECT COUNT(*) FROM interview_questions WHERE interview_id = ?) + ?,
+                questions_complete = ?,
+                revision = revision + 1, updated_at = strftime('%s', 'now')
+            WHERE id = ? AND (status = 0 OR (status IN (1, 2) AND questions_complete = 0))
+        ''', (interview_id, len(questions), 1 if complete else 0, interview_id))
+        if cursor.rowcount == 0:
+            return False
+        
+        for question in questions:
+            # 将score_standard转换为JSON字符串(如果是字典类型)
+            score_standard = question['score_standard']
+            if isinstance(score_standard, dict):
+                score_standard = json.dumps(score_standard, ensure_ascii=False)
+                
+            cursor.execute('''
+                INSERT INTO interview_questions (interview_id, question, score_standard)
+                VALUES (?, ?, ?)
+            ''', (interview_id, question['question'], score_standard))
+        
+        # 候选人可能已答完先生成的题目，全部生成后检查面试是否已完成
+        if complete:
+            interview_state.finalize_if_complete(conn, interview_id)
+        return True
+
+# 读取生成试题所需的面试、候选人和岗位信息，无需生成时返回 None
+def load_interview_context(interview_id):
+    interview = get_interview(interview_id)
+    if not interview or not (interview['status'] == 0 or (interview['status'] in (1, 2) and not interview['questions_complete'])):
+        print(f"面试ID: {interview_id} 不存在或试题已生成完毕，跳过")
+        return None
     
-    # 更新面试状态为"试题已备好"(1)
-    cursor.execute('''
-        UPDATE interviews SET status = 1 , question_count = ? WHERE id = ?
-    ''', (len(questions), interview_id))
+    interview_id, candidate_id, interviewer, start_time, status, questions_complete, question_count = interview
     
-    conn.commit()
-    conn.close()
-
-# 主处理函数
-def process_pending_interviews():
-    print(f"[{datetime.now()}] 开始处理未开始的面试...")
+    # 获取候选人信息
+    candidate = get_candidate_info(candidate_id)
+    if not candidate:
+        print(f"无法找到候选人ID: {candidate_id}的信息")
+        return None
     
-    # 获取所有未开始的面试
-    pending_interviews = get_pending_interviews()
+    candidate_id, candidate_name, candidate_email, position_id = candidate
     
-    if not pending_interviews:
-        print("没有未开始的面试需要处理")
+    # 简历文本在上传时已提取；升级前的简历在这里提取一次并保存
+    resume = resume_text.get_or_extract(get_db_connection(), candidate_id, resume_extractor) or "无简历内容"
+    
+    # 获取岗位信息
+    position = get_position_info(position_id)
+    if not position:
+        print(f"无法找到岗位ID: {position_id}的信息")
+        return None
+    
+    position_id, position_name, requirements, responsibilities, position_revision = position
+    return {
+        'interview_id': interview_id,
+        'question_count': question_count,
+        'candidate_name': candidate_name,
+        'resume': resume,
+        'position_id': position_id,
+        'position_revision': position_revision,
+        'position_name': position_name,
+        'requirements': requirements,
+        'responsibilities': responsibilities,
+    }
+
+# 处理一个生成试题任务，抛出异常时任务稍后重试；多个任务并发执行，题目生成后立即保存
+async def process_interview(job):
+    interview_id = job['interview_id']
+    
+    # 数据库读写放在线程中执行，不阻塞其他任务
+    context = await asyncio.to_thread(load_interview_context, interview_id)
+    if context is None:
         return
     
-    print(f"找到 {len(pending_interviews)} 个待处理的面试")
+    print(f"为面试ID: {interview_id}, 候选人: {context['candidate_name']}, 岗位: {context['position_name']} 生成面试问题")
     
-    for interview in pending_interviews:
-        interview_id, candidate_id, interviewer, start_time = interview
-        
-        # 获取候选人信息
-        candidate = get_candidate_info(candidate_id)
-        if not candidate:
-            print(f"无法找到候选人ID: {candidate_id}的信息")
-            continue
-        
-        candidate_id, candidate_name, candidate_email, resume_content, position_id = candidate
-        
-        # 获取岗位信息
-        position = get_position_info(position_id)
-        if not position:
-            print(f"无法找到岗位ID: {position_id}的信息")
-            continue
-        
-        position_id, position_name, requirements, responsibilities = position
-        
-        print(f"为面试ID: {interview_id}, 候选人: {candidate_name}, 岗位: {position_name} 生成面试问题")
-        
-        # 生成面试问题
-        questions = generate_questions(resume_content, position_name, requirements, responsibilities)
-        
-        # 保存问题到数据库
-        save_questions(interview_id, questions)
+    # 生成面试问题并保存到数据库
+    if context['question_count']:
+        questions = await complete_questions(context)
+    else:
+        questions = await build_questions(context)
+    print(f"已为面试ID: {interview_id} 成功生成 {len(questions)} 个问题")
 
-        
-        print(f"已为面试ID: {interview_id} 成功生成 {len(questions)} 个问题")
+# 为未开始但没有任务的面试补写任务（升级前的数据或直接修改数据库的情况）
+def enqueue_pending_interviews():
+    count = job_queue.enqueue_missing(get_db_connection(), job_queue.KIND_QUESTIONS, 0)
+    if count:
+        print(f"[{datetime.now()}] 补写了 {count} 个生成试题任务")
 
-# 定时任务
+# 定时任务：每5分钟检查一次遗漏的面试
 def run_scheduler():
-    schedule.every(5).minutes.do(process_pending_interviews)
+    schedule.every(5).minutes.do(enqueue_pending_interviews)
     
     while True:
         schedule.run_pending()
@@ -223,19 +344,23 @@ def run_scheduler():
 # 主函数
 if __name__ == "__main__":
   
-    # 立即运行一次，然后启动定时任务
-    process_pending_interviews()
+    # 确保任务表已创建，立即补写一次遗漏的任务，然后启动定时检查
+    migrations.migrate()
+    enqueue_pending_interviews()
+    
+    # 在启动其他线程之前创建简历提取子进程
+    resume_extractor.start()
     
     # 在后台线程中运行定时任务
     scheduler_thread = threading.Thread(target=run_scheduler)
     scheduler_thread.daemon = True
     scheduler_thread.start()
     
-    print("面试问题生成定时任务已启动，每5分钟执行一次")
+    # server.py 创建面试时写入任务，本进程在一秒内领取执行，同时最多执行 JOB_CONCURRENCY 个；可同时运行多个进程
+    worker = job_queue.create_worker_from_env(job_queue.KIND_QUESTIONS, process_interview, use_async=True)
+    print("面试问题生成任务进程已启动")
     
     try:
-        # 保持主线程运行
-        while True:
-            time.sleep(60)
+        worker.run_forever()
     except KeyboardInterrupt:
         print("程序已停止") 
\ No newline at end of file
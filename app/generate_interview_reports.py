@@ -1,85 +1,136 @@
-import sqlite3
+import asyncio
 import time
+import threading
 import schedule
-from jinja2 import Environment
-from weasyprint import HTML
-import json
 from datetime import datetime
-from openai import OpenAI
 from dotenv import load_dotenv
-import os
+import db
+import job_queue
+import migrations
+import queries
+import llm_client
+import report_renderer
+import evaluations
 
 
 
 # 加载环境变量
 load_dotenv()
 
-# 初始化OpenAI客户端
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_BASE_URL")
-)
+# Async LLM client: bounded concurrency, rate limiting and retry with backoff
+llm = llm_client.create_client_from_env()
+
+# Warm pool of PDF rendering processes, started in main
+renderer = report_renderer.create_renderer_from_env()
+
+# How long a report waits before checking again whether its answers are scored
+SCORE_WAIT_SECONDS = 5
    
 
-def fetch_interviews_with_status_3():
-    """Fetch all interviews with status = 3 (interview completed)"""
-    conn = sqlite3.connect('interview_system.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT * FROM interviews WHERE status = 3
-    ''')
-    
-    interviews = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return interviews
+def fetch_report_data(interview_id):
+    """
+    Load the text fields a report needs with two indexed queries
 
-def fetch_candidate_info(candidate_id):
-    """Fetch candidate information by candidate_id"""
-    conn = sqlite3.connect('interview_system.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    Only the columns used by the prompt are projected, so resume, report and
+    answer audio BLOBs are never read. Returns (interview, questions), where
+    interview is None if it does not exist.
+    """
+    conn = db.get_connection()
     
-    cursor.execute('''
-    SELECT * FROM candidates WHERE id = ?
-    ''', (candidate_id,))
+    # Interview, candidate name and position name in one joined lookup;
+    # LEFT JOIN so a missing candidate or position can still be reported
+    row = conn.execute('''
+    SELECT i.id, i.interviewer, i.status, i.candidate_id,
+           c.name AS candidate_name, c.position_id, p.name AS position_name
+    FROM interviews i
+    LEFT JOIN candidates c ON c.id = i.candidate_id
+    LEFT JOIN positions p ON p.id = c.position_id
+    WHERE i.id = ?
+    ''', (interview_id,)).fetchone()
+    if row is None:
+        return None, []
     
-    row = cursor.fetchone()
-    candidate = dict(row) if row else None
-    conn.close()
-    return candidate
+    questions = [dict(q) for q in conn.execute(queries.REPORT_QUESTIONS, (interview_id,))]
+    return dict(row), questions
 
-def fetch_position_info(position_id):
-    """Fetch position information by position_id"""
-    conn = sqlite3.connect('interview_system.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT * FROM positions WHERE id = ?
-    ''', (position_id,))
-    
-    row = cursor.fetchone()
-    position = dict(row) if row else None
-    conn.close()
-    return position
+def fetch_answer(interview_id, question_id):
+    """Load one question and its answer for scoring"""
+    conn = db.get_connection()
+    row = conn.execute('''
+    SELECT id, question, score_standard, answer_text, score
+    FROM interview_questions WHERE id = ? AND interview_id = ?
+    ''', (question_id, interview_id)).fetchone()
+    return dict(row) if row else None
 
-def fetch_interview_questions(interview_id):
-    """Fetch all questions and answers for a specific interview"""
-    conn = sqlite3.connect('interview_system.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT * FROM interview_questions WHERE interview_id = ?
-    ''', (interview_id,))
+def save_answer_score(question, result):
+    """
+    Store the score of one answer
+
+    The answer_text check skips the write if the candidate re-recorded the
+    answer while it was being scored; re-recording marks the running score
+    job for a rerun, so the newer answer is scored when this job finishes.
+    """
+    conn = db.get_connection()
+    cursor = conn.execute('''
+    UPDATE interview_questions
+    SET score = ?, score_comments = ?, scored_at = strftime('%s', 'now')
+    WHERE id = ? AND answer_text IS ?
+    ''', (result['score'], result['comments'], question['id'], question['answer_text']))
+    return cursor.rowcount > 0
+
+async def evaluate_answer(question):
+    """
+    Score one answer against its score_standard
+
+    Each call only carries one question, its standard and the answer, so it
+    is small and can run as soon as the answer is transcribed.
+    """
+    if not question.get('answer_text'):
+        return {"score": 0, "comments": "未提供回答"}
     
-    questions = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return questions
+    prompt = f"""
+        请根据评分标准对候选人的回答评分，满分10分，并给出简短点评。
+        
+        问题: {question.get('question', '未提供问题')}
+        评分标准: {question.get('score_standard', '未提供评分标准')}
+        候选人回答: {question['answer_text']}
+        
+        请以JSON格式返回: {{"score": 7, "comments": "回答详细，展示了扎实的基础知识..."}}
+        """
+    try:
+        result = await llm.chat_json(
+            "qwen-turbo",
+            [
+                {"role": "system", "content": "你是一位专业的面试评估专家，负责评估技术面试表现。"},
+                {"role": "user", "content": prompt}
+            ]
+        )
+    except Exception as e:
+        print(f"调用AI模型时出错: {str(e)}")
+        raise
+    return {
+        "score": evaluations.parse_score(result.get('score')),
+        "comments": result.get('comments', ''),
+    }
+
+async def score_question(question):
+    """Score a question in place and save the result"""
+    result = await evaluate_answer(question)
+    if await asyncio.to_thread(save_answer_score, question, result):
+        question['score'] = result['score']
+        question['score_comments'] = result['comments']
+    return result
+
+async def score_answer(job):
+    """Score one answer as soon as it is saved; exceptions make the job retry later"""
+    question = await asyncio.to_thread(fetch_answer, job['interview_id'], job['question_id'])
+    if question is None or question['answer_text'] is None or question['score'] is not None:
+        # Deleted, re-recorded (the new answer has its own job) or already scored
+        return
+    result = await score_question(question)
+    print(f"Scored question ID {question['id']} of interview ID {job['interview_id']}: {result['score']}")
 
-def call_ai_model(candidate_name, position_name, interviewer, questions):
+async def call_ai_model(candidate_name, position_name, interviewer, questions):
         """
         调用OpenAI API生成面试报告
         
@@ -87,46 +138,44 @@ def call_ai_model(candidate_name, position_name, interviewer, questions):
             candidate_name: 候选人姓名
             position_name: 职位名称
             interviewer: 面试官姓名
-            questions: 面试问题列表，包含问题内容、评分标准和回答
+            questions: 面试问题列表，包含问题内容、评分标准、回答以及逐题评分和点评
             
         Returns:
             JSON格式的面试评估结果
+
+        Each answer has already been scored by its own job, so the prompt only
+        carries the per-question scores and comments and the model only writes
+        the summary. Raises once the retries in llm are used up, so the job is
+        retried later instead of saving an empty report.
         """
         # 构建发送给OpenAI的提示内容
         prompt = f"""
-        你是一位专业的面试评估专家，需要对候选人"{candidate_name}"应聘"{position_name}"职位的面试表现进行评估。
+        你是一位专业的面试评估专家，需要对候选人"{candidate_name}"应聘"{position_name}"职位的面试表现进行综合评价。
         面试官是{interviewer}。
         
-        请根据以下面试问题、评分标准和候选人的回答，对每个问题进行评分和点评，并给出综合评价
-        注意每个问题评分范围是0-100分，综合评分范围是0-100分
+        以下是每个问题的评分(满分10分)和点评，请据此给出综合评价，综合评分范围是0-100分
         
         """
         
-        # 添加每个问题的详细信息
+        # 添加每个问题的评分和点评
         for i, q in enumerate(questions, 1):
             prompt += f"""
         问题{i}: {q.get('question', '未提供问题')}
-        评分标准: {q.get('score_standard', '未提供评分标准')}
-        候选人回答: {q.get('answer_text', '未提供回答')}
+        评分: {q.get('score')}
+        点评: {q.get('score_comments') or ''}
         
         """
         
         prompt += """
         请以JSON格式返回评估结果，包含以下内容：
-        1. 每个问题的评分和评价
-        2. 技术能力总分(满分100)
-        3. 沟通能力总分(满分100)
-        4. 综合评分(满分100)
-        5. 面试官评语(综合评价候选人的优缺点)
-        6. 录用建议(推荐录用/可以考虑/不建议录用)
+        1. 技术能力总分(满分100)
+        2. 沟通能力总分(满分100)
+        3. 综合评分(满分100)
+        4. 面试官评语(综合评价候选人的优缺点)
+        5. 录用建议(推荐录用/可以考虑/不建议录用)
         
         JSON格式示例:
         {
-            "question_evaluations": [
-                {"id": 1, "question": "[question]", "score_standard": "[score_standard]", "answer": "[answer_text]", "score": 7, "comments": "回答详细，展示了扎实的基础知识..."},
-                {"id": 2, "question": "[question]", "score_standard": "[score_standard]", "answer": "[answer_text]", "score": 9, "comments": "思路清晰，解决方案合理..."}
-                ...
-            ],
             "technical_score": 88,
             "communication_score": 90,
             "overall_score": 89,
@@ -136,216 +185,163 @@ def call_ai_model(candidate_name, position_name, interviewer, questions):
         """
         
         try:
-            # 调用大模型 API
-            response = client.chat.completions.create(
-                model="qwen-turbo",
-                messages=[
+            # 调用大模型 API，返回解析后的JSON结果
+            evaluation_result = await llm.chat_json(
+                "qwen-turbo",
+                [
                     {"role": "system", "content": "你是一位专业的面试评估专家，负责评估技术面试表现。"},
                     {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                stream = False
+                ]
             )
-            
-            # 解析返回的JSON结果
-            result_text = response.choices[0].message.content
-            evaluation_result = json.loads(result_text)
-            
-            # Create model output similar to the example
-            model_output = {
-                "candidate_name": candidate_name,
-                "position": position_name,
-                "interview_date": datetime.now().strftime("%Y年%m月%d日"),
-                "interviewer": interviewer,
-                "evaluation_result": evaluation_result
-            }
-            
-            return model_output
-            
         except Exception as e:
             print(f"调用AI模型时出错: {str(e)}")
-            # 创建一个模拟的评估结果，以防API调用失败
-            # 返回模拟数据
-            model_output = {
-                "candidate_name": candidate_name,
-                "position": position_name,
-                "interview_date": datetime.now().strftime("%Y年%m月%d日"),
-                "interviewer": interviewer,
-                "evaluation_result": {}
+            raise
+        
+        # 逐题评估直接使用保存的评分结果
+        evaluation_result['question_evaluations'] = [
+            {
+                "id": i,
+                "question": q.get('question'),
+                "score_standard": q.get('score_standard'),
+                "answer": q.get('answer_text'),
+                "score": q.get('score'),
+                "comments": q.get('score_comments'),
             }
-            return model_output
+            for i, q in enumerate(questions, 1)
+        ]
+        
+        # Create model output similar to the example
+        model_output = {
+            "candidate_name": candidate_name,
+            "position": position_name,
+            "interview_date": datetime.now().strftime("%Y年%m月%d日"),
+            "interviewer": interviewer,
+            "evaluation_result": evaluation_result
+        }
+        
+        return model_output
 
-def generate_pdf_report(model_output):
-    """Generate PDF report using the template and model output"""
-    # HTML template updated to match data structure from call_ai_model
-    html_template = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>面试报告</title>
-        <style>
-            body { font-family: Arial, sans-serif; margin: 40px; }
-            .container { max-width: 800px; margin: auto; }
-            .header { text-align: center; border-bottom: 2px solid #333; padding-bottom: 20px; }
-            .section { margin-top: 20px; }
-            .section h2 { color: #2c3e50; }
-            .table { width: 100%; border-collapse: collapse; margin-top: 10px; }
-            .table th, .table td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-            .table th { background-color: #f2f2f2; }
-            .question-section { border: 1px solid #ddd; padding: 15px; margin-bottom: 15px; border-radius: 5px; }
-            .question-title { font-weight: bold; color: #2c3e50; }
-            .score { font-weight: bold; color: #e74c3c; }
-            .footer { margin-top: 30px; text-align: center; color: #7f8c8d; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>面试报告</h1>
-                <p>{{ interview_date }}</p>
-            </div>
-            <div class="section">
-                <h2>候选人信息</h2>
-                <table class="table">
-                    <tr><th>姓名</th><td>{{ candidate_name }}</td></tr>
-                    <tr><th>应聘职位</th><td>{{ position }}</td></tr>
-                    <tr><th>面试官</th><td>{{ interviewer }}</td></tr>
-                </table>
-            </div>
-            <div class="section">
-                <h2>面试评估</h2>
-                <table class="table">
-                    <tr><th>技术能力</th><td>{{ evaluation_result.technical_score }}/100</td></tr>
-                    <tr><th>沟通能力</th><td>{{ evaluation_result.communication_score }}/100</td></tr>
-                    <tr><th>综合评分</th><td>{{ evaluation_result.overall_score }}/100</td></tr>
-                </table>
-            </div>
-            <div class="section">
-                <h2>面试官评语</h2>
-                <p>{{ evaluation_result.comments }}</p>
-            </div>
-            <div class="section">
-                <h2>推荐意见</h2>
-                <p>{{ evaluation_result.recommendation }}</p>
-            </div>
-            
-            <div class="section">
-                <h2>问题评估详情</h2>
-                {% for question in evaluation_result.question_evaluations %}
-                <div class="question-section">
-                    <p class="question-title">问题{{ question.id }}: {{ question.question }}</p>
-                    <p><strong>评分标准:</strong> {{ question.score_standard }}</p>
-                    <p><strong>候选人回答:</strong> {{ question.answer }}</p>
-                    <p><strong>评分:</strong> <span class="score">{{ question.score }}/10</span></p>
-                    <p><strong>点评:</strong> {{ question.comments }}</p>
-                </div>
-                {% endfor %}
-            </div>
-            
-            <div class="footer">
-                <p>Generated by xAI Interview System</p>
-            </div>
-        </div>
-    </body>
-    </html>
+def update_interview_report(interview, report_content, evaluation_result):
     """
-    
-    # Initialize Jinja2 environment
-    env = Environment()
-    
-    # Load template from string
-    template = env.from_string(html_template)
-    
-    # Render template
-    rendered_html = template.render(**model_output)
-    
-    # Convert to PDF bytes
-    pdf_bytes = HTML(string=rendered_html).write_pdf()
-    
-    return pdf_bytes
+    Save the report content to the interview record and update status to 4
 
-def update_interview_report(interview_id, report_content):
-    """Save the report content to the interview record and update status to 4"""
-    conn = sqlite3.connect('interview_system.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    UPDATE interviews 
-    SET report_content = ?, status = 4 
-    WHERE id = ?
-    ''', (report_content, interview_id))
+    The evaluation JSON and its scores go to the evaluations table in the
+    same transaction, so candidates can be ranked without opening PDFs.
+    Only interviews still in status 3 are updated, so a job that runs twice
+    (e.g. after its lease expired) does not overwrite a newer report.
+    Returns True if the report was saved.
+    """
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        UPDATE interviews 
+        SET report_content = ?, status = 4, revision = revision + 1, updated_at = strftime('%s', 'now')
+        WHERE id = ? AND status = 3
+        ''', (report_content, interview['id']))
+        if cursor.rowcount == 0:
+            return False
+        
+        evaluations.save(conn, interview['id'], interview['candidate_id'], interview['position_id'], evaluation_result)
+        return True
+
+def load_report_context(interview_id):
+    """Load everything the report needs; returns None if there is nothing to do"""
+    interview, questions = fetch_report_data(interview_id)
     
-    conn.commit()
-    conn.close()
+    # Skip if the interview is no longer waiting for a report
+    if not interview or interview['status'] != 3:
+        print(f"Interview ID {interview_id} does not exist or is not in status 3, skipping")
+        return None
+    if interview['candidate_name'] is None:
+        print(f"Could not find candidate with ID {interview['candidate_id']}")
+        return None
+    if interview['position_name'] is None:
+        print(f"Could not find position with ID {interview['position_id']}")
+        return None
+    return interview, questions
+
+async def process_report(job):
+    """
+    Generate the report for one interview; exceptions make the job retry later
 
-def process_pending_reports():
-    """Main function to process all interviews with status = 3"""
-    print(f"[{datetime.now()}] Checking for interviews that need reports...")
+    Several jobs run concurrently on one event loop. Database access runs in
+    worker threads and PDF rendering in the renderer's process pool, so
+    neither holds up the LLM calls.
+    """
+    interview_id = job['interview_id']
     
-    # 1. Get all interviews with status = 3
-    interviews = fetch_interviews_with_status_3()
+    # Wait for the queued and running score jobs instead of scoring the same
+    # answers again here; the report job is retried once they are done
+    if await asyncio.to_thread(lambda: job_queue.has_active(db.get_connection(), job_queue.KIND_SCORE, interview_id)):
+        raise job_queue.Deferred(SCORE_WAIT_SECONDS, "answers are still being scored")
     
-    if not interviews:
-        print("No interviews need reports at this time.")
+    context = await asyncio.to_thread(load_report_context, interview_id)
+    if context is None:
         return
+    interview, questions = context
     
-    print(f"Found {len(interviews)} interviews that need reports.")
+    # Answers are normally scored by their own jobs; score any that have none
+    # left (data from before scoring, or a score job that failed for good)
+    missing = [q for q in questions if q['score'] is None]
+    if missing:
+        await asyncio.gather(*(score_question(q) for q in missing))
     
-    for interview in interviews:
-        try:
-            interview_id = interview['id']
-            candidate_id = interview['candidate_id']
-            interviewer = interview['interviewer']
-            
-            # 2. Get candidate information
-            candidate = fetch_candidate_info(candidate_id)
-            if not candidate:
-                print(f"Could not find candidate with ID {candidate_id}")
-                continue
-            
-            # 3. Get position information
-            position = fetch_position_info(candidate['position_id'])
-            if not position:
-                print(f"Could not find position with ID {candidate['position_id']}")
-                continue
-            
-            # 4. Get interview questions and answers
-            questions = fetch_interview_questions(interview_id)
-            
-            # 5. Call AI model to generate report
-            model_output = call_ai_model(
-                candidate['name'],
-                position['name'],
-                interviewer,
-                questions
-            )
-            
-            # Generate PDF report
-            pdf_report = generate_pdf_report(model_output)
-            
-            # 6. Save report to database
-            # 7. Update interview status to 4
-            update_interview_report(interview_id, pdf_report)
-            
-            print(f"Generated report for interview ID {interview_id}, candidate: {candidate['name']}")
-            
-        except Exception as e:
-            print(f"Error processing interview ID {interview.get('id', 'unknown')}: {str(e)}")
+    # Call AI model to write the summary
+    model_output = await call_ai_model(
+        interview['candidate_name'],
+        interview['position_name'],
+        interview['interviewer'],
+        questions
+    )
+    
+    # Generate PDF report
+    pdf_report = await renderer.render(model_output)
+    
+    # Save report to database and update interview status to 4
+    if await asyncio.to_thread(update_interview_report, interview, pdf_report, model_output['evaluation_result']):
+        print(f"Generated report for interview ID {interview_id}, candidate: {interview['candidate_name']}")
+    else:
+        print(f"Report for interview ID {interview_id} was already saved by another job")
+
+def enqueue_pending_reports():
+    """Enqueue report jobs for completed interviews that never had one (e.g. data from before the job table)"""
+    count = job_queue.enqueue_missing(db.get_connection(), job_queue.KIND_REPORT, 3)
+    if count:
+        print(f"[{datetime.now()}] Enqueued {count} missing report jobs")
+
+def log_render_stats():
+    print(f"[{datetime.now()}] Report rendering stats: {renderer.stats()}")
 
 def run_scheduler():
-    """Set up the scheduler to run the task every 5 minutes"""
-    # Schedule the job to run every 5 minutes
-    schedule.every(5).minutes.do(process_pending_reports)
-    
-    # Run the job once immediately when starting
-    process_pending_reports()
+    """Check for missed interviews and log rendering stats every 5 minutes"""
+    schedule.every(5).minutes.do(enqueue_pending_reports)
+    schedule.every(5).minutes.do(log_render_stats)
     
-    # Keep the script running
     while True:
         schedule.run_pending()
         time.sleep(1)
 
 if __name__ == "__main__":
     print("Starting interview report generation service...")
-    run_scheduler() 
\ No newline at end of file
+    
+    # Make sure the job table exists and pick up interviews that were missed
+    migrations.migrate()
+    enqueue_pending_reports()
+    
+    # Start the rendering processes before any other thread is running
+    renderer.start()
+    
+    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    scheduler_thread.start()
+    
+    # server.py enqueues a score job for every saved answer and a report job
+    # when an interview completes. Both workers share one event loop and the
+    # LLM client; each runs up to JOB_CONCURRENCY jobs at once and several
+    # processes can run side by side
+    score_worker = job_queue.create_worker_from_env(job_queue.KIND_SCORE, score_answer, use_async=True)
+    report_worker = job_queue.create_worker_from_env(job_queue.KIND_REPORT, process_report, use_async=True)
+    try:
+        job_queue.run_async_workers(score_worker, report_worker)
+    except KeyboardInterrupt:
+        print("Stopped")
@@ -0,0 +1,75 @@
+# 生产环境运行配置：gunicorn -c gunicorn.conf.py server:app
+#
+# 主进程预加载 server.py（数据库迁移、加载 Whisper 模型）后再 fork 出 worker，
+# 各 worker 以写时复制方式共享同一份模型权重，增加 worker 不会成倍增加模型内存。
+# 进程池和后台线程不会随 fork 复制，由每个 worker 在 post_worker_init 中各自启动。
+#
+# kill -HUP <主进程>：按新配置逐个替换 worker，正在处理的请求处理完后旧 worker 才退出。
+# 预加载模式下 HUP 不会重新导入代码和模型，更新代码需 kill -USR2 启动新主进程，
+# 新主进程就绪后再向旧主进程发送 kill -TERM。
+import gc
+import os
+import sys
+import time
+
+# 用 NVML 检测 GPU，主进程判断设备时不初始化 CUDA 驱动，fork 出的 worker 仍可使用 GPU
+os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+
+import torch
+
+import asr_backend
+import db
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# CUDA 上下文无法在 fork 后继续使用：使用 GPU 时不预加载，每个 worker 在自己的进程中加载模型
+use_gpu = asr_backend.resolve_device(os.getenv("ASR_BACKEND", "whisper"), os.getenv("ASR_DEVICE") or None) == "cuda"
+preload_app = not use_gpu
+
+# 转写任务保存在 jobs 表中、分片上传会话保存在共用目录中，请求落到哪个 worker 都可以处理，
+# 默认每个 CPU 核一个 worker，模型权重仍只有一份；GPU 时每个 worker 各占一份显存，默认只启动一个
+workers = int(os.getenv("GUNICORN_WORKERS", "1" if use_gpu else str(os.cpu_count() or 1)))
+worker_class = "gthread"
+# 每个 worker 内的请求线程数；转写在后台线程中执行，请求线程主要等待数据库和上传
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# worker 处理 max_requests 个请求后重启，回收内存碎片；加入随机抖动避免所有 worker 同时重启
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# 慢速客户端上传整段录音所需的时间
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# worker 退出前等待请求和本 worker 正在执行的转写完成的时间
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+
+
+def when_ready(server):
+    if not preload_app:
+        print("语音识别使用 GPU：不预加载模型，每个 worker 各自加载一份（各占一份显存）")
+        return
+    # 预加载时执行迁移打开的数据库连接不能跨 fork 使用，fork 前关闭，各 worker 自行建立连接
+    db.close_connection()
+    # 把预加载的对象移出垃圾回收跟踪，避免 worker 中的 GC 改写对象头导致共享内存页被复制
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # 未指定 ASR_THREADS 时把 CPU 核数平分给各 worker，避免 torch 计算线程过多互相争抢
+    if not use_gpu and not os.getenv("ASR_THREADS"):
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    # 只有首批启动的第一个 worker 补写遗漏的转写任务，其余 worker 和之后重启的 worker 不重复检查
+    __import__("server").start_background_services(requeue=worker.age == 1)
+
+
+def worker_exit(server, worker):
+    # 重启或关闭 worker 时不再领取新的转写任务，等待正在执行的转写完成、结果写入数据库后再退出；
+    # 排队中的任务和分片上传会话由其他 worker 继续处理。worker 未加载完应用时无需等待
+    app_module = sys.modules.get("server")
+    if app_module is None:
+        return
+    deadline = time.monotonic() + graceful_timeout
+    drained = app_module.transcription_queue.drain(graceful_timeout)
+    drained = app_module.stream_manager.drain(max(0, deadline - time.monotonic())) and drained
+    if not drained:
+        print(f"worker {worker.pid} 退出时仍有未完成的转写，租约到期后由其他 worker 接手")
@@ -0,0 +1,26 @@
+import db
+import job_queue
+
+
+def finalize_if_complete(conn, interview_id):
+    """
+    所有问题都已生成完毕、回答并转写完成时，将面试状态更新为"已完成"(3)并写入报告生成任务
+
+    回答转写完成时由 server.py 调用；试题流式生成时，候选人可能先答完已生成的题目，
+    因此生成试题的进程在全部题目写入后也会调用一次。返回是否更新了状态。
+    """
+    with db.transaction():
+        cursor = conn.execute('''
+            UPDATE interviews SET status = 3, revision = revision + 1, updated_at = strftime('%s', 'now')
+            WHERE id = ? AND status < 3 AND questions_complete = 1
+              AND EXISTS (SELECT 1 FROM interview_questions WHERE interview_id = ?)
+              AND NOT EXISTS (
+                  SELECT 1 FROM interview_questions
+                  WHERE interview_id = ? AND (answered_at IS NULL OR answer_text IS NULL)
+              )
+        ''', (interview_id, interview_id, interview_id))
+        if cursor.rowcount == 0:
+            return False
+        # 与状态更新在同一事务中写入报告生成任务
+        job_queue.enqueue(conn, job_queue.KIND_REPORT, interview_id)
+    return True
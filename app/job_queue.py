@@ -0,0 +1,345 @@
+"""
+基于数据库 jobs 表的后台任务队列
+
+server.py 在创建面试、保存回答、面试完成时写入任务，生成试题和生成报告的任务进程领取执行；
+回答的转写任务由 server.py 各 worker 进程中的转写线程领取执行（见 transcription.py）。
+领取任务是一条原子的 UPDATE ... RETURNING，并带有租约：执行期间定期续约，
+进程崩溃后租约到期，任务会被其他进程重新领取，因此可以同时运行多个任务进程。
+
+AsyncJobWorker 在一个进程内同时执行多个任务（处理函数为协程），适合以等待大模型响应为主的任务。
+
+任务进程空闲时轮询 PRAGMA data_version（只检查共享内存，不读数据页），
+其他进程提交写入后立即尝试领取，任务从写入到开始执行通常在一秒以内。
+"""
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+import db
+import queries
+
+
+KIND_QUESTIONS = "questions"
+KIND_REPORT = "report"
+KIND_SCORE = "score"
+KIND_TRANSCRIBE = "transcribe"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class Deferred(Exception):
+    """处理函数抛出该异常表示暂不执行：任务在 delay 秒后重新排队，不计入执行次数"""
+
+    def __init__(self, delay, reason=""):
+        super().__init__(reason)
+        self.delay = delay
+
+def enqueue(conn, kind, interview_id, delay=0, question_id=0):
+    """
+    写入任务
+
+    同一面试（逐题任务为同一问题）已有排队中的同类任务时不重复写入，执行时会读取最新数据；
+    已有执行中的任务时标记 rerun，该任务结束后重新排队，保证执行期间修改的数据（如重新录制的回答）也会被处理。
+    """
+    now = time.time()
+    conn.execute('''
+        INSERT INTO jobs (kind, interview_id, question_id, status, run_after, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (kind, interview_id, question_id) WHERE status IN ('queued', 'running')
+        DO UPDATE SET rerun = CASE WHEN status = 'running' THEN 1 ELSE rerun END, updated_at = excluded.updated_at
+    ''', (kind, interview_id, question_id, STATUS_QUEUED, now + delay, now, now))
+
+
+def enqueue_missing(conn, kind, interview_status):
+    """
+    为处于 interview_status 状态、但从未有过该类型任务的面试补写任务，返回补写的数量
+
+    用于升级前已有的面试，以及绕过 server.py 直接修改数据库的情况。
+    """
+    now = time.time()
+    cursor = conn.execute(queries.ENQUEUE_MISSING_JOBS, (kind, STATUS_QUEUED, now, now, now, interview_status, kind))
+    return cursor.rowcount
+
+
+# 可领取的任务，依次尝试：排队中且已到执行时间的任务按到期先后领取，其次是租约已过期的执行中任务。
+# 两个条件分开查询，都能沿 (kind, status, run_after) 索引定位，已完成的任务再多也不会被扫描
+CLAIM_CONDITIONS = (
+    "kind = ? AND status = 'queued' AND run_after <= ? ORDER BY run_after",
+    "kind = ? AND status = 'running' AND lease_expires_at < ?",
+)
+
+
+def claim(conn, kind, owner, lease_seconds):
+    """领取一个任务并加租约，没有可领取的任务时返回 None"""
+    now = time.time()
+    for condition in CLAIM_CONDITIONS:
+        # 先用只读查询判断，避免空闲时每次轮询都获取写锁
+        if conn.execute(f'SELECT id FROM jobs WHERE {condition} LIMIT 1', (kind, now)).fetchone() is None:
+            continue
+        row = conn.execute(f'''
+            UPDATE jobs
+            SET status = 'running', lease_owner = ?, lease_expires_at = ?,
+                attempts = attempts + 1, updated_at = ?
+            WHERE id = (SELECT id FROM jobs WHERE {condition} LIMIT 1)
+            RETURNING id, kind, interview_id, question_id, attempts, created_at
+        ''', (owner, now + lease_seconds, now, kind, now)).fetchone()
+        if row:
+            return dict(row)
+    return None
+
+
+def heartbeat(conn, job_id, owner, lease_seconds):
+    """续约，租约已被其他进程接管时返回 False"""
+    now = time.time()
+    cursor = conn.execute(queries.JOB_HEARTBEAT, (now + lease_seconds, now, job_id, owner))
+    return cursor.rowcount > 0
+
+
+def complete(conn, job_id, owner):
+    """标记完成；执行期间被标记 rerun 的任务重新排队，立即再执行一次"""
+    now = time.time()
+    cursor = conn.execute('''
+        UPDATE jobs SET status = CASE WHEN rerun THEN 'queued' ELSE 'done' END,
+            run_after = CASE WHEN rerun THEN ? ELSE run_after END,
+            attempts = CASE WHEN rerun THEN 0 ELSE attempts END,
+            rerun = 0, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+        WHERE id = ? AND lease_owner = ?
+    ''', (now, now, job_id, owner))
+    return cursor.rowcount > 0
+
+
+def defer(conn, job_id, owner, delay):
+    """任务在 delay 秒后重新排队，本次领取不计入执行次数；执行期间被标记的 rerun 由重新执行覆盖"""
+    now = time.time()
+    cursor = conn.execute('''
+        UPDATE jobs SET status = 'queued', run_after = ?, attempts = MAX(attempts - 1, 0),
+            rerun = 0, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+        WHERE id = ? AND lease_owner = ?
+    ''', (now + delay, now, job_id, owner))
+    return cursor.rowcount > 0
+
+
+def has_active(conn, kind, interview_id):
+    """面试是否有排队中或执行中的某类任务"""
+    return conn.execute('''
+        SELECT 1 FROM jobs WHERE interview_id = ? AND kind = ? AND status IN ('queued', 'running') LIMIT 1
+    ''', (interview_id, kind)).fetchone() is not None
+
+
+def fail(conn, job, owner, error, max_attempts, retry_delay):
+    """记录失败；未超过最大次数时按指数退避（带随机抖动）重新排队，被标记 rerun 的任务立即重新排队"""
+    now = time.time()
+    if job['attempts'] >= max_attempts:
+        status, run_after = STATUS_FAILED, now
+    else:
+        delay = retry_delay * (2 ** (job['attempts'] - 1))
+        status, run_after = STATUS_QUEUED, now + random.uniform(delay / 2, delay)
+    row = conn.execute('''
+        UPDATE jobs SET status = CASE WHEN rerun THEN 'queued' ELSE ? END,
+            run_after = CASE WHEN rerun THEN ? ELSE ? END,
+            attempts = CASE WHEN rerun THEN 0 ELSE attempts END,
+            rerun = 0, last_error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+        WHERE id = ? AND lease_owner = ?
+        RETURNING status
+    ''', (status, now, run_after, error[-2000:], now, job['id'], owner)).fetchone()
+    return row['status'] if row else status
+
+
+def stats(conn):
+    """各类型、各状态的任务数，以及排队最久的任务已等待的秒数"""
+    result = {}
+    for row in conn.execute('''
+        SELECT kind, status, COUNT(*) AS count, MIN(created_at) AS oldest
+        FROM jobs WHERE status IN ('queued', 'running', 'failed')
+        GROUP BY kind, status
+    '''):
+        kind = result.setdefault(row['kind'], {})
+        kind[row['status']] = row['count']
+        if row['status'] == STATUS_QUEUED:
+            kind['oldest_queued_seconds'] = round(time.time() - row['oldest'], 1)
+    return result
+
+
+class JobWorker:
+    """
+    领取并执行某一类型的任务
+
+    handler(job) 执行任务，抛出异常视为失败，抛出 Deferred 则稍后重新执行。执行期间后台线程每 lease_seconds/3 续约一次。
+    handler 写入结果时应检查面试状态，保证同一任务被重复执行时不会重复写入。
+
+    Args:
+        kind: 任务类型
+        handler: 任务处理函数
+        lease_seconds: 租约时长，进程崩溃后最多经过这么久任务会被重新领取
+        max_attempts: 最多执行次数，超过后标记为失败
+        retry_delay: 第一次重试前的等待秒数，之后每次翻倍
+        poll_interval: 空闲时检查数据库是否有新写入的间隔（秒）
+        recheck_interval: 空闲时即使没有新写入也重新检查的间隔（秒），用于到期的重试和过期的租约
+    """
+
+    def __init__(self, kind, handler, lease_seconds=60, max_attempts=3, retry_delay=30,
+                 poll_interval=0.2, recheck_interval=5):
+        self.kind = kind
+        self.handler = handler
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.recheck_interval = recheck_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """不再领取新任务，正在执行的任务执行完后 run_forever 返回"""
+        self._stopping.set()
+
+    def run_forever(self):
+        conn = db.get_connection()
+        print(f"任务进程 {self.owner} 开始处理 {self.kind} 任务")
+        while not self._stopping.is_set():
+            job = claim(conn, self.kind, self.owner, self.lease_seconds)
+            if job is None:
+                self.wait_for_change(conn)
+                continue
+            self.run_job(conn, job)
+
+    def wait_for_change(self, conn):
+        """等待其他进程写入数据库，或等待 recheck_interval 秒"""
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        deadline = time.monotonic() + self.recheck_interval
+        while time.monotonic() < deadline and not self._stopping.is_set():
+            time.sleep(self.poll_interval)
+            if conn.execute('PRAGMA data_version').fetchone()[0] != version:
+                return
+
+    def run_job(self, conn, job):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 领取 {self.kind} 任务 {job['id']}（面试ID: {job['interview_id']}，"
+              f"第 {job['attempts']} 次，排队 {time.time() - job['created_at']:.1f} 秒）")
+        stop = threading.Event()
+        keeper = threading.Thread(target=self._keep_lease, args=(job, stop), daemon=True)
+        keeper.start()
+        try:
+            self.handler(job)
+        except Deferred as e:
+            defer(conn, job['id'], self.owner, e.delay)
+            print(f"{self.kind} 任务 {job['id']} 推迟 {e.delay} 秒执行: {e}")
+        except Exception as e:
+            status = fail(conn, job, self.owner, f"{e}\n{traceback.format_exc()}", self.max_attempts, self.retry_delay)
+            print(f"{self.kind} 任务 {job['id']} 执行失败（{status}）: {e}")
+        else:
+            if not complete(conn, job['id'], self.owner):
+                print(f"{self.kind} 任务 {job['id']} 的租约已被其他进程接管")
+        finally:
+            stop.set()
+            keeper.join()
+
+    def _keep_lease(self, job, stop):
+        conn = db.get_connection()
+        while not stop.wait(self.lease_seconds / 3):
+            if not heartbeat(conn, job['id'], self.owner, self.lease_seconds):
+                print(f"{self.kind} 任务 {job['id']} 续约失败，租约可能已过期")
+                return
+
+
+class AsyncJobWorker(JobWorker):
+    """
+    在事件循环中同时执行最多 concurrency 个任务
+
+    handler(job) 为协程函数，每个任务完成后立即提交结果并领取下一个任务。
+    数据库操作都放在线程池中执行，不阻塞事件循环；一个协程统一为所有执行中的任务续约。
+
+    Args:
+        concurrency: 同时执行的任务数
+        其余参数同 JobWorker
+    """
+
+    def __init__(self, kind, handler, concurrency=8, **kwargs):
+        super().__init__(kind, handler, **kwargs)
+        self.concurrency = concurrency
+        self._running = {}
+        self._tasks = set()
+
+    def run_forever(self):
+        run_async_workers(self)
+
+    async def _main(self):
+        print(f"任务进程 {self.owner} 开始处理 {self.kind} 任务，并发数 {self.concurrency}")
+        slots = asyncio.Semaphore(self.concurrency)
+        keeper = asyncio.create_task(self._keep_leases())
+        try:
+            while True:
+                await slots.acquire()
+                job = await _in_thread(claim, self.kind, self.owner, self.lease_seconds)
+                if job is None:
+                    slots.release()
+                    await asyncio.to_thread(lambda: self.wait_for_change(db.get_connection()))
+                    continue
+                self._running[job['id']] = job
+                # 保留任务引用，避免执行中的任务被垃圾回收
+                task = asyncio.create_task(self._run_job(job, slots))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            keeper.cancel()
+
+    async def _run_job(self, job, slots):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 领取 {self.kind} 任务 {job['id']}（面试ID: {job['interview_id']}，"
+              f"第 {job['attempts']} 次，排队 {time.time() - job['created_at']:.1f} 秒，执行中 {len(self._running)} 个）")
+        try:
+            await self.handler(job)
+        except Deferred as e:
+            await _in_thread(defer, job['id'], self.owner, e.delay)
+            print(f"{self.kind} 任务 {job['id']} 推迟 {e.delay} 秒执行: {e}")
+        except Exception as e:
+            status = await _in_thread(fail, job, self.owner, f"{e}\n{traceback.format_exc()}",
+                                      self.max_attempts, self.retry_delay)
+            print(f"{self.kind} 任务 {job['id']} 执行失败（{status}）: {e}")
+        else:
+            if not await _in_thread(complete, job['id'], self.owner):
+                print(f"{self.kind} 任务 {job['id']} 的租约已被其他进程接管")
+        finally:
+            self._running.pop(job['id'], None)
+            slots.release()
+
+    async def _keep_leases(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            for job in list(self._running.values()):
+                if not await _in_thread(heartbeat, job['id'], self.owner, self.lease_seconds):
+                    print(f"{self.kind} 任务 {job['id']} 续约失败，租约可能已过期")
+
+
+def run_async_workers(*workers):
+    """在同一个事件循环中运行多个 AsyncJobWorker，它们共用进程内的大模型客户端及其并发和限流"""
+    async def main():
+        await asyncio.gather(*(worker._main() for worker in workers))
+    asyncio.run(main())
+
+
+async def _in_thread(fn, *args):
+    # 在线程池中使用该线程自己的数据库连接执行
+    return await asyncio.to_thread(lambda: fn(db.get_connection(), *args))
+
+
+def create_worker_from_env(kind, handler, use_async=False):
+    """
+    根据环境变量创建任务进程：JOB_LEASE_SECONDS、JOB_MAX_ATTEMPTS、JOB_RETRY_DELAY、JOB_POLL_INTERVAL，
+    use_async=True 时创建 AsyncJobWorker，并发数由 JOB_CONCURRENCY 配置
+    """
+    kwargs = dict(
+        lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+        retry_delay=float(os.getenv("JOB_RETRY_DELAY", "30")),
+        poll_interval=float(os.getenv("JOB_POLL_INTERVAL", "0.2")),
+    )
+    if use_async:
+        return AsyncJobWorker(kind, handler, concurrency=int(os.getenv("JOB_CONCURRENCY", "8")), **kwargs)
+    return JobWorker(kind, handler, **kwargs)
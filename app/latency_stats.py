@@ -0,0 +1,6 @@
+def percentile(sorted_values, q):
+    """已排序样本的 q 分位数（0 <= q <= 1），没有样本时返回 0"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,236 @@
+"""
+管理后台列表接口的分页、筛选和字段选择
+
+列表按 id 倒序（最新的在前）分页，下一页从上一页最后一条的 id 继续
+（WHERE id < cursor），不使用 OFFSET，因此无论翻到第几页、表有多大，
+每页都只读取 limit 条记录。
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+# 每个列表最多缓存的计数结果数（不同筛选条件各占一条）
+COUNT_CACHE_SIZE = 256
+
+
+def contains(value):
+    """按名称搜索的 LIKE 模式：包含 value 即匹配，value 中的 %、_ 按字面匹配"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class ListSpec:
+    """
+    描述一个列表接口可以返回的字段和支持的筛选条件
+
+    Args:
+        table: 主表，带别名，如 "interviews i"
+        alias: 主表别名，分页游标使用 alias.id
+        columns: 字段名 -> SQL 表达式，BLOB 字段不要放进来
+        legacy_fields: 不分页时（旧接口）默认返回的字段
+        default_fields: 分页时默认返回的字段
+        filters: 查询参数 -> (SQL 条件, 参数类型)，条件中用一个 ? 占位
+        joins: 字段名 -> 需要的 JOIN 子句，只有请求了该字段才会关联
+    """
+
+    def __init__(self, table, alias, columns, legacy_fields, default_fields, filters, joins=None):
+        self.table = table
+        self.alias = alias
+        self.columns = columns
+        self.legacy_fields = legacy_fields
+        self.default_fields = default_fields
+        self.filters = filters
+        self.joins = joins or {}
+        self._counts = OrderedDict()
+        self._counts_lock = threading.Lock()
+
+    def parse_fields(self, value, default):
+        if not value:
+            return list(default)
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in self.columns]
+        if unknown:
+            raise ValueError(f"不支持的字段: {', '.join(unknown)}")
+        # id 总是返回，分页游标依赖它
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+        return fields
+
+    def parse_filters(self, args):
+        conditions, params = [], []
+        for name, (condition, cast) in self.filters.items():
+            value = args.get(name)
+            if value is None or value == '':
+                continue
+            try:
+                params.append(cast(value))
+            except ValueError:
+                raise ValueError(f"参数 {name} 格式不正确: {value}")
+            conditions.append(condition)
+        return conditions, params
+
+    def count(self, conn, where, params, version=None):
+        """
+        统计符合筛选条件的记录数
+
+        COUNT(*) 需要扫描所有符合条件的记录，version（各表的版本号）相同时直接返回上次的结果，
+        表没有变化时不再重复统计。
+        """
+        key = (where, tuple(params), version)
+        if version is not None:
+            with self._counts_lock:
+                if key in self._counts:
+                    self._counts.move_to_end(key)
+                    return self._counts[key]
+        total = conn.execute(f'SELECT COUNT(*) FROM {self.table} {where}', params).fetchone()[0]
+        if version is not None:
+            with self._counts_lock:
+                self._counts[key] = total
+                while len(self._counts) > COUNT_CACHE_SIZE:
+                    self._counts.popitem(last=False)
+        return total
+
+    def query(self, conn, args, version=None):
+        """
+        执行列表查询
+
+        未传 limit 和 cursor 时保持旧接口行为，按 id 正序返回全部记录的数组；
+        否则返回 {"items": [...], "next_cursor": ..., "total": ...}，
+        total 只在第一页（没有 cursor）且传入 with_total=1 时统计，翻页时不再重复计数。
+        version 为各表的版本号，用于缓存计数结果。
+
+        Raises:
+            ValueError: 参数不合法
+        """
+        paginated = 'limit' in args or 'cursor' in args
+        conditions, params = self.parse_filters(args)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        if not paginated:
+            select, joins = self._select(self.parse_fields(args.get('fields'), self.legacy_fields))
+            rows = conn.execute(f'SELECT {select} FROM {self.table} {joins} {where} ORDER BY {self.alias}.id ASC', params)
+            return [dict(row) for row in rows]
+
+        sql, page_params, limit, cursor = self.page_sql(args)
+        rows = conn.execute(sql, page_params).fetchall()
+        items = [dict(row) for row in rows[:limit]]
+
+        result = {
+            'items': items,
+            'next_cursor': items[-1]['id'] if len(rows) > limit else None,
+        }
+        if cursor is None and args.get('with_total') == '1':
+            result['total'] = self.count(conn, where, params, version)
+        return result
+
+    def page_sql(self, args):
+        """
+        构造一页列表的查询，返回 (SQL, 参数, limit, cursor)；query() 执行它，migrations.py --check 检查它的执行计划
+
+        Raises:
+            ValueError: 参数不合法
+        """
+        select, joins = self._select(self.parse_fields(args.get('fields'), self.default_fields))
+        conditions, params = self.parse_filters(args)
+        try:
+            limit = min(max(int(args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+            cursor = int(args['cursor']) if args.get('cursor') else None
+        except ValueError:
+            raise ValueError("limit 和 cursor 必须是整数")
+
+        if cursor is not None:
+            conditions.append(f'{self.alias}.id < ?')
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        # 多取一条用于判断是否还有下一页
+        sql = f'''
+            SELECT {select} FROM {self.table} {joins} {where}
+            ORDER BY {self.alias}.id DESC LIMIT ?
+        '''
+        return sql, params + [limit + 1], limit, cursor
+
+    def _select(self, fields):
+        select = ', '.join(f'{self.columns[field]} AS {field}' for field in fields)
+        joins = ' '.join(dict.fromkeys(self.joins[field] for field in fields if field in self.joins))
+        return select, joins
+
+
+POSITIONS = ListSpec(
+    table='positions p',
+    alias='p',
+    columns={
+        'id': 'p.id',
+        'name': 'p.name',
+        'requirements': 'p.requirements',
+        'responsibilities': 'p.responsibilities',
+        'quantity': 'p.quantity',
+        'status': 'p.status',
+        'created_at': 'p.created_at',
+        'recruiter': 'p.recruiter',
+    },
+    legacy_fields=['id', 'name', 'requirements', 'responsibilities', 'quantity', 'status', 'created_at', 'recruiter'],
+    # 岗位要求和职责较长，列表页默认不返回，编辑时通过 /api/positions/<id> 获取
+    default_fields=['id', 'name', 'quantity', 'status', 'created_at', 'recruiter'],
+    filters={
+        'status': ('p.status = ?', int),
+        'recruiter': ('p.recruiter = ?', str),
+        # 下拉框按名称搜索：沿主键倒序查找，凑够 limit 条匹配即停止
+        'q': ("p.name LIKE ? ESCAPE '\\'", contains),
+        'created_from': ('p.created_at >= ?', int),
+        'created_to': ('p.created_at <= ?', int),
+    },
+)
+
+CANDIDATES = ListSpec(
+    table='candidates c',
+    alias='c',
+    columns={
+        'id': 'c.id',
+        'position_id': 'c.position_id',
+        'name': 'c.name',
+        'email': 'c.email',
+        'position_name': 'p.name',
+    },
+    legacy_fields=['id', 'position_id', 'name', 'email'],
+    default_fields=['id', 'position_id', 'name', 'email', 'position_name'],
+    filters={
+        'position_id': ('c.position_id = ?', int),
+        'q': ("c.name LIKE ? ESCAPE '\\'", contains),
+    },
+    joins={
+        'position_name': 'LEFT JOIN positions p ON p.id = c.position_id',
+    },
+)
+
+INTERVIEWS = ListSpec(
+    table='interviews i',
+    alias='i',
+    columns={
+        'id': 'i.id',
+        'candidate_id': 'i.candidate_id',
+        'interviewer': 'i.interviewer',
+        'start_time': 'i.start_time',
+        'end_time': 'i.end_time',
+        'status': 'i.status',
+        'question_count': 'i.question_count',
+        'is_passed': 'i.is_passed',
+        'voice_reading': 'i.voice_reading',
+        'token': 'i.token',
+        'candidate_name': 'c.name',
+    },
+    legacy_fields=['id', 'candidate_id', 'interviewer', 'start_time', 'status', 'is_passed', 'token'],
+    default_fields=['id', 'candidate_id', 'interviewer', 'start_time', 'status', 'is_passed', 'token', 'candidate_name'],
+    filters={
+        'status': ('i.status = ?', int),
+        'candidate_id': ('i.candidate_id = ?', int),
+        'interviewer': ('i.interviewer = ?', str),
+        'position_id': ('i.position_id = ?', int),
+        'start_from': ('i.start_time >= ?', int),
+        'start_to': ('i.start_time <= ?', int),
+    },
+    joins={
+        'candidate_name': 'LEFT JOIN candidates c ON c.id = i.candidate_id',
+    },
+)
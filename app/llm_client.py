@@ -0,0 +1,271 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import openai
+from openai import AsyncOpenAI
+
+
+# 可以重试的错误：限流、超时、连接失败和服务端 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    """
+    令牌桶限流：每分钟请求数和每分钟 token 数
+
+    两个桶的容量都是一分钟的额度，按秒匀速补充；值为 0 表示不限制。
+    调用前按估算的 token 数扣减，调用后用实际用量修正。
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, tokens):
+        # 加锁保证先到的请求先拿到额度
+        async with self._lock:
+            if self.tokens_per_minute:
+                tokens = min(tokens, self.tokens_per_minute)
+            while True:
+                self._refill()
+                wait = 0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait == 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+
+    def adjust(self, estimated, actual):
+        """用实际 token 用量修正调用前的估算"""
+        if self.tokens_per_minute and actual is not None:
+            self._tokens -= actual - estimated
+
+
+class JsonObjectStream:
+    """
+    从流式返回的 JSON 文本中逐个解析出完整的对象
+
+    每收到一段文本调用 feed，返回这段文本中新闭合、且包含 required_keys 的对象。
+    只跟踪花括号和字符串，不关心外层是数组还是 {"questions": [...]}；
+    不含 required_keys 的对象（外层包装、嵌套的评分标准）不单独返回。
+    """
+
+    def __init__(self, required_keys=()):
+        self.required_keys = required_keys
+        self._buffer = []
+        self._starts = []
+        self._in_string = False
+        self._escaped = False
+        self._position = 0
+
+    def feed(self, text):
+        objects = []
+        for char in text:
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._starts.append(self._position)
+            elif char == "}" and self._starts:
+                start = self._starts.pop()
+                try:
+                    value = json.loads("".join(self._buffer[start:]))
+                except ValueError:
+                    value = None
+                if isinstance(value, dict) and all(key in value for key in self.required_keys):
+                    objects.append(value)
+            self._position += 1
+        return objects
+
+
+def estimate_tokens(messages, max_output_tokens=1000):
+    # 粗略估算：中文约每 1.5 个字符一个 token，再加上预计的输出长度
+    chars = sum(len(message.get("content") or "") for message in messages)
+    return int(chars / 1.5) + max_output_tokens
+
+
+class LlmClient:
+    """
+    异步调用大模型，限制并发数和速率，失败时按带随机抖动的指数退避重试
+
+    Args:
+        client: AsyncOpenAI 客户端（应设置 max_retries=0，由本类负责重试）
+        concurrency: 同时进行的请求数上限
+        limiter: RateLimiter，None 表示不限速
+        max_retries: 最多重试次数
+        base_delay: 第一次重试的最长等待秒数，之后每次翻倍
+        max_delay: 单次重试的最长等待秒数
+    """
+
+    def __init__(self, client, concurrency=8, limiter=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.client = client
+        self.concurrency = concurrency
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.tokens = 0
+
+    async def chat(self, model, messages, **kwargs):
+        """调用 chat.completions.create，返回原始响应"""
+        estimated = estimate_tokens(messages, kwargs.get("max_tokens") or 1000)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(estimated)
+            try:
+                async with self._semaphore:
+                    self.in_flight += 1
+                    try:
+                        response = await self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+                    finally:
+                        self.in_flight -= 1
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.retries += 1
+                print(f"调用大模型失败（{type(e).__name__}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+                await asyncio.sleep(delay)
+                continue
+
+            self.calls += 1
+            usage = getattr(response, "usage", None)
+            actual = getattr(usage, "total_tokens", None)
+            if actual:
+                self.tokens += actual
+            self.limiter.adjust(estimated, actual)
+            return response
+
+    async def chat_stream(self, model, messages, **kwargs):
+        """
+        流式调用，逐段返回生成的文本
+
+        收到第一段文本之前失败时按 chat 的规则重试；之后失败直接抛出，
+        因为已返回的内容可能已被调用方使用。
+        """
+        estimated = estimate_tokens(messages, kwargs.get("max_tokens") or 1000)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(estimated)
+            started = False
+            try:
+                async with self._semaphore:
+                    self.in_flight += 1
+                    try:
+                        stream = await self.client.chat.completions.create(
+                            model=model, messages=messages, stream=True, **kwargs
+                        )
+                        async for chunk in stream:
+                            if not chunk.choices:
+                                continue
+                            text = chunk.choices[0].delta.content
+                            if text:
+                                started = True
+                                yield text
+                    finally:
+                        self.in_flight -= 1
+            except RETRYABLE_ERRORS as e:
+                if started or attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.retries += 1
+                print(f"调用大模型失败（{type(e).__name__}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+                await asyncio.sleep(delay)
+                continue
+
+            # 流式响应不一定返回用量，按估算值计入
+            self.calls += 1
+            self.tokens += estimated
+            return
+
+    async def chat_json_stream(self, model, messages, required_keys=(), **kwargs):
+        """要求返回 JSON 对象，流式解析并逐个返回其中包含 required_keys 的对象"""
+        parser = JsonObjectStream(required_keys)
+        async for text in self.chat_stream(model, messages, response_format={"type": "json_object"}, **kwargs):
+            for value in parser.feed(text):
+                yield value
+
+    async def chat_json(self, model, messages, **kwargs):
+        """要求返回 JSON 对象并解析"""
+        response = await self.chat(model, messages, response_format={"type": "json_object"}, **kwargs)
+        return json.loads(response.choices[0].message.content)
+
+    def _retry_delay(self, error, attempt):
+        # 服务端给出 Retry-After 时按其等待，否则在 [0, base_delay * 2^attempt] 内随机（full jitter）
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "tokens": self.tokens,
+        }
+
+
+def create_client_from_env():
+    """
+    根据环境变量创建异步大模型客户端：
+    OPENAI_API_KEY、OPENAI_BASE_URL、LLM_CONCURRENCY、LLM_REQUESTS_PER_MINUTE、
+    LLM_TOKENS_PER_MINUTE、LLM_MAX_RETRIES、LLM_TIMEOUT
+    """
+    client = AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        timeout=float(os.getenv("LLM_TIMEOUT", "120")),
+        max_retries=0,
+    )
+    limiter = RateLimiter(
+        requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+        tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+    )
+    return LlmClient(
+        client,
+        concurrency=int(os.getenv("LLM_CONCURRENCY", "8")),
+        limiter=limiter,
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+    )
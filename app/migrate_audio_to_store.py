@@ -0,0 +1,89 @@
+"""
+将 interview_questions.answer_audio 中的录音 BLOB 迁移到按内容寻址的文件存储
+
+迁移后数据库只保留 answer_audio_hash 和 answer_audio_size，可重复执行。
+
+用法：
+
+    python migrate_audio_to_store.py            # 迁移录音
+    python migrate_audio_to_store.py --vacuum   # 迁移后压缩数据库文件
+    python migrate_audio_to_store.py --gc       # 删除数据库中不再引用的录音文件
+"""
+import argparse
+import os
+import time
+
+import audio_store
+import db
+import migrations
+
+
+BATCH_SIZE = 100
+
+
+def migrate(conn, store):
+    """分批把 BLOB 写入文件存储，每批提交一次，返回迁移的条数"""
+    migrated = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, answer_audio FROM interview_questions
+            WHERE answer_audio IS NOT NULL
+            LIMIT ?
+        ''', (BATCH_SIZE,)).fetchall()
+        if not rows:
+            break
+        conn.execute('BEGIN IMMEDIATE')
+        for question_id, audio_data in rows:
+            audio_hash, audio_size = store.put(audio_data)
+            conn.execute('''
+                UPDATE interview_questions
+                SET answer_audio_hash = ?, answer_audio_size = ?, answer_audio = NULL
+                WHERE id = ?
+            ''', (audio_hash, audio_size, question_id))
+        conn.execute('COMMIT')
+        migrated += len(rows)
+        print(f"已迁移 {migrated} 条录音")
+    return migrated
+
+
+def collect_garbage(conn, store, min_age_seconds=3600):
+    """
+    删除数据库中已不再引用的录音文件，返回删除的文件数
+
+    最近 min_age_seconds 内写入的文件可能属于正在提交的回答，暂不删除。
+    """
+    cutoff = time.time() - min_age_seconds
+    referenced = {row[0] for row in conn.execute('''
+        SELECT DISTINCT answer_audio_hash FROM interview_questions WHERE answer_audio_hash IS NOT NULL
+    ''')}
+    removed = 0
+    for audio_hash in list(store.iter_hashes()):
+        if audio_hash not in referenced and os.path.getmtime(store.path(audio_hash)) < cutoff:
+            store.remove(audio_hash)
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移回答录音到文件存储")
+    parser.add_argument("--db", default=db.DB_PATH, help="数据库文件路径")
+    parser.add_argument("--vacuum", action="store_true", help="迁移后执行 VACUUM 释放数据库空间")
+    parser.add_argument("--gc", action="store_true", help="删除不再被引用的录音文件")
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    store = audio_store.create_store_from_env()
+    # 确保数据库已有录音哈希和长度字段
+    migrations.migrate(conn)
+
+    count = migrate(conn, store)
+    print(f"迁移完成，共 {count} 条录音")
+
+    if args.vacuum:
+        conn.execute('VACUUM')
+        print("数据库已压缩")
+
+    if args.gc:
+        print(f"已删除 {collect_garbage(conn, store)} 个未引用的录音文件")
+
+    conn.close()
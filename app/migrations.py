@@ -0,0 +1,400 @@
+"""
+数据库结构版本管理
+
+每个迁移有一个递增的版本号，当前版本记录在 PRAGMA user_version 中。
+server.py 启动时执行 migrate()，只应用尚未执行过的迁移；新增表、字段或索引时
+在 MIGRATIONS 末尾追加新的迁移，不要修改已发布的迁移。
+
+用法：
+
+    python migrations.py          # 执行迁移
+    python migrations.py --check  # 执行迁移并验证热点查询都使用了索引
+"""
+import argparse
+import sys
+
+import db
+import job_queue
+import list_query
+import queries
+
+
+def _add_column(conn, table, column, definition):
+    # 兼容已经手动补过字段的旧数据库
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def migration_1_base_schema(conn):
+    """创建基础表结构"""
+    # 创建待招聘岗位表
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS positions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- 岗位ID，唯一标识
+        name TEXT NOT NULL, -- 岗位名称
+        requirements TEXT, -- 岗位要求
+        responsibilities TEXT, -- 岗位职责
+        quantity INTEGER, -- 需求人数
+        status INTEGER, -- 招聘状态：0=未启动，1=进行中，2=已完成
+        created_at INTEGER DEFAULT (strftime('%s', 'now')), -- 岗位发布时间，Unix时间戳
+        recruiter TEXT -- 招聘负责人
+    )
+    ''')
+
+    # 创建候选人表
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS candidates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- 候选人ID，唯一标识
+        position_id INTEGER NOT NULL, -- 申请的岗位ID
+        name TEXT NOT NULL, -- 候选人姓名
+        email TEXT, -- 候选人邮件
+        resume_content BLOB -- 简历文件二进制内容
+    )
+    ''')
+
+    # 创建面试表
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS interviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- 面试ID，唯一标识
+        candidate_id INTEGER NOT NULL, -- 候选人ID
+        interviewer TEXT, -- 面试官
+        start_time INTEGER, -- 面试开始时间，Unix时间戳
+        end_time INTEGER, -- 面试结束时间，Unix时间戳
+        status INTEGER, -- 面试状态：0=未开始，1=试题已备好 2 =面试进行中  3 =面试完毕 4 =面试报告已生成
+        question_count INTEGER, -- 面试问题数量
+        is_passed INTEGER, -- 面试结果：0=未通过，1=通过
+        voice_reading INTEGER, -- 是否开启语音朗读：0=关闭，1=开启
+        report_content BLOB, -- 面试报告二进制内容
+        token TEXT -- 面试链接验证令牌
+    )
+    ''')
+
+    # 创建面试问题表
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS interview_questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- 问题ID，唯一标识
+        interview_id INTEGER NOT NULL, -- 面试ID
+        question TEXT NOT NULL, -- 面试问题内容
+        score_standard TEXT, -- 评分标准或分值说明
+        answer_audio BLOB, -- 回答录音二进制内容（旧数据，新录音保存在文件存储中）
+        answer_text TEXT, -- 回答文本内容
+        created_at INTEGER DEFAULT (strftime('%s', 'now')), -- 问题创建时间，Unix时间戳
+        answered_at INTEGER -- 回答时间，Unix时间戳
+    )
+    ''')
+
+
+def migration_2_audio_store(conn):
+    """回答录音改存文件，数据库只记录哈希和长度"""
+    _add_column(conn, 'interview_questions', 'answer_audio_hash', 'TEXT')  # 回答录音 SHA-256
+    _add_column(conn, 'interview_questions', 'answer_audio_size', 'INTEGER')  # 回答录音字节数
+
+
+def migration_3_lookup_indexes(conn):
+    """为热点查询添加索引"""
+    # 候选人每次请求都按 token 查找面试
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_interviews_token ON interviews (token)')
+    # 题目导航：WHERE interview_id = ? AND id > ? ORDER BY id
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interview_questions_interview_id ON interview_questions (interview_id, id)')
+    # 两个后台任务按状态查找待处理的面试
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interviews_status ON interviews (status)')
+    # 候选人与岗位、面试与候选人的关联查询
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_candidates_position_id ON candidates (position_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interviews_candidate_id ON interviews (candidate_id)')
+
+
+def migration_4_list_filter_indexes(conn):
+    """为管理后台列表筛选添加索引"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_positions_status ON positions (status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_positions_recruiter ON positions (recruiter)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interviews_interviewer ON interviews (interviewer)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interviews_start_time ON interviews (start_time)')
+
+
+VERSIONED_TABLES = ['positions', 'candidates', 'interviews']
+
+
+def migration_5_revisions(conn):
+    """记录岗位、候选人、面试的版本号和修改时间，用于 HTTP 缓存"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY, -- 表名
+        version INTEGER NOT NULL DEFAULT 0, -- 表中任意记录增删改后加一
+        updated_at INTEGER -- 最近修改时间，Unix时间戳
+    )
+    ''')
+    for table in VERSIONED_TABLES:
+        _add_column(conn, table, 'revision', 'INTEGER NOT NULL DEFAULT 0')  # 记录版本号，每次修改加一
+        _add_column(conn, table, 'updated_at', 'INTEGER')  # 记录最近修改时间，Unix时间戳
+        conn.execute(f"UPDATE {table} SET updated_at = strftime('%s', 'now') WHERE updated_at IS NULL")
+        conn.execute("INSERT OR IGNORE INTO table_versions (name, version, updated_at) VALUES (?, 0, strftime('%s', 'now'))", (table,))
+
+        # 记录的版本号最初由触发器维护，迁移12起改由写入语句自己更新
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_insert_revision AFTER INSERT ON {table}
+        BEGIN
+            UPDATE {table} SET revision = 1, updated_at = strftime('%s', 'now') WHERE id = NEW.id;
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_update_revision AFTER UPDATE ON {table}
+        WHEN NEW.revision = OLD.revision
+        BEGIN
+            UPDATE {table} SET revision = OLD.revision + 1, updated_at = strftime('%s', 'now') WHERE id = NEW.id;
+        END
+        ''')
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1, updated_at = strftime('%s', 'now') WHERE name = '{table}';
+            END
+            ''')
+
+
+def migration_6_jobs(conn):
+    """后台任务表：生成试题、生成报告的任务由 server.py 写入，任务进程领取执行"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- 任务ID
+        kind TEXT NOT NULL, -- 任务类型：questions=生成试题，report=生成报告
+        interview_id INTEGER NOT NULL, -- 面试ID
+        status TEXT NOT NULL DEFAULT 'queued', -- 任务状态：queued=排队中，running=执行中，done=已完成，failed=已失败
+        attempts INTEGER NOT NULL DEFAULT 0, -- 已执行次数
+        run_after REAL NOT NULL, -- 最早执行时间，重试时延后
+        lease_owner TEXT, -- 领取任务的进程
+        lease_expires_at REAL, -- 租约到期时间，到期未续约的任务可被其他进程重新领取
+        last_error TEXT, -- 最近一次失败原因
+        created_at REAL, -- 创建时间，Unix时间戳
+        updated_at REAL -- 最近更新时间，Unix时间戳
+    )
+    ''')
+    # 同一面试同一类型同时只有一个未完成的任务，重复写入会被忽略
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs (kind, interview_id)
+        WHERE status IN ('queued', 'running')
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (kind, status, run_after)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_interview_id ON jobs (interview_id)')
+
+
+def migration_7_resume_texts(conn):
+    """新增 resume_texts 表，保存上传时提取的简历文本"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS resume_texts (
+        candidate_id INTEGER PRIMARY KEY, -- 候选人ID
+        resume_hash TEXT NOT NULL, -- 简历内容的 SHA-256
+        page_count INTEGER, -- 简历总页数
+        text TEXT, -- 提取的文本（受页数和字符数上限限制）
+        created_at INTEGER, -- 提取时间，Unix时间戳
+        FOREIGN KEY (candidate_id) REFERENCES candidates(id)
+    )
+    ''')
+
+
+def migration_8_question_cache(conn):
+    """新增试题缓存和岗位通用题库"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS question_cache (
+        cache_key TEXT PRIMARY KEY, -- 提示词版本:岗位ID:岗位版本号:简历文本哈希
+        position_id INTEGER NOT NULL, -- 岗位ID
+        position_revision INTEGER NOT NULL, -- 生成时的岗位版本号
+        questions TEXT NOT NULL, -- 整套试题，JSON 数组
+        created_at INTEGER -- 生成时间，Unix时间戳
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_question_cache_position_id ON question_cache (position_id, position_revision)')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS position_question_bank (
+        position_id INTEGER PRIMARY KEY, -- 岗位ID
+        position_revision INTEGER NOT NULL, -- 生成时的岗位版本号，岗位修改后重新生成
+        prompt_version INTEGER NOT NULL, -- 生成时的提示词版本
+        questions TEXT NOT NULL, -- 通用题，JSON 数组
+        created_at INTEGER -- 生成时间，Unix时间戳
+    )
+    ''')
+
+
+def migration_9_evaluations(conn):
+    """新增 evaluations 表，保存报告的评估结果和分数，用于岗位候选人排名"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS evaluations (
+        interview_id INTEGER PRIMARY KEY, -- 面试ID
+        candidate_id INTEGER NOT NULL, -- 候选人ID
+        position_id INTEGER NOT NULL, -- 岗位ID
+        technical_score REAL, -- 技术能力评分(满分100)
+        communication_score REAL, -- 沟通能力评分(满分100)
+        overall_score REAL, -- 综合评分(满分100)
+        recommendation TEXT, -- 录用建议
+        evaluation TEXT, -- 大模型返回的完整评估结果，JSON
+        created_at INTEGER, -- 评估时间，Unix时间戳
+        FOREIGN KEY (interview_id) REFERENCES interviews(id)
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_evaluations_position_score ON evaluations (position_id, overall_score DESC)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_evaluations_candidate_id ON evaluations (candidate_id)')
+
+
+def migration_10_answer_scores(conn):
+    """逐题评分：interview_questions 保存每题的评分和点评，jobs 增加 question_id 以支持逐题任务"""
+    _add_column(conn, 'interview_questions', 'score', 'REAL')  # 本题评分(满分10)
+    _add_column(conn, 'interview_questions', 'score_comments', 'TEXT')  # 本题点评
+    _add_column(conn, 'interview_questions', 'scored_at', 'INTEGER')  # 评分时间，Unix时间戳
+    _add_column(conn, 'jobs', 'question_id', 'INTEGER NOT NULL DEFAULT 0')  # 逐题任务的问题ID，其余任务为0
+    # 同一问题同时只有一个未完成的评分任务
+    conn.execute('DROP INDEX IF EXISTS idx_jobs_active')
+    conn.execute('''
+        CREATE UNIQUE INDEX idx_jobs_active ON jobs (kind, interview_id, question_id)
+        WHERE status IN ('queued', 'running')
+    ''')
+
+
+def migration_11_questions_complete(conn):
+    """interviews 新增 questions_complete：试题流式生成时，第一题写入即可开始面试，全部写入后置 1"""
+    _add_column(conn, 'interviews', 'questions_complete', 'INTEGER NOT NULL DEFAULT 0')
+    # 已生成过试题的面试视为已生成完毕
+    conn.execute('UPDATE interviews SET questions_complete = 1 WHERE status >= 1')
+
+
+def migration_12_drop_revision_triggers(conn):
+    """删除维护 revision 的触发器，改由写入语句自己更新 revision 和 updated_at"""
+    # 触发器在写入后再 UPDATE 同一行，整行（包括简历、报告 BLOB）会被重写一遍，WAL 写入量翻倍
+    for table in VERSIONED_TABLES:
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_insert_revision')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_update_revision')
+
+
+def migration_13_job_rerun(conn):
+    """jobs 新增 rerun：任务执行期间再次写入同一任务时置 1，执行完后重新排队"""
+    _add_column(conn, 'jobs', 'rerun', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def migration_14_interview_position(conn):
+    """interviews 新增 position_id：按岗位筛选面试时沿 (position_id, id) 索引倒序分页，不再经候选人子查询"""
+    _add_column(conn, 'interviews', 'position_id', 'INTEGER')
+    conn.execute('''
+        UPDATE interviews SET position_id = (SELECT position_id FROM candidates WHERE id = interviews.candidate_id)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interviews_position_id ON interviews (position_id)')
+
+
+MIGRATIONS = [
+    (1, migration_1_base_schema),
+    (2, migration_2_audio_store),
+    (3, migration_3_lookup_indexes),
+    (4, migration_4_list_filter_indexes),
+    (5, migration_5_revisions),
+    (6, migration_6_jobs),
+    (7, migration_7_resume_texts),
+    (8, migration_8_question_cache),
+    (9, migration_9_evaluations),
+    (10, migration_10_answer_scores),
+    (11, migration_11_questions_complete),
+    (12, migration_12_drop_revision_triggers),
+    (13, migration_13_job_rerun),
+    (14, migration_14_interview_position),
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn=None):
+    """应用所有尚未执行的迁移，返回迁移后的版本号"""
+    conn = conn or db.get_connection()
+    for version, migration in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        # 每个迁移及其版本号在同一个事务中提交；多个进程同时启动时，
+        # 拿到写锁后重新检查版本，避免重复执行
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version > current_version(conn):
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                print(f"数据库已迁移到版本 {version}: {migration.__doc__}")
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    return current_version(conn)
+
+
+# 热点查询及其必须使用的索引；SQL 与执行查询的代码共用（见 queries.py、job_queue.py、list_query.py）
+HOT_QUERIES = [
+    ('候选人端按 token 加载面试', queries.INTERVIEW_SESSION_BY_TOKEN, 'idx_interviews_token'),
+    ('切换语音朗读', queries.SET_VOICE_READING, 'idx_interviews_token'),
+    ('获取下一个问题', queries.NEXT_QUESTION, 'idx_interview_questions_interview_id'),
+    ('任务进程领取到期任务',
+     f'SELECT id FROM jobs WHERE {job_queue.CLAIM_CONDITIONS[0]} LIMIT 1',
+     'idx_jobs_claim'),
+    ('任务进程领取租约过期任务',
+     f'SELECT id FROM jobs WHERE {job_queue.CLAIM_CONDITIONS[1]} LIMIT 1',
+     'idx_jobs_claim'),
+    ('任务续约', queries.JOB_HEARTBEAT, 'INTEGER PRIMARY KEY'),
+    ('生成报告读取问题和回答', queries.REPORT_QUESTIONS, 'idx_interview_questions_interview_id'),
+    ('补写遗漏的任务', queries.ENQUEUE_MISSING_JOBS, 'idx_jobs_interview_id'),
+    ('岗位候选人排名', queries.POSITION_RANKING, 'idx_evaluations_position_score'),
+    ('管理后台按状态分页查询面试',
+     list_query.INTERVIEWS.page_sql({'status': '0', 'cursor': '1'})[0],
+     'idx_interviews_status'),
+    ('管理后台按岗位分页查询候选人',
+     list_query.CANDIDATES.page_sql({'position_id': '0', 'cursor': '1'})[0],
+     'idx_candidates_position_id'),
+    ('管理后台按岗位分页查询面试',
+     list_query.INTERVIEWS.page_sql({'position_id': '0', 'cursor': '1'})[0],
+     'idx_interviews_position_id'),
+    ('管理后台按负责人分页查询岗位',
+     list_query.POSITIONS.page_sql({'recruiter': '-', 'cursor': '1'})[0],
+     'idx_positions_recruiter'),
+]
+
+
+class QueryPlanError(Exception):
+    """热点查询的执行计划不符合预期：没有使用预期的索引、存在全表扫描或需要临时排序"""
+
+
+def explain(conn, sql):
+    params = (None,) * sql.count('?')
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_query_plans(conn=None):
+    """
+    检查每个热点查询都使用了预期的索引，且不需要全表扫描或临时排序
+
+    Raises:
+        QueryPlanError: 查询计划不符合预期
+    """
+    conn = conn or db.get_connection()
+    for name, sql, index in HOT_QUERIES:
+        plan = explain(conn, sql)
+        details = "; ".join(plan)
+        if not any(index in step for step in plan):
+            raise QueryPlanError(f"{name} 未使用索引 {index}: {details}")
+        # 主键查找显示为 SEARCH ... USING INTEGER PRIMARY KEY，其余 SCAN 都是全表扫描
+        if any(step.startswith('SCAN') for step in plan):
+            raise QueryPlanError(f"{name} 存在全表扫描: {details}")
+        if any('TEMP B-TREE' in step for step in plan):
+            raise QueryPlanError(f"{name} 需要临时排序: {details}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="执行数据库迁移")
+    parser.add_argument("--check", action="store_true", help="验证热点查询的执行计划")
+    args = parser.parse_args()
+
+    conn = db.get_connection()
+    print(f"当前数据库版本: {migrate(conn)}")
+
+    if args.check:
+        for name, sql, _ in HOT_QUERIES:
+            print(f"{name}: {'; '.join(explain(conn, sql))}")
+        try:
+            check_query_plans(conn)
+        except QueryPlanError as e:
+            print(f"执行计划检查失败: {e}")
+            sys.exit(1)
+        print("所有热点查询都使用了索引")
@@ -0,0 +1,62 @@
+"""
+热点查询的 SQL
+
+执行查询的代码和 migrations.py --check 使用同一份 SQL，修改查询后执行计划检查随之生效，
+不会出现检查的语句与实际执行的语句不一致。新增热点查询时在这里定义，并加入 migrations.HOT_QUERIES。
+"""
+
+# 候选人端按 token 加载面试会话
+INTERVIEW_SESSION_BY_TOKEN = '''
+    SELECT i.id, i.question_count, i.voice_reading, i.start_time, i.status, i.revision,
+           c.name as candidate_name, p.name as position_name
+    FROM interviews i
+    JOIN candidates c ON i.candidate_id = c.id
+    JOIN positions p ON c.position_id = p.id
+    WHERE i.token = ?
+'''
+
+# 候选人端切换语音朗读
+SET_VOICE_READING = '''
+    UPDATE interviews SET voice_reading = ?, revision = revision + 1, updated_at = strftime('%s', 'now')
+    WHERE token = ?
+'''
+
+# 当前问题之后的下一个问题，当前问题 id 为 0 时返回第一题
+NEXT_QUESTION = '''
+    SELECT id, question as text
+    FROM interview_questions
+    WHERE interview_id = ? AND id > ?
+    ORDER BY id ASC
+    LIMIT 1
+'''
+
+# 生成报告读取全部问题、回答和逐题评分
+REPORT_QUESTIONS = '''
+    SELECT id, question, score_standard, answer_text, score, score_comments
+    FROM interview_questions WHERE interview_id = ? ORDER BY id
+'''
+
+# 岗位候选人排名：沿 (position_id, overall_score) 索引按综合评分从高到低读取
+POSITION_RANKING = '''
+    SELECT e.interview_id, e.candidate_id, c.name AS candidate_name,
+           e.technical_score, e.communication_score, e.overall_score,
+           e.recommendation, e.created_at AS evaluated_at
+    FROM evaluations e
+    JOIN candidates c ON c.id = e.candidate_id
+    WHERE e.position_id = ?
+    ORDER BY e.overall_score DESC
+'''
+
+# 任务续约
+JOB_HEARTBEAT = '''
+    UPDATE jobs SET lease_expires_at = ?, updated_at = ?
+    WHERE id = ? AND lease_owner = ? AND status = 'running'
+'''
+
+# 为处于某状态、但从未有过该类型任务的面试补写任务
+ENQUEUE_MISSING_JOBS = '''
+    INSERT OR IGNORE INTO jobs (kind, interview_id, status, run_after, created_at, updated_at)
+    SELECT ?, i.id, ?, ?, ?, ? FROM interviews i
+    WHERE i.status = ?
+      AND NOT EXISTS (SELECT 1 FROM jobs j WHERE j.kind = ? AND j.interview_id = i.id)
+'''
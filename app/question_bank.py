@@ -0,0 +1,54 @@
+import hashlib
+import json
+import random
+
+
+def cache_key(position_id, position_revision, resume, prompt_version):
+    """试题缓存键：岗位及其版本号、简历文本哈希、提示词版本都相同时复用试题"""
+    resume_hash = hashlib.sha256((resume or "").encode('utf-8')).hexdigest()
+    return f"{prompt_version}:{position_id}:{position_revision}:{resume_hash}"
+
+
+def get_cached(conn, key):
+    """读取缓存的整套试题，没有时返回 None"""
+    row = conn.execute('SELECT questions FROM question_cache WHERE cache_key = ?', (key,)).fetchone()
+    return json.loads(row['questions']) if row else None
+
+
+def save_cached(conn, key, position_id, position_revision, questions):
+    conn.execute('''
+        INSERT OR REPLACE INTO question_cache (cache_key, position_id, position_revision, questions, created_at)
+        VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+    ''', (key, position_id, position_revision, json.dumps(questions, ensure_ascii=False)))
+    # 岗位修改后旧版本的试题不会再命中，顺便清理
+    conn.execute(
+        'DELETE FROM question_cache WHERE position_id = ? AND position_revision < ?',
+        (position_id, position_revision),
+    )
+
+
+def get_bank(conn, position_id, position_revision, prompt_version):
+    """读取岗位的通用题库；岗位或提示词修改过时视为没有"""
+    row = conn.execute('''
+        SELECT questions FROM position_question_bank
+        WHERE position_id = ? AND position_revision = ? AND prompt_version = ?
+    ''', (position_id, position_revision, prompt_version)).fetchone()
+    return json.loads(row['questions']) if row else None
+
+
+def save_bank(conn, position_id, position_revision, prompt_version, questions):
+    conn.execute('''
+        INSERT OR REPLACE INTO position_question_bank (position_id, position_revision, prompt_version, questions, created_at)
+        VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+    ''', (position_id, position_revision, prompt_version, json.dumps(questions, ensure_ascii=False)))
+
+
+def pick(bank, count):
+    """从题库中随机抽取 count 道题，不同候选人拿到的通用题不完全相同"""
+    return random.sample(bank, min(count, len(bank)))
+
+
+def delete_position(conn, position_id):
+    """删除岗位时清理其题库和缓存的试题"""
+    conn.execute('DELETE FROM position_question_bank WHERE position_id = ?', (position_id,))
+    conn.execute('DELETE FROM question_cache WHERE position_id = ?', (position_id,))
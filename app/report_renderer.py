@@ -0,0 +1,273 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from jinja2 import Environment
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+import latency_stats
+
+
+STAGES = ("template", "layout", "pdf", "total", "per_page")
+
+# Stylesheet kept separate from the template so it is parsed once per process
+REPORT_CSS = """
+body { font-family: Arial, sans-serif; margin: 40px; }
+.container { max-width: 800px; margin: auto; }
+.header { text-align: center; border-bottom: 2px solid #333; padding-bottom: 20px; }
+.section { margin-top: 20px; }
+.section h2 { color: #2c3e50; }
+.table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+.table th, .table td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+.table th { background-color: #f2f2f2; }
+.question-section { border: 1px solid #ddd; padding: 15px; margin-bottom: 15px; border-radius: 5px; }
+.question-title { font-weight: bold; color: #2c3e50; }
+.score { font-weight: bold; color: #e74c3c; }
+.footer { margin-top: 30px; text-align: center; color: #7f8c8d; }
+"""
+
+# HTML template matching the data structure returned by call_ai_model
+REPORT_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>面试报告</title>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>面试报告</h1>
+            <p>{{ interview_date }}</p>
+        </div>
+        <div class="section">
+            <h2>候选人信息</h2>
+            <table class="table">
+                <tr><th>姓名</th><td>{{ candidate_name }}</td></tr>
+                <tr><th>应聘职位</th><td>{{ position }}</td></tr>
+                <tr><th>面试官</th><td>{{ interviewer }}</td></tr>
+            </table>
+        </div>
+        <div class="section">
+            <h2>面试评估</h2>
+            <table class="table">
+                <tr><th>技术能力</th><td>{{ evaluation_result.technical_score }}/100</td></tr>
+                <tr><th>沟通能力</th><td>{{ evaluation_result.communication_score }}/100</td></tr>
+                <tr><th>综合评分</th><td>{{ evaluation_result.overall_score }}/100</td></tr>
+            </table>
+        </div>
+        <div class="section">
+            <h2>面试官评语</h2>
+            <p>{{ evaluation_result.comments }}</p>
+        </div>
+        <div class="section">
+            <h2>推荐意见</h2>
+            <p>{{ evaluation_result.recommendation }}</p>
+        </div>
+
+        <div class="section">
+            <h2>问题评估详情</h2>
+            {% for question in evaluation_result.question_evaluations %}
+            <div class="question-section">
+                <p class="question-title">问题{{ question.id }}: {{ question.question }}</p>
+                <p><strong>评分标准:</strong> {{ question.score_standard }}</p>
+                <p><strong>候选人回答:</strong> {{ question.answer }}</p>
+                <p><strong>评分:</strong> <span class="score">{{ question.score }}/10</span></p>
+                <p><strong>点评:</strong> {{ question.comments }}</p>
+            </div>
+            {% endfor %}
+        </div>
+
+        <div class="footer">
+            <p>Generated by xAI Interview System</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+# Used to load fonts and warm up layout when a rendering process starts
+SAMPLE_REPORT = {
+    "candidate_name": "示例",
+    "position": "示例",
+    "interview_date": "",
+    "interviewer": "示例",
+    "evaluation_result": {"question_evaluations": [{"id": 1, "question": "示例", "score": 0}]},
+}
+
+
+@lru_cache(maxsize=None)
+def get_template():
+    """Compile the report template once per process"""
+    return Environment().from_string(REPORT_TEMPLATE)
+
+
+@lru_cache(maxsize=None)
+def get_styles():
+    """Font configuration and parsed stylesheet, shared by every render in this process"""
+    font_config = FontConfiguration()
+    return font_config, CSS(string=REPORT_CSS, font_config=font_config)
+
+
+def render_pdf(model_output):
+    """
+    Render the report to PDF bytes
+
+    Returns (pdf_bytes, page_count, timings) where timings holds the seconds
+    spent in each stage.
+    """
+    started = time.perf_counter()
+    rendered_html = get_template().render(**model_output)
+    templated = time.perf_counter()
+
+    font_config, stylesheet = get_styles()
+    document = HTML(string=rendered_html).render(stylesheets=[stylesheet], font_config=font_config)
+    laid_out = time.perf_counter()
+
+    pdf_bytes = document.write_pdf()
+    finished = time.perf_counter()
+
+    page_count = len(document.pages)
+    timings = {
+        "template": templated - started,
+        "layout": laid_out - templated,
+        "pdf": finished - laid_out,
+        "total": finished - started,
+        "per_page": (finished - started) / max(page_count, 1),
+    }
+    return pdf_bytes, page_count, timings
+
+
+def _warm_up():
+    # Runs in each rendering process as it starts: compile the template,
+    # parse the stylesheet and load fonts before the first real report
+    render_pdf(SAMPLE_REPORT)
+
+
+class ReportRenderer:
+    """
+    Pool of warm PDF rendering processes
+
+    WeasyPrint layout is CPU-bound and holds the GIL, so reports are rendered
+    in separate processes. Each process compiles the template, parses the
+    stylesheet and loads fonts once when it starts and reuses them for every
+    report, and several reports can render in parallel.
+
+    A render that takes longer than timeout seconds fails, and the pool is
+    rebuilt so the stuck process is terminated. If a rendering process dies
+    and breaks the pool, the pool is rebuilt as well; the reports that were
+    rendering fail and are retried by the job queue.
+
+    Args:
+        workers: number of rendering processes
+        stats_window: number of recent renders used for the timing statistics
+        timeout: longest time a single report may take to render, in seconds
+    """
+
+    def __init__(self, workers=2, stats_window=1000, timeout=60):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._rendered = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._restarts = 0
+        self._pages = 0
+        self._timings = {stage: deque(maxlen=stats_window) for stage in STAGES}
+
+    def start(self):
+        self._executor = self._create_executor()
+        # Submit a no-op so the processes start (and warm up) now rather than
+        # on the first report
+        self._executor.submit(int).result()
+
+    async def render(self, model_output):
+        """Render a report in the pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            executor = self._executor
+        try:
+            try:
+                future = loop.run_in_executor(executor, render_pdf, model_output)
+            except BrokenProcessPool:
+                executor = self._restart(executor)
+                future = loop.run_in_executor(executor, render_pdf, model_output)
+            pdf_bytes, page_count, timings = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            print(f"Report rendering took longer than {self.timeout} s, restarting the rendering pool")
+            with self._stats_lock:
+                self._timed_out += 1
+            self._restart(executor)
+            raise
+        except BrokenProcessPool:
+            print("Rendering process exited unexpectedly, restarting the rendering pool")
+            with self._stats_lock:
+                self._failed += 1
+            self._restart(executor)
+            raise
+        except Exception:
+            with self._stats_lock:
+                self._failed += 1
+            raise
+
+        with self._stats_lock:
+            self._rendered += 1
+            self._pages += page_count
+            for stage, seconds in timings.items():
+                self._timings[stage].append(seconds)
+        print(f"Rendered report: {page_count} pages in {timings['total'] * 1000:.0f} ms "
+              f"(template {timings['template'] * 1000:.0f} ms, layout {timings['layout'] * 1000:.0f} ms, "
+              f"pdf {timings['pdf'] * 1000:.0f} ms)")
+        return pdf_bytes
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+
+    def _restart(self, broken):
+        """Replace a broken or stuck pool; when several renders notice the same pool, it is rebuilt once"""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = self._create_executor()
+                with self._stats_lock:
+                    self._restarts += 1
+            executor = self._executor
+        # ProcessPoolExecutor has no public way to stop its processes, so a
+        # stuck render can only be terminated directly
+        for process in list((broken._processes or {}).values()):
+            process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+        return executor
+
+    def stats(self):
+        """Render counts and per-stage timings in milliseconds"""
+        with self._stats_lock:
+            result = {
+                "workers": self.workers,
+                "rendered": self._rendered,
+                "failed": self._failed,
+                "timed_out": self._timed_out,
+                "restarts": self._restarts,
+                "pages": self._pages,
+            }
+            for stage, values in self._timings.items():
+                ordered = sorted(values)
+                result[f"{stage}_ms_avg"] = round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0
+                result[f"{stage}_ms_p99"] = round(latency_stats.percentile(ordered, 0.99) * 1000, 2)
+        return result
+
+
+def create_renderer_from_env():
+    """Create the rendering pool from REPORT_RENDER_WORKERS and REPORT_RENDER_TIMEOUT"""
+    return ReportRenderer(
+        workers=int(os.getenv("REPORT_RENDER_WORKERS", "2")),
+        timeout=float(os.getenv("REPORT_RENDER_TIMEOUT", "60")),
+    )
@@ -0,0 +1,287 @@
+import hashlib
+import io
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+import db
+
+
+# 超出上限的页数和字符不再解析，避免异常的 PDF 拖慢进程或撑大提示词
+MAX_PAGES = int(os.getenv("RESUME_MAX_PAGES", "20"))
+MAX_CHARS = int(os.getenv("RESUME_MAX_CHARS", "20000"))
+
+# 解析失败或超时的简历保存的文本，生成试题时不再重新解析
+UNPARSEABLE = "无法解析简历内容"
+
+
+def resume_hash(pdf_content):
+    return hashlib.sha256(pdf_content or b'').hexdigest()
+
+
+# 从PDF二进制数据中提取文本内容，返回 (文本, 页数)
+def extract_text_from_pdf(pdf_content, max_pages=MAX_PAGES, max_chars=MAX_CHARS):
+    # 如果输入是None或空值，返回提示文本
+    if pdf_content is None or pdf_content == b'':
+        return "无简历内容", 0
+
+    try:
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
+        page_count = len(pdf_reader.pages)
+
+        # 逐页提取文本，达到页数或字符上限后停止
+        parts = []
+        length = 0
+        for page in pdf_reader.pages[:max_pages]:
+            text = page.extract_text() or ""
+            parts.append(text)
+            length += len(text) + 1
+            if length >= max_chars:
+                break
+        text = "\n".join(parts)[:max_chars]
+
+        if not text.strip():
+            return "无法从PDF中提取文本内容", page_count
+        return text, page_count
+    except Exception as e:
+        print(f"PDF文本提取错误: {str(e)}")
+        # 如果pdf解析失败，尝试作为纯文本处理
+        try:
+            if isinstance(pdf_content, bytes):
+                return pdf_content.decode('utf-8', errors='ignore')[:max_chars], 0
+            return str(pdf_content)[:max_chars], 0
+        except Exception:
+            return UNPARSEABLE, 0
+
+
+def save(conn, candidate_id, content_hash, text, page_count):
+    """保存提取结果；候选人已被删除时不保存"""
+    conn.execute('''
+        INSERT OR REPLACE INTO resume_texts (candidate_id, resume_hash, page_count, text, created_at)
+        SELECT id, ?, ?, ?, strftime('%s', 'now') FROM candidates WHERE id = ?
+    ''', (content_hash, page_count, text, candidate_id))
+
+
+def load(conn, candidate_id):
+    """读取已提取的简历文本，没有时返回 None"""
+    row = conn.execute(
+        'SELECT resume_hash, page_count, text FROM resume_texts WHERE candidate_id = ?',
+        (candidate_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def get_or_extract(conn, candidate_id, extractor):
+    """
+    返回候选人的简历文本，优先使用上传时提取的结果
+
+    升级前上传的简历或上传后提取尚未完成时，在 extractor 的进程池中提取一次并等待结果
+    （同样受超时限制），结果保存后后续面试直接复用。
+    """
+    cached = load(conn, candidate_id)
+    if cached is not None:
+        return cached['text']
+
+    row = conn.execute('SELECT resume_content FROM candidates WHERE id = ?', (candidate_id,)).fetchone()
+    if row is None:
+        return None
+    content = row['resume_content']
+    text, page_count = extractor.extract(content)
+    save(conn, candidate_id, resume_hash(content), text, page_count)
+    return text
+
+
+class ResumeExtractor:
+    """
+    在进程池中提取上传简历的文本
+
+    创建候选人后提交简历，PDF 解析在子进程中进行，不占用请求线程和 GIL；
+    提取完成后结果写入 resume_texts 表，生成试题时直接读取。
+
+    页数和字符上限不限制解析时间：同时交给进程池的简历不超过子进程数，每份简历一交出即开始解析，
+    超过 timeout 秒仍未完成的保存为无法解析，并重建进程池以终止卡住的子进程。
+    子进程意外退出导致进程池损坏时同样重建，受影响的简历重新提交一次。
+    submit 只把简历放入队列，不会抛出异常；最终提取失败的简历由生成试题的进程通过 extract 重新提取。
+
+    Args:
+        workers: 子进程数量
+        max_pages: 最多解析的页数
+        max_chars: 最多保存的字符数
+        timeout: 单份简历最长解析时间（秒）
+    """
+
+    def __init__(self, workers=2, max_pages=MAX_PAGES, max_chars=MAX_CHARS, timeout=30):
+        self.workers = workers
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self._executor = None
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._extracted = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._restarts = 0
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        # 提交一个空任务，让子进程在启动时就创建好，而不是在第一次上传时
+        self._executor.submit(int).result()
+        threading.Thread(target=self._dispatch_loop, name="resume-extract", daemon=True).start()
+
+    def submit(self, candidate_id, pdf_content):
+        with self._lock:
+            self._pending += 1
+        self._queue.put({"candidate_id": candidate_id, "content": pdf_content,
+                         "hash": resume_hash(pdf_content), "retried": False})
+
+    def extract(self, pdf_content):
+        """
+        在进程池中提取一份简历并等待结果，返回 (文本, 页数)
+
+        与 submit 共用子进程名额和超时：超时的简历返回无法解析并重建进程池，
+        进程池损坏时重建并重新提交一次，再次损坏同样返回无法解析。
+        """
+        with self._slots:
+            for attempt in range(2):
+                with self._lock:
+                    executor = self._executor
+                try:
+                    future = executor.submit(extract_text_from_pdf, pdf_content, self.max_pages, self.max_chars)
+                    return future.result(timeout=self.timeout)
+                except TimeoutError:
+                    print(f"简历超过 {self.timeout} 秒未解析完成，重建提取进程池")
+                    with self._lock:
+                        self._timed_out += 1
+                    self._restart(executor)
+                    return UNPARSEABLE, 0
+                except BrokenProcessPool as e:
+                    self._restart(executor)
+                    if attempt:
+                        print(f"提取简历文本失败，进程池已损坏: {str(e)}")
+                        return UNPARSEABLE, 0
+
+    def _dispatch_loop(self):
+        while True:
+            task = self._queue.get()
+            self._slots.acquire()
+            try:
+                self._dispatch(task)
+            except Exception as e:
+                self._slots.release()
+                print(f"提交候选人 {task['candidate_id']} 的简历提取失败: {str(e)}")
+                self._finish(task, "failed")
+
+    def _dispatch(self, task):
+        with self._lock:
+            executor = self._executor
+        try:
+            future = executor.submit(extract_text_from_pdf, task["content"], self.max_pages, self.max_chars)
+        except BrokenProcessPool:
+            executor = self._restart(executor)
+            future = executor.submit(extract_text_from_pdf, task["content"], self.max_pages, self.max_chars)
+        task["settled"] = False
+        task["timer"] = threading.Timer(self.timeout, self._on_timeout, args=(task, future, executor))
+        task["timer"].daemon = True
+        task["timer"].start()
+        future.add_done_callback(lambda f: self._on_done(task, f, executor))
+
+    def _on_done(self, task, future, executor):
+        task["timer"].cancel()
+        self._slots.release()
+        try:
+            text, page_count = future.result()
+        except BrokenProcessPool as e:
+            if not self._settle(task):
+                # 超时后进程池被重建，已由 _on_timeout 处理
+                return
+            self._restart(executor)
+            if not task["retried"]:
+                # 进程池中其他简历导致的损坏，重新提交一次
+                task["retried"] = True
+                self._queue.put(task)
+                return
+            print(f"提取候选人 {task['candidate_id']} 的简历文本失败，进程池已损坏: {str(e)}")
+            self._finish(task, "failed")
+            return
+        except Exception as e:
+            self._settle(task)
+            # 失败时生成试题的进程会重新提取
+            print(f"提取候选人 {task['candidate_id']} 的简历文本失败: {str(e)}")
+            self._finish(task, "failed")
+            return
+
+        if self._settle(task):
+            self._save(task, text, page_count)
+            self._finish(task, "extracted")
+
+    def _on_timeout(self, task, future, executor):
+        if future.done() or not self._settle(task):
+            return
+        print(f"候选人 {task['candidate_id']} 的简历超过 {self.timeout} 秒未解析完成，重建提取进程池")
+        # 保存为无法解析，生成试题时不再重新解析这份简历
+        self._save(task, UNPARSEABLE, 0)
+        self._finish(task, "timed_out")
+        self._restart(executor)
+
+    def _save(self, task, text, page_count):
+        try:
+            save(db.get_connection(), task["candidate_id"], task["hash"], text, page_count)
+        except Exception as e:
+            print(f"保存候选人 {task['candidate_id']} 的简历文本失败: {str(e)}")
+
+    def _restart(self, broken):
+        """重建进程池并终止旧进程池的子进程；多个线程同时发现同一个进程池损坏时只重建一次"""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._restarts += 1
+            executor = self._executor
+        # ProcessPoolExecutor 没有公开终止子进程的接口，卡住的子进程只能直接终止
+        for process in list((broken._processes or {}).values()):
+            process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+        return executor
+
+    def _settle(self, task):
+        """超时和完成回调可能同时发生，每次提交只由先到的一方处理，返回是否由本次调用处理"""
+        with self._lock:
+            if task["settled"]:
+                return False
+            task["settled"] = True
+            return True
+
+    def _finish(self, task, result):
+        with self._lock:
+            self._pending -= 1
+            if result == "extracted":
+                self._extracted += 1
+            elif result == "timed_out":
+                self._timed_out += 1
+            else:
+                self._failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "extracted": self._extracted,
+                "failed": self._failed,
+                "timed_out": self._timed_out,
+                "restarts": self._restarts,
+            }
+
+
+def create_extractor_from_env():
+    """根据环境变量创建简历提取进程池：RESUME_EXTRACT_WORKERS、RESUME_EXTRACT_TIMEOUT"""
+    return ResumeExtractor(
+        workers=int(os.getenv("RESUME_EXTRACT_WORKERS", "2")),
+        timeout=float(os.getenv("RESUME_EXTRACT_TIMEOUT", "30")),
+    )
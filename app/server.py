@@ -1,44 +1,45 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, jsonify, request, send_file, Response
 import sqlite3
-from io import BytesIO
 from flask_cors import CORS
 import time
 import string
+import threading
 import secrets
 from datetime import datetime
-import whisper
-import io
-import tempfile
 import torch
 import os
-import subprocess
+import db
+import transcription
+import asr_batcher
+import answer_stream
+import audio_decode
+import vad
+import asr_backend
+import transcript_cache
+import audio_store
+import migrations
+import list_query
+import blob_stream
+from urllib.parse import quote
+import hashlib
+import session_cache
+import job_queue
+import resume_text
+import question_bank
+import evaluations
+import interview_state
+import queries
 
 
-# 检查数据库文件是否存在
-if not os.path.exists('interview_system.db'):
-    # 调用数据库初始化脚本 ，直接调用 create_interview_system_db.py 脚本
-    print("数据库文件不存在，正在初始化数据库...")
-    import create_interview_system_db   
-    print("数据库初始化完成")
-    
+# 每次启动都执行数据库迁移：新数据库建表，旧数据库补充新字段和索引
+print(f"数据库版本：{migrations.migrate()}")
 
-print("torch 版本：", torch.__version__)
 
+print("torch 版本：", torch.__version__)
 
-# https://huggingface.co/openai/whisper-large-v3
-# 加载 large-v3 模型 ， 确保 GPU 可用
-if torch.cuda.is_available():
-    whisperModel = whisper.load_model("large-v3").to("cuda")  # 显式移动到 GPU
-    print("GPU 可用，使用 large-v3 模型")
-else:
-    whisperModel = whisper.load_model("base")
-    print("GPU 不可用，使用 base 模型")
 
-# tiny：最小的模型，适合资源受限的设备，速度快但精度较低。
-# base：基础模型，平衡了速度和精度，适合一般用途。
-# small：中等规模模型，精度高于 base，适合需要更好性能的场景。
-# medium：中大型模型，精度进一步提高，适合高质量转录。
-# large：最大模型，精度最高，适合专业级应用，但需要更多计算资源。
+# 语音识别后端：通过 ASR_BACKEND、ASR_MODEL、ASR_DECODE_PRESET 等环境变量选择
+asr = asr_backend.load_backend_from_env()
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 
@@ -50,20 +51,362 @@ def generate_token(length=32):
     token = ''.join(secrets.choice(alphabet) for _ in range(length))
     return token
 
+# 当前线程复用的数据库连接，无需关闭
 def get_db():
-    conn = sqlite3.connect('interview_system.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.get_connection()
+
+# 语音转写：在后台工作线程中执行
+def transcribe_audio(audio_data):
+    # 相同录音与模型配置的转写结果直接复用
+    cache_key = transcript_cache.TranscriptCache.make_key(audio_data, asr.fingerprint())
+    text = transcripts.get(cache_key, count_miss=False)
+    if text is not None:
+        return text
+    
+    # 从 webm 音频文件 提取 中文文本，此处获得的text是繁体中文，但是不影响后续功能
+    text = transcribe_pcm(decode_audio(audio_data))
+    transcripts.put(cache_key, text, len(audio_data))
+    return text
+
+# 去除首尾静音并在停顿处切分，各片段合并到同一批次解码
+def transcribe_pcm(audio):
+    segments = vad.segment_speech(audio, vad_config)
+    vad_stats.record(len(audio), segments)
+    if not segments:
+        return ""
+    texts = batch_transcriber.transcribe_many([audio[start:end] for start, end in segments])
+    return "".join(texts)
+
+# 分片上传时在停顿处切出可转写的片段
+def find_stream_cut(audio, min_offset):
+    return vad.find_pause(audio, min_offset, vad_config)
+
+# 将上传的音频在内存中解码为 16kHz 单声道 float32 数组，不产生临时文件
+def decode_audio(audio_data):
+    return decoder_pool.decode(audio_data)
+
+# 所有问题都已回答且转写完毕时，将面试状态更新为"面试完毕"(3)
+def finalize_interview_if_complete(conn, interview_id):
+    if not interview_state.finalize_if_complete(conn, interview_id):
+        return False
+    sessions.invalidate(interview_id=interview_id)
+    return True
+
+# 回填 answer_text，写入逐题评分任务，并检查面试是否已完成
+# audio_hash 为转写所用录音的哈希，回答已被重新录制时丢弃旧录音的转写结果
+def save_answer_text(question_id, interview_id, text, audio_hash):
+    conn = get_db()
+    cursor = conn.execute('''
+        UPDATE interview_questions SET answer_text = ?
+        WHERE id = ? AND interview_id = ? AND answer_audio_hash IS ?
+    ''', (text, question_id, interview_id, audio_hash))
+    if cursor.rowcount > 0:
+        job_queue.enqueue(conn, job_queue.KIND_SCORE, interview_id, question_id=question_id)
+    finalize_interview_if_complete(conn, interview_id)
+
+# 转写队列完成回调
+def save_transcription(job, text):
+    save_answer_text(job.question_id, job.interview_id, text, job.audio_hash)
+
+# 分片上传完成回调：增量转写失败时，整段音频重新放入转写队列
+# 录音已保存、候选人已进入下一题，不受排队上限限制
+def save_streamed_transcription(session, text):
+    if text is not None:
+        save_answer_text(session.question_id, session.interview_id, text, session.audio_hash)
+        return
+    transcription_queue.submit(session.question_id, session.interview_id, limit=False)
+
+# 转写任务读取回答录音，返回 (录音, 录音哈希)
+def load_transcription_audio(question_id):
+    row = get_db().execute('''
+        SELECT answer_audio, answer_audio_hash FROM interview_questions WHERE id = ?
+    ''', (question_id,)).fetchone()
+    audio_data = load_answer_audio(row) if row else None
+    if not audio_data:
+        return None
+    return audio_data, row['answer_audio_hash']
+
+# 读取回答录音：新录音在文件存储中，未迁移的旧录音仍在 BLOB 字段
+def load_answer_audio(row):
+    if row['answer_audio_hash']:
+        return audio_files.read(row['answer_audio_hash'])
+    return row['answer_audio']
+
+# 保存回答音频到文件存储，数据库只记录哈希和长度；answer_text 为空时由转写完成后回填
+# 重新作答时清除上一次回答的评分，有 answer_text 时立即写入评分任务
+def record_answer(conn, interview_id, question_id, audio_data, answer_text=None):
+    audio_hash, audio_size = audio_files.put(audio_data)
+    cursor = conn.execute('''
+        UPDATE interview_questions
+        SET answer_audio = NULL, answer_audio_hash = ?, answer_audio_size = ?, answer_text = ?, answered_at = ?,
+            score = NULL, score_comments = NULL, scored_at = NULL
+        WHERE id = ? AND interview_id = ?
+    ''', (audio_hash, audio_size, answer_text, int(time.time()), question_id, interview_id))
+    if cursor.rowcount == 0:
+        return False
+    if answer_text is not None:
+        job_queue.enqueue(conn, job_queue.KIND_SCORE, interview_id, question_id=int(question_id))
+    return True
+
+# 构造提交答案后的响应：下一个问题，或面试已完成
+def build_next_question_result(conn, interview_id, question_id, transcription_status=transcription.STATUS_QUEUED):
+    # 获取下一个问题
+    next_question = conn.execute(queries.NEXT_QUESTION, (interview_id, question_id)).fetchone()
+    
+    # 如果没有下一个问题，检查是否所有问题都已回答并转写完毕
+    if not next_question:
+        # 如果所有问题都已回答且转写完毕，将面试状态更新为"已完成"
+        # 否则由最后一个完成的转写任务更新状态
+        finalize_interview_if_complete(conn, interview_id)
+        
+        return {
+            "status": "success",
+            "message": "答案已提交",
+            "transcription_status": transcription_status,
+            "next_question": end_of_questions(conn, interview_id)
+        }
+    return {
+        "status": "success",
+        "message": "答案已提交",
+        "transcription_status": transcription_status,
+        "next_question": dict(next_question)
+    }
+
+# 已生成的问题都已答完时，区分面试结束和后续问题仍在生成中
+def end_of_questions(conn, interview_id):
+    row = conn.execute('SELECT questions_complete FROM interviews WHERE id = ?', (interview_id,)).fetchone()
+    if row and not row['questions_complete']:
+        return {"id": 0, "text": "下一题正在生成，请稍候", "pending": True}
+    return {"id": 0, "text": "面试已完成"}
+
+# 候选人端接口的处理逻辑，Flask 路由和 candidate_api.py 中的异步路由共用，两者返回相同的 JSON
+# 返回 current_question_id 之后的问题，current_question_id 为 0 时返回第一题
+def next_question(conn, interview_id, current_question_id=0):
+    question = conn.execute(queries.NEXT_QUESTION, (interview_id, current_question_id)).fetchone()
+    
+    # 如果没有下一个问题，返回结束标志；问题仍在生成时带 pending 标志，客户端稍后重试
+    if not question:
+        return end_of_questions(conn, interview_id)
+    return dict(question)
+
+# 保存回答音频并提交转写，返回 (响应, 状态码)
+def submit_answer_audio(conn, interview_id, question_id, audio_data):
+    # 重复提交的相同录音直接使用缓存的转写结果，不经过模型
+    cached_text = transcripts.get(transcript_cache.TranscriptCache.make_key(audio_data, asr.fingerprint()))
+    if cached_text is not None:
+        if not record_answer(conn, interview_id, question_id, audio_data, cached_text):
+            return {"error": "问题不存在"}, 404
+        return build_next_question_result(conn, interview_id, question_id, transcription.STATUS_DONE), 200
+    
+    # 先保存音频，answer_text 由转写任务完成后回填
+    if not record_answer(conn, interview_id, question_id, audio_data):
+        return {"error": "问题不存在"}, 404
+    
+    # 将转写任务放入后台队列
+    if not transcription_queue.submit(int(question_id), interview_id):
+        # 队列已满，撤销本次提交，由候选人重新提交
+        conn.execute('UPDATE interview_questions SET answered_at = NULL WHERE id = ?', (question_id,))
+        return {"error": "服务繁忙，请稍后重试"}, 503
+    
+    return build_next_question_result(conn, interview_id, question_id), 200
+
+def set_voice_reading(conn, token, enabled):
+    conn.execute(queries.SET_VOICE_READING, (1 if enabled else 0, token))
+    sessions.invalidate(token=token)
+    return {'status': 'success', 'voice_reading': enabled}
+
+# 服务启动时，为已保存音频但尚未转写、也没有转写任务的回答补写任务（升级前的回答，或分片转写中途退出）
+def requeue_pending_transcriptions():
+    conn = get_db()
+    rows = conn.execute('''
+        SELECT q.id, q.interview_id FROM interview_questions q
+        WHERE q.answered_at IS NOT NULL AND q.answer_text IS NULL
+          AND (q.answer_audio_hash IS NOT NULL OR q.answer_audio IS NOT NULL)
+          AND NOT EXISTS (
+              SELECT 1 FROM jobs j
+              WHERE j.interview_id = q.interview_id AND j.kind = ? AND j.question_id = q.id
+                AND j.status IN ('queued', 'running')
+          )
+    ''', (job_queue.KIND_TRANSCRIBE,)).fetchall()
+    for row in rows:
+        transcription_queue.submit(row['id'], row['interview_id'], limit=False)
+    if rows:
+        print(f"重新提交 {len(rows)} 个未完成的转写任务")
+
+# 按 token 加载候选人端的面试会话
+def load_interview_session(token):
+    row = get_db().execute(queries.INTERVIEW_SESSION_BY_TOKEN, (token,)).fetchone()
+    return dict(row) if row else None
+
+# 面试的当前版本号：每次修改面试都会加一，多个 worker 据此发现其他进程对面试的修改
+def load_interview_revision(interview_id):
+    row = get_db().execute('SELECT revision FROM interviews WHERE id = ?', (interview_id,)).fetchone()
+    return row['revision'] if row else None
+
+# 将会话信息转换为候选人端的面试信息
+def interview_info_result(session):
+    if session['start_time']:
+        time_text = datetime.fromtimestamp(session['start_time']).strftime('%Y年%m月%d日 %H:%M')
+    else:
+        time_text = "未设置时间"
+    return {
+        "interview_id": session['id'],
+        "time": time_text,
+        "position": session['position_name'],
+        "candidate": session['candidate_name'],
+        "status": session['status'],
+        "question_count": session['question_count'],
+        "voice_reading": session['voice_reading']
+    }
+
+# 候选人端按 token 查找面试时先查进程内缓存，命中时只按主键核对版本号
+sessions = session_cache.create_session_cache_from_env(load_interview_session, load_interview_revision)
+
+# 上传的简历在进程池中提取文本，生成试题时不再重复解析 PDF
+resume_extractor = resume_text.create_extractor_from_env()
+
+# 回答录音保存在按内容寻址的文件存储中
+audio_files = audio_store.create_store_from_env()
+
+# 按音频内容缓存转写结果，重复提交时不再调用模型
+transcripts = transcript_cache.create_cache_from_env()
+
+# 语音活动检测：跳过静音部分，统计节省的音频时长
+vad_config = vad.VadConfig.from_env()
+vad_stats = vad.VadStats()
+
+# 常驻 ffmpeg 解码进程池
+decoder_pool = audio_decode.create_pool_from_env()
+
+# 多个面试同时作答时，将待转写音频合并成批一次解码
+batch_transcriber = asr_batcher.create_batcher_from_env(asr)
+
+# 转写任务保存在 jobs 表中，由各 worker 的转写线程领取
+transcription_queue = transcription.create_queue_from_env(load_transcription_audio, transcribe_audio, save_transcription)
+
+# 分片上传的回答在作答过程中增量转写，会话保存在各 worker 共用的目录中
+stream_manager = answer_stream.create_manager_from_env(decode_audio, transcribe_pcm, save_streamed_transcription,
+                                                       find_stream_cut)
+
+def start_background_services(requeue=True):
+    """
+    启动进程池和后台线程
+
+    子进程和线程不会随 fork 复制，gunicorn 预加载模式下由每个 worker 在 fork 之后调用（见 gunicorn.conf.py）；
+    requeue 为 True 时补写遗漏的转写任务，多个 worker 中只需一个执行；需要扫描回答表，
+    在后台线程中执行，不阻塞 worker 启动。
+    """
+    resume_extractor.start()
+    decoder_pool.start()
+    batch_transcriber.start()
+    transcription_queue.start()
+    if requeue:
+        threading.Thread(target=requeue_pending_transcriptions, name="requeue-transcriptions", daemon=True).start()
+
+# 下载、列表和静态页面的缓存策略：不随请求者变化，浏览器和共享缓存都可以保存，但每次使用前需用 ETag 验证
+CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "public, no-cache")
+# 候选人端按 token 访问的接口只返回该面试自己的数据，只允许浏览器缓存
+PRIVATE_CACHE_CONTROL = os.getenv("HTTP_PRIVATE_CACHE_CONTROL", "private, no-cache")
+
+@app.after_request
+def set_default_cache_control(response):
+    if request.path.startswith('/api/interview/'):
+        response.headers['Cache-Control'] = PRIVATE_CACHE_CONTROL
+    elif request.path.startswith(app.static_url_path + '/'):
+        response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+def is_not_modified(etag, updated_at=None):
+    """客户端缓存的版本与 etag（或 updated_at）一致时返回 True"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if updated_at and request.if_modified_since:
+        return int(updated_at) <= int(request.if_modified_since.timestamp())
+    return False
+
+def with_cache_headers(response, etag, updated_at=None):
+    response.set_etag(etag)
+    if updated_at:
+        response.last_modified = int(updated_at)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+def not_modified(etag, updated_at=None):
+    return with_cache_headers(Response(status=304), etag, updated_at)
+
+def list_response(spec):
+    """
+    返回列表接口的响应
+
+    ETag 由请求参数和 table_versions 中各表的版本号计算，表未变化时直接返回 304，不执行列表查询。
+    """
+    conn = get_db()
+    versions = conn.execute('SELECT name, version, updated_at FROM table_versions ORDER BY name').fetchall()
+    etag = hashlib.sha1(f"{request.full_path}|{[tuple(row) for row in versions]}".encode("utf-8")).hexdigest()
+    updated_at = max((row['updated_at'] or 0 for row in versions), default=None)
+    if is_not_modified(etag, updated_at):
+        return not_modified(etag, updated_at)
+    try:
+        result = spec.query(conn, request.args, version=tuple(tuple(row) for row in versions))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return with_cache_headers(jsonify(result), etag, updated_at)
+
+def send_blob(reader, mimetype, file_name, as_attachment=True, etag=None):
+    """
+    分块发送数据库中的 BLOB，支持单个 Range 请求
+
+    响应结束（或客户端断开）时关闭 reader 的数据库连接。
+    """
+    start, end, status = 0, reader.length, 200
+    # If-Range 与当前版本不一致时忽略 Range，返回完整内容
+    if request.range and (not request.if_range or request.if_range.etag == etag):
+        byte_range = request.range.range_for_length(reader.length)
+        if byte_range is None:
+            reader.close()
+            return Response(status=416, headers={'Content-Range': f'bytes */{reader.length}'})
+        start, end = byte_range
+        status = 206
+
+    response = Response(reader.iter_range(start, end), status=status, mimetype=mimetype, direct_passthrough=True)
+    response.call_on_close(reader.close)
+    response.headers['Content-Length'] = str(end - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{reader.length}'
+    disposition = 'attachment' if as_attachment else 'inline'
+    # 中文文件名按 RFC 5987 编码
+    response.headers['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(file_name)}"
+    if etag:
+        with_cache_headers(response, etag, reader.info.get('updated_at'))
+    return response
 
 # 岗位管理
 @app.route('/api/positions', methods=['GET'])
 def get_positions():
+    return list_response(list_query.POSITIONS)
+
+@app.route('/api/positions/<int:id>', methods=['GET'])
+def get_position(id):
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM positions')
-    positions = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(positions)
+    position = conn.execute('SELECT * FROM positions WHERE id=?', (id,)).fetchone()
+    if position is None:
+        return jsonify({'error': '岗位不存在'}), 404
+    etag = f"position-{id}-r{position['revision']}"
+    if is_not_modified(etag, position['updated_at']):
+        return not_modified(etag, position['updated_at'])
+    return with_cache_headers(jsonify(dict(position)), etag, position['updated_at'])
+
+# 岗位候选人排名：按报告中的综合评分从高到低返回前 limit 名（默认10）
+@app.route('/api/positions/<int:id>/ranking', methods=['GET'])
+def get_position_ranking(id):
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit 必须是整数'}), 400
+    limit = max(1, min(limit, list_query.MAX_LIMIT))
+    conn = get_db()
+    return jsonify({'position_id': id, 'items': evaluations.ranking(conn, id, limit)})
 
 @app.route('/api/positions', methods=['POST'])
 def create_position():
@@ -71,11 +414,9 @@ def create_position():
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO positions (name, requirements, responsibilities, quantity, status, created_at, recruiter)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO positions (name, requirements, responsibilities, quantity, status, created_at, recruiter, revision, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1, strftime('%s', 'now'))
     ''', (data['name'], data['requirements'], data['responsibilities'], data['quantity'], data['status'], int(time.time()), data['recruiter']))
-    conn.commit()
-    conn.close()
     return jsonify({'status': 'success'})
 
 @app.route('/api/positions/<int:id>', methods=['PUT'])
@@ -84,31 +425,28 @@ def update_position(id):
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
-        UPDATE positions SET name=?, requirements=?, responsibilities=?, quantity=?, status=?, recruiter=?
+        UPDATE positions SET name=?, requirements=?, responsibilities=?, quantity=?, status=?, recruiter=?,
+            revision=revision + 1, updated_at=strftime('%s', 'now')
         WHERE id=?
     ''', (data['name'], data['requirements'], data['responsibilities'], data['quantity'], data['status'], data['recruiter'], id))
-    conn.commit()
-    conn.close()
+    # 会话中缓存了岗位名称
+    sessions.clear()
     return jsonify({'status': 'success'})
 
 @app.route('/api/positions/<int:id>', methods=['DELETE'])
 def delete_position(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM positions WHERE id=?', (id,))
-    conn.commit()
-    conn.close()
+    # 岗位、评估结果和题库在同一事务中删除，不会只删掉一部分
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM positions WHERE id=?', (id,))
+        conn.execute('DELETE FROM evaluations WHERE position_id=?', (id,))
+        question_bank.delete_position(conn, id)
+    sessions.clear()
     return jsonify({'status': 'success'})
 
 # 候选人管理
 @app.route('/api/candidates', methods=['GET'])
 def get_candidates():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id,position_id, name, email  FROM candidates')
-    candidates = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(candidates)
+    return list_response(list_query.CANDIDATES)
 
 @app.route('/api/candidates', methods=['POST'])
 def create_candidate():
@@ -119,71 +457,83 @@ def create_candidate():
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO candidates (position_id, name, email, resume_content)
-        VALUES (?, ?, ?, ?)
+        INSERT INTO candidates (position_id, name, email, resume_content, revision, updated_at)
+        VALUES (?, ?, ?, ?, 1, strftime('%s', 'now'))
     ''', (data['position_id'], data['name'], data['email'],  resume_binary))
-    conn.commit()
-    conn.close()
+    if resume_content:
+        resume_extractor.submit(cursor.lastrowid, resume_content)
     return jsonify({'status': 'success'})
 
 @app.route('/api/candidates/<int:id>/resume', methods=['GET'])
 def download_resume(id):
+    # 先比较版本号，缓存有效时不读取简历内容
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT resume_content FROM candidates WHERE id=?', (id,))
-    resume = cursor.fetchone()
-    conn.close()
-    if resume and resume['resume_content']:
-        return send_file(BytesIO(resume['resume_content']), download_name=f'resume_{id}.pdf', as_attachment=True)
-    return jsonify({'error': '简历不存在'}), 404
+    candidate = conn.execute('SELECT revision, updated_at FROM candidates WHERE id=? AND length(resume_content) > 0', (id,)).fetchone()
+    if candidate is None:
+        return jsonify({'error': '简历不存在'}), 404
+    etag = f"resume-{id}-r{candidate['revision']}"
+    if is_not_modified(etag, candidate['updated_at']):
+        return not_modified(etag, candidate['updated_at'])
+
+    reader = blob_stream.BlobReader('candidates', 'resume_content', id, info_columns=('revision', 'updated_at'))
+    if reader.length is None:
+        reader.close()
+        return jsonify({'error': '简历不存在'}), 404
+    return send_blob(reader, 'application/pdf', f'resume_{id}.pdf', etag=f"resume-{id}-r{reader.info['revision']}")
 
 # 删除候选人
 @app.route('/api/candidates/<int:id>', methods=['DELETE'])
 def delete_candidate(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM candidates WHERE id=?', (id,))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM candidates WHERE id=?', (id,))
+        conn.execute('DELETE FROM resume_texts WHERE candidate_id=?', (id,))
+        conn.execute('DELETE FROM evaluations WHERE candidate_id=?', (id,))
+    sessions.clear()
     return jsonify({'status': 'success'})
 
 
 # 面试管理
+# 按面试状态写入后台任务：未开始的面试生成试题，面试完毕的生成报告
+def enqueue_interview_job(conn, interview_id, status):
+    if int(status) == 0:
+        job_queue.enqueue(conn, job_queue.KIND_QUESTIONS, interview_id)
+    elif int(status) == 3:
+        job_queue.enqueue(conn, job_queue.KIND_REPORT, interview_id)
+
 @app.route('/api/interviews', methods=['GET'])
 def get_interviews():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, candidate_id, interviewer, start_time, status, is_passed, token FROM interviews')
-    interviews = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(interviews)
+    return list_response(list_query.INTERVIEWS)
 
 @app.route('/api/interviews', methods=['POST'])
 def create_interview():
     data = request.json
     data['token'] = generate_token()
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO interviews (candidate_id, interviewer, start_time, status, is_passed , token)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (data['candidate_id'], data['interviewer'], data['start_time'], data['status'], data['is_passed'], data['token'] ))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO interviews (candidate_id, position_id, interviewer, start_time, status, is_passed , token, revision, updated_at)
+            VALUES (?, (SELECT position_id FROM candidates WHERE id = ?), ?, ?, ?, ?, ?, 1, strftime('%s', 'now'))
+        ''', (data['candidate_id'], data['candidate_id'], data['interviewer'], data['start_time'], data['status'], data['is_passed'], data['token'] ))
+        enqueue_interview_job(conn, cursor.lastrowid, data['status'])
     return jsonify({'status': 'success'})
 
 @app.route('/api/interviews/<int:id>', methods=['PUT'])
 def update_interview(id):
     data = request.json
     data['token'] = generate_token()
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE interviews SET candidate_id=?, interviewer=?, start_time=?, status=?, is_passed=? ,token=?
-        WHERE id=?
-    ''', (data['candidate_id'], data['interviewer'], data['start_time'], data['status'], data['is_passed'], data['token'], id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE interviews SET candidate_id=?, position_id=(SELECT position_id FROM candidates WHERE id = ?),
+                interviewer=?, start_time=?, status=?, is_passed=? ,token=?,
+                revision=revision + 1, updated_at=strftime('%s', 'now')
+            WHERE id=?
+        ''', (data['candidate_id'], data['candidate_id'], data['interviewer'], data['start_time'], data['status'], data['is_passed'], data['token'], id))
+        # 管理员把状态改回"未开始"或"面试完毕"时重新生成试题或报告
+        if cursor.rowcount > 0:
+            enqueue_interview_job(conn, id, data['status'])
+    # 编辑面试会更换 token，旧 token 立即失效
+    sessions.invalidate(interview_id=id)
     return jsonify({'status': 'success'})
 
 # API: 下载面试报告
@@ -191,87 +541,108 @@ def update_interview(id):
 def download_interview_report(interview_id):
     conn = get_db()
     
-    # 获取面试信息及报告内容
-    interview = conn.execute('''SELECT id, candidate_id, report_content FROM interviews WHERE id = ? ''', (interview_id, )).fetchone()
-    
-    conn.close()
+    # 获取面试信息，报告内容分块读取
+    interview = conn.execute('''SELECT id, revision, updated_at, length(report_content) > 0 AS has_report FROM interviews WHERE id = ? ''', (interview_id, )).fetchone()
     
     if not interview:
         return jsonify({"error": "面试不存在"}), 404
     
-    if not interview['report_content']:
+    if not interview['has_report']:
         return jsonify({"error": "面试报告尚未生成"}), 404
     
-    # 将BLOB转换为字节流
-    report_data = io.BytesIO(interview['report_content'])
+    # 版本号未变化时直接返回 304，不读取报告内容
+    etag = f"report-{interview_id}-r{interview['revision']}"
+    if is_not_modified(etag, interview['updated_at']):
+        return not_modified(etag, interview['updated_at'])
+    
+    reader = blob_stream.BlobReader('interviews', 'report_content', interview_id, info_columns=('revision', 'updated_at'))
+    if reader.length is None:
+        reader.close()
+        return jsonify({"error": "面试报告尚未生成"}), 404
     
     # 生成文件名
     file_name = f"面试报告_{interview['id']}.pdf"
     
     # 发送文件
-    return send_file(
-        report_data,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=file_name
-    )
+    return send_blob(reader, 'application/pdf', file_name, etag=f"report-{interview_id}-r{reader.info['revision']}")
+
+# API: 下载回答录音，支持 Range 请求
+@app.route('/api/interviews/<int:interview_id>/questions/<int:question_id>/audio', methods=['GET'])
+def download_answer_audio(interview_id, question_id):
+    conn = get_db()
+    question = conn.execute('''
+        SELECT answer_audio_hash, answer_audio IS NOT NULL AS has_blob
+        FROM interview_questions WHERE id = ? AND interview_id = ?
+    ''', (question_id, interview_id)).fetchone()
+    
+    if not question:
+        return jsonify({"error": "问题不存在"}), 404
+    
+    file_name = f"answer_{interview_id}_{question_id}.webm"
+    if question['answer_audio_hash']:
+        # send_file 对文件路径自动处理 Range、ETag 和 Last-Modified
+        return send_file(audio_files.path(question['answer_audio_hash']), mimetype='audio/webm',
+                         download_name=file_name, conditional=True, etag=question['answer_audio_hash'])
+    
+    if question['has_blob']:
+        # 尚未迁移的旧录音
+        reader = blob_stream.BlobReader('interview_questions', 'answer_audio', question_id)
+        if reader.length is not None:
+            return send_blob(reader, 'audio/webm', file_name, as_attachment=False)
+        reader.close()
+    
+    return jsonify({"error": "录音不存在"}), 404
 
 # API: 删除面试
 @app.route('/api/interviews/<int:id>', methods=['DELETE'])
 def delete_interview(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # 先删除相关的面试问题
-    cursor.execute('DELETE FROM interview_questions WHERE interview_id = ?', (id,))
-    
-    # 然后删除面试记录
-    cursor.execute('DELETE FROM interviews WHERE id = ?', (id,))
+    with db.transaction() as conn:
+        # 先删除相关的面试问题
+        conn.execute('DELETE FROM interview_questions WHERE interview_id = ?', (id,))
+        
+        # 删除未执行的后台任务和评估结果
+        conn.execute('DELETE FROM jobs WHERE interview_id = ?', (id,))
+        conn.execute('DELETE FROM evaluations WHERE interview_id = ?', (id,))
+        
+        # 然后删除面试记录
+        conn.execute('DELETE FROM interviews WHERE id = ?', (id,))
     
-    conn.commit()
-    conn.close()
+    sessions.invalidate(interview_id=id)
     return jsonify({'status': 'success'})
 
 # API: 获取面试信息
 @app.route('/api/interview/<token>/info', methods=['GET'])
 def get_interview_info(token):
-    conn = get_db()
+    session = sessions.get(token)
     
-    # 获取面试及相关信息
-    interview_info = conn.execute('''
-        SELECT i.id, i.question_count, i.voice_reading, i.start_time, i.status,
-               c.name as candidate_name, c.email as candidate_email,
-               p.name as position_name, p.requirements
-        FROM interviews i
-        JOIN candidates c ON i.candidate_id = c.id
-        JOIN positions p ON c.position_id = p.id
-        WHERE i.token = ?
-    ''', (token,)).fetchone()
+    if not session:
+        return jsonify({"error": "面试不存在"}), 404
     
-    conn.close()
+    return jsonify(interview_info_result(session))
+
+# API: 一次返回面试信息和全部问题，候选人端在本地切换问题
+@app.route('/api/interview/<token>/bundle', methods=['GET'])
+def get_interview_bundle(token):
+    session = sessions.get(token)
     
-    if not interview_info:
+    if not session:
         return jsonify({"error": "面试不存在"}), 404
     
-    # 转换为字典
-    result = dict(interview_info)
+    conn = get_db()
+    questions = conn.execute('''
+        SELECT id, question as text, answered_at IS NOT NULL as answered
+        FROM interview_questions
+        WHERE interview_id = ?
+        ORDER BY id ASC
+    ''', (session['id'],)).fetchall()
     
-    # 格式化时间
-    if result['start_time']:
-        result['time'] = datetime.fromtimestamp(result['start_time']).strftime('%Y年%m月%d日 %H:%M')
-    else:
-        result['time'] = "未设置时间"
-    
-    # 构造返回数据
-    return jsonify({
-        "interview_id": result['id'],
-        "time": result['time'],
-        "position": result['position_name'],
-        "candidate": result['candidate_name'],
-        "status": result['status'],
-        "question_count": result['question_count'],
-        "voice_reading": result['voice_reading']
-    })
+    # 试题流式生成时问题可能还没有全部写入，questions_complete 为 false 时客户端需稍后重新获取
+    complete = conn.execute('SELECT questions_complete FROM interviews WHERE id = ?', (session['id'],)).fetchone()
+    
+    result = interview_info_result(session)
+    result['questions'] = [dict(question) for question in questions]
+    result['questions_complete'] = bool(complete and complete['questions_complete'])
+    return jsonify(result)
 
 # API: 获取下一个问题
 @app.route('/api/interview/<token>/get_question', methods=['GET'])
@@ -281,50 +652,21 @@ def get_next_question(token):
     conn = get_db()
     
     # 先获取面试ID
-    interview = conn.execute('SELECT id FROM interviews WHERE token = ?', (token,)).fetchone()
+    interview = sessions.get(token)
     
     if not interview:
-        conn.close()
         return jsonify({"id": 0, "text": "面试无效"}), 404
     
-    # 获取下一个问题
-    next_question = None
-    if current_question_id == 0:
-        # 获取第一个问题
-        next_question = conn.execute('''
-            SELECT id, question as text
-            FROM interview_questions
-            WHERE interview_id = ?
-            ORDER BY id ASC
-            LIMIT 1
-        ''', (interview['id'],)).fetchone()
-    else:
-        # 获取下一个问题
-        next_question = conn.execute('''
-            SELECT id, question as text
-            FROM interview_questions
-            WHERE interview_id = ? AND id > ?
-            ORDER BY id ASC
-            LIMIT 1
-        ''', (interview['id'], current_question_id)).fetchone()
-    
-    conn.close()
-    
-    # 如果没有下一个问题，返回结束标志
-    if not next_question:
-        return jsonify({"id": 0, "text": "面试已完成"})
-    
-    return jsonify(dict(next_question))
+    return jsonify(next_question(conn, interview['id'], current_question_id))
 
 # API: 提交答案
 @app.route('/api/interview/<token>/submit_answer', methods=['POST'])
 def submit_answer(token):
     conn = get_db()
     # 验证令牌
-    interview = conn.execute('SELECT id FROM interviews WHERE token = ?', (token,)).fetchone()
+    interview = sessions.get(token)
     
     if not interview:
-        conn.close()
         return jsonify({"error": "面试不存在"}), 404
     
     # 获取问题ID和音频答案
@@ -332,81 +674,141 @@ def submit_answer(token):
     audio_answer = request.files.get('audio_answer')
     
     if not question_id or not audio_answer:
-        conn.close()
         return jsonify({"error": "缺少必要参数"}), 400
     
-    audio_data = audio_answer.read()
-    # 从 webm 音频文件 提取 中文文本
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-        temp_file.write(audio_data)
-        temp_file_path = temp_file.name
+    result, status = submit_answer_audio(conn, interview['id'], question_id, audio_answer.read())
+    return jsonify(result), status
 
-    # 使用 transcribe 处理临时文件，此处获得的text是繁体中文，但是不影响后续功能
-    result = whisperModel.transcribe(temp_file_path, language="zh")
-    audio_text = result["text"]
+# API: 分片上传回答音频，作答过程中边上传边转写
+@app.route('/api/interview/<token>/questions/<int:question_id>/stream', methods=['POST'])
+def stream_answer_chunk(token, question_id):
+    interview = sessions.get(token)
+    
+    if not interview:
+        return jsonify({"error": "面试不存在"}), 404
+    
+    if request.content_length and request.content_length > stream_manager.max_bytes:
+        return jsonify({"error": "录音过大"}), 413
+    
+    # 只接收属于本面试的问题的分片
+    exists = get_db().execute('SELECT 1 FROM interview_questions WHERE id = ? AND interview_id = ?',
+                              (question_id, interview['id'])).fetchone()
+    if not exists:
+        return jsonify({"error": "问题不存在"}), 404
+    
+    seq = request.form.get('seq', type=int)
+    chunk = request.files.get('chunk')
+    if seq is None or not chunk:
+        return jsonify({"error": "缺少必要参数"}), 400
+    
+    try:
+        accepted, session = stream_manager.append(interview['id'], question_id, seq, chunk.read())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+    if not accepted:
+        # 分片顺序错误，客户端应从 expected_seq 开始重传
+        expected_seq = session['received_seq'] + 1 if session else 0
+        return jsonify({"error": "分片顺序错误", "expected_seq": expected_seq}), 409
+    
+    return jsonify({"status": "success", **session})
 
-    answered_time = int(time.time())
+# API: 结束分片上传，保存完整音频并返回下一个问题
+@app.route('/api/interview/<token>/questions/<int:question_id>/stream/finish', methods=['POST'])
+def finish_answer_stream(token, question_id):
+    conn = get_db()
+    interview = sessions.get(token)
     
-    conn.execute('''
-        UPDATE interview_questions
-        SET answer_audio = ?, answer_text = ?, answered_at = ?
-        WHERE id = ? AND interview_id = ?
-    ''', (audio_data, audio_text, answered_time, question_id, interview['id']))
+    if not interview:
+        return jsonify({"error": "面试不存在"}), 404
     
-    # 获取下一个问题
-    next_question = conn.execute('''
-        SELECT id, question as text
-        FROM interview_questions
-        WHERE interview_id = ? AND id > ?
-        ORDER BY id ASC
-        LIMIT 1
-    ''', (interview['id'], question_id)).fetchone()
+    exists = conn.execute('SELECT 1 FROM interview_questions WHERE id = ? AND interview_id = ?',
+                          (question_id, interview['id'])).fetchone()
+    if not exists:
+        return jsonify({"error": "问题不存在"}), 404
     
-    conn.commit()
+    def persist(audio_data):
+        if not record_answer(conn, interview['id'], question_id, audio_data):
+            return None
+        return build_next_question_result(conn, interview['id'], question_id)
     
-    # 如果没有下一个问题，检查是否所有问题都已回答
-    if not next_question:
-        # 检查是否所有问题都已回答
-        all_answered = conn.execute('''
-            SELECT COUNT(*) as total, SUM(CASE WHEN answered_at IS NOT NULL THEN 1 ELSE 0 END) as answered
-            FROM interview_questions
-            WHERE interview_id = ?
-        ''', (interview['id'],)).fetchone()
-        
-        # 如果所有问题都已回答，将面试状态更新为"已完成"
-        if all_answered['total'] == all_answered['answered']:
-            conn.execute('UPDATE interviews SET status = 3 WHERE id = ?', (interview['id'],))
-            conn.commit()
-        
-        result = {
-            "status": "success",
-            "message": "答案已提交",
-            "next_question": {"id": 0, "text": "面试已完成"}
-        }
-    else:
-        result = {
-            "status": "success",
-            "message": "答案已提交",
-            "next_question": dict(next_question)
-        }
+    # 先保存完整音频再转写剩余部分，转写结果由回调写入 answer_text
+    result = stream_manager.finish(interview['id'], question_id, persist)
     
-    conn.close()
+    if result is None:
+        return jsonify({"error": "没有可提交的音频分片"}), 409
     return jsonify(result)
 
+# API: 查询回答的转写进度
+@app.route('/api/interview/<token>/questions/<int:question_id>/transcription', methods=['GET'])
+def get_transcription_status(token, question_id):
+    interview = sessions.get(token)
+    if not interview:
+        return jsonify({"error": "问题不存在"}), 404
+    
+    conn = get_db()
+    question = conn.execute('''
+        SELECT id, answer_text, answered_at
+        FROM interview_questions
+        WHERE id = ? AND interview_id = ?
+    ''', (question_id, interview['id'])).fetchone()
+    
+    if not question:
+        return jsonify({"error": "问题不存在"}), 404
+    
+    job = transcription_queue.status(interview['id'], question_id)
+    stream = stream_manager.status(interview['id'], question_id)
+    if stream and not job:
+        # 分片上传中：返回部分转写结果
+        result = {"question_id": question_id, "status": stream['status'],
+                  "partial_text": stream['partial_text'], "segments": stream['segments']}
+        if question['answer_text'] is not None:
+            result["answer_text"] = question['answer_text']
+        return jsonify(result)
+    if question['answered_at'] is None:
+        status = 'not_answered'
+    elif job:
+        status = job['status']
+    elif question['answer_text'] is None:
+        status = transcription.STATUS_QUEUED
+    else:
+        status = transcription.STATUS_DONE
+    
+    result = {"question_id": question_id, "status": status}
+    if job:
+        result["attempts"] = job['attempts']
+        result["error"] = job['error']
+    if question['answer_text'] is not None:
+        result["answer_text"] = question['answer_text']
+    return jsonify(result)
+
+# API: 语音识别吞吐量与等待时间统计
+@app.route('/api/asr/stats', methods=['GET'])
+def get_asr_stats():
+    stats = batch_transcriber.stats()
+    stats['transcription_pending'] = transcription_queue.pending_count()
+    stats['decode'] = decoder_pool.stats()
+    stats['vad'] = vad_stats.to_dict()
+    stats['cache'] = transcripts.stats()
+    return jsonify(stats)
+
+# API: 后台任务队列统计
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_stats():
+    stats = job_queue.stats(get_db())
+    stats['resume_extract'] = resume_extractor.stats()
+    return jsonify(stats)
+
 # New API endpoint to toggle voice reading
 @app.route('/api/interview/<token>/toggle_voice_reading', methods=['POST'])
 def toggle_voice_reading(token):
     data = request.json
     enabled = data.get('enabled', False)
     
-    conn = get_db()
-    # Update voice reading setting
-    conn.execute('UPDATE interviews SET voice_reading = ? WHERE token = ?', 
-                (1 if enabled else 0, token))
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'status': 'success', 'voice_reading': enabled})
+    return jsonify(set_voice_reading(get_db(), token, enabled))
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
+    # 本地调试：单进程运行，生产环境使用 gunicorn -c gunicorn.conf.py server:app
+    # 不开启自动重载：重载器的父子进程会各自启动进程池并重复提交未完成的转写；
+    # 不开启调试器：交互式调试器可在浏览器中执行任意代码
+    start_background_services()
+    app.run(debug=False, use_reloader=False, host='0.0.0.0', port=8000)
\ No newline at end of file
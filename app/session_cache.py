@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionCache:
+    """
+    进程内的 token -> 面试会话缓存
+
+    候选人端每个接口都要先按 token 查找面试，命中缓存时不再执行多表联合查询。
+    本进程内修改面试（编辑、删除、切换语音朗读、面试完成）时调用 invalidate 立即失效；
+    提供 revision_loader 时，命中缓存后还会按面试 ID 读取当前版本号，与缓存的 revision 不一致
+    （其他 worker 或后台任务进程修改过面试）时重新加载，否则其他进程的修改最多延迟 ttl 秒生效。
+    不存在的 token 不缓存，避免随意构造的 token 占满缓存。
+
+    Args:
+        loader: 按 token 加载会话的函数，返回 dict（须含 id 字段，使用 revision_loader 时还须含 revision）或 None
+        ttl: 缓存有效期（秒）
+        max_entries: 最多缓存的会话数，超出后淘汰最久未使用的
+        revision_loader: 按面试 ID 返回当前版本号的函数，面试已删除时返回 None
+    """
+
+    def __init__(self, loader, ttl=30, max_entries=10000, revision_loader=None):
+        self.loader = loader
+        self.revision_loader = revision_loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token -> (过期时间, 会话)
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(token)
+                cached = entry[1]
+            else:
+                cached = None
+
+        if cached is not None:
+            if self.revision_loader is None or self.revision_loader(cached['id']) == cached['revision']:
+                return cached
+            self.invalidate(token=token)
+
+        session = self.loader(token)
+        if session is None:
+            return None
+        with self._lock:
+            self._entries[token] = (now + self.ttl, session)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return session
+
+    def invalidate(self, token=None, interview_id=None):
+        """按 token 或面试 ID 使缓存失效"""
+        with self._lock:
+            if token is not None:
+                self._entries.pop(token, None)
+            if interview_id is not None:
+                for key in [key for key, (_, session) in self._entries.items() if session['id'] == interview_id]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def create_session_cache_from_env(loader, revision_loader=None):
+    """根据环境变量创建会话缓存：SESSION_CACHE_TTL、SESSION_CACHE_MAX_ENTRIES"""
+    return SessionCache(
+        loader,
+        ttl=float(os.getenv("SESSION_CACHE_TTL", "30")),
+        max_entries=int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000")),
+        revision_loader=revision_loader,
+    )
@@ -1,5 +1,5 @@
 #!/bin/sh
-python server.py &
+gunicorn -c gunicorn.conf.py server:app &
 python generate_interview_questions.py &
 python generate_interview_reports.py &
 wait
\ No newline at end of file
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class TranscriptCache:
+    """
+    按音频内容缓存转写结果
+
+    键为音频二进制数据与模型配置的 SHA-256，候选人网络不稳定导致重复提交
+    同一段录音时直接返回已有结果，不再调用模型。缓存保存在独立的 SQLite 文件中，
+    重启后仍然有效；条目数超过 max_entries 时按最近使用时间淘汰。
+
+    Args:
+        path: 缓存数据库文件路径
+        max_entries: 最多保留的条目数
+    """
+
+    def __init__(self, path="transcript_cache.db", max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._size = 0
+
+    def _connection(self):
+        """
+        当前进程的连接，调用方需持有 _lock
+
+        SQLite 连接不能跨 fork 使用：gunicorn 预加载时缓存对象在主进程中创建，
+        因此连接推迟到首次使用时打开，fork 出的每个 worker 各自打开一个。
+        """
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._pid = os.getpid()
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS transcripts (
+                key TEXT PRIMARY KEY, -- 音频与模型配置的哈希
+                text TEXT NOT NULL, -- 转写文本
+                audio_size INTEGER, -- 音频字节数
+                created_at INTEGER, -- 写入时间，Unix时间戳
+                last_used_at REAL -- 最近命中时间，用于 LRU 淘汰
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_transcripts_last_used ON transcripts (last_used_at)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM transcripts').fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def make_key(audio_data, fingerprint):
+        digest = hashlib.sha256()
+        digest.update(fingerprint.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(audio_data)
+        return digest.hexdigest()
+
+    def get(self, key, count_miss=True):
+        """
+        返回缓存的文本，未命中返回 None
+
+        同一段录音可能先后在提交接口和转写任务中各查一次，第二次查询传入
+        count_miss=False，避免未命中被重复统计。
+        """
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT text FROM transcripts WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self.hits += 1
+            conn.execute('UPDATE transcripts SET last_used_at = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key, text, audio_size=None):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO transcripts (key, text, audio_size, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, text, audio_size, int(now), now))
+            self._size += cursor.rowcount
+            if self._size > self.max_entries:
+                self._evict()
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            self._connection()
+            total = self.hits + self.misses
+            return {
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0,
+            }
+
+    def _evict(self):
+        # 一次多淘汰 10%，避免每次写入都触发淘汰
+        target = int(self.max_entries * 0.9)
+        self._conn.execute('''
+            DELETE FROM transcripts WHERE key IN (
+                SELECT key FROM transcripts ORDER BY last_used_at ASC LIMIT ?
+            )
+        ''', (self._size - target,))
+        self._size = self._conn.execute('SELECT COUNT(*) FROM transcripts').fetchone()[0]
+
+
+def create_cache_from_env():
+    """根据环境变量创建转写缓存：TRANSCRIPT_CACHE_PATH、TRANSCRIPT_CACHE_MAX_ENTRIES"""
+    return TranscriptCache(
+        path=os.getenv("TRANSCRIPT_CACHE_PATH", "transcript_cache.db"),
+        max_entries=int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "10000")),
+    )
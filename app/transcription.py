@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+
+import db
+import job_queue
+
+
+# 转写任务状态
+STATUS_QUEUED = 'queued'          # 已入队，等待转写
+STATUS_PROCESSING = 'processing'  # 转写中
+STATUS_DONE = 'done'              # 转写完成
+STATUS_FAILED = 'failed'          # 多次重试后仍失败
+
+# jobs 表中的任务状态对应的转写状态
+_JOB_STATUS = {
+    job_queue.STATUS_QUEUED: STATUS_QUEUED,
+    job_queue.STATUS_RUNNING: STATUS_PROCESSING,
+    job_queue.STATUS_DONE: STATUS_DONE,
+    job_queue.STATUS_FAILED: STATUS_FAILED,
+}
+
+
+class TranscriptionJob:
+    def __init__(self, question_id, interview_id, audio_hash, attempts):
+        self.question_id = question_id
+        self.interview_id = interview_id
+        # 转写所用录音的哈希，回写结果时据此丢弃已被重新录制的回答的结果
+        self.audio_hash = audio_hash
+        self.attempts = attempts
+
+
+class TranscriptionQueue:
+    """
+    有界的后台转写工作池
+
+    submit_answer 只负责把录音保存到文件存储并在 jobs 表中写入转写任务，由转写线程领取执行：
+    调用 load_fn 读取录音、transcribe_fn 完成转写，结果通过 on_complete(job, text) 回调写回数据库。
+    任务保存在数据库中，gunicorn 的每个 worker 都启动 max_workers 个转写线程，任何 worker 都可以领取；
+    worker 退出或崩溃后，未完成的任务在租约到期后由其他 worker 重新领取。
+
+    Args:
+        load_fn: load_fn(question_id) 返回 (录音二进制数据, 录音哈希)，回答已删除或没有录音时返回 None
+        transcribe_fn: 转写函数，接收音频二进制数据，返回文本
+        on_complete: 转写完成（或最终失败，text 为空字符串）后的回调
+        max_workers: 本进程的转写线程数量
+        max_pending: 所有进程合计最多允许排队的任务数，超过时 submit 返回 False
+        max_attempts: 单个任务的最大尝试次数
+        lease_seconds: 任务租约时长，进程崩溃后最多经过这么久任务会被其他 worker 重新领取
+        retry_delay: 转写失败后重试前的等待秒数，之后每次翻倍
+        poll_interval: 空闲时检查是否有新任务的间隔（秒）；到期的重试最迟 1 秒后被领取
+    """
+
+    def __init__(self, load_fn, transcribe_fn, on_complete, max_workers=2, max_pending=100, max_attempts=3,
+                 lease_seconds=60, retry_delay=1, poll_interval=0.2):
+        self.load_fn = load_fn
+        self.transcribe_fn = transcribe_fn
+        self.on_complete = on_complete
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._workers = [
+            job_queue.JobWorker(job_queue.KIND_TRANSCRIBE, self._handle, lease_seconds=lease_seconds,
+                                max_attempts=max_attempts, retry_delay=retry_delay, poll_interval=poll_interval,
+                                recheck_interval=1)
+            for _ in range(max_workers)
+        ]
+        self._threads = []
+
+    def start(self):
+        for i, worker in enumerate(self._workers):
+            thread = threading.Thread(target=worker.run_forever, name=f"transcriber-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, question_id, interview_id, limit=True):
+        """
+        写入转写任务，排队的任务已达上限时返回 False
+
+        limit 为 False 时不检查上限，用于录音已保存、候选人已进入下一题的回答，这些任务不能被丢弃。
+        """
+        if limit and self.pending_count() >= self.max_pending:
+            return False
+        job_queue.enqueue(db.get_connection(), job_queue.KIND_TRANSCRIBE, interview_id, question_id=int(question_id))
+        return True
+
+    def status(self, interview_id, question_id):
+        """返回问题最近一次转写任务的状态，没有转写任务时返回 None"""
+        row = db.get_connection().execute('''
+            SELECT status, attempts, last_error, created_at, updated_at FROM jobs
+            WHERE interview_id = ? AND kind = ? AND question_id = ?
+            ORDER BY id DESC LIMIT 1
+        ''', (interview_id, job_queue.KIND_TRANSCRIBE, question_id)).fetchone()
+        if row is None:
+            return None
+        return {
+            "question_id": question_id,
+            "status": _JOB_STATUS.get(row['status'], row['status']),
+            "attempts": row['attempts'],
+            # 只返回异常信息，不返回调用栈
+            "error": row['last_error'].split("\n", 1)[0] if row['last_error'] else None,
+            "enqueued_at": row['created_at'],
+            "updated_at": row['updated_at'],
+        }
+
+    def pending_count(self):
+        return db.get_connection().execute('''
+            SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = ?
+        ''', (job_queue.KIND_TRANSCRIBE, job_queue.STATUS_QUEUED)).fetchone()[0]
+
+    def drain(self, timeout):
+        """
+        不再领取新任务，等待本进程正在执行的转写完成，超时返回 False；进程退出前调用
+
+        排队中的任务保留在数据库中，由其他 worker 继续执行。
+        """
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.stop()
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _handle(self, job):
+        loaded = self.load_fn(job['question_id'])
+        if loaded is None:
+            # 回答已删除，或已被清空
+            return
+        audio_data, audio_hash = loaded
+        transcription_job = TranscriptionJob(job['question_id'], job['interview_id'], audio_hash, job['attempts'])
+        if job['attempts'] > self.max_attempts:
+            # 已达最大次数仍被重新领取，说明执行时进程崩溃，不再尝试
+            self.on_complete(transcription_job, "")
+            return
+        try:
+            text = self.transcribe_fn(audio_data)
+        except Exception as e:
+            print(f"问题ID: {job['question_id']} 第{job['attempts']}次转写失败: {str(e)}")
+            if job['attempts'] >= self.max_attempts:
+                # 多次失败后写入空文本，避免面试永远无法进入"面试完毕"状态；任务仍记为失败
+                self.on_complete(transcription_job, "")
+            raise
+        self.on_complete(transcription_job, text)
+
+
+def create_queue_from_env(load_fn, transcribe_fn, on_complete):
+    """
+    根据环境变量创建转写队列：TRANSCRIBE_WORKERS、TRANSCRIBE_QUEUE_SIZE，
+    租约和轮询间隔与其他后台任务相同（JOB_LEASE_SECONDS、JOB_POLL_INTERVAL）
+    """
+    return TranscriptionQueue(
+        load_fn,
+        transcribe_fn,
+        on_complete,
+        max_workers=int(os.getenv("TRANSCRIBE_WORKERS", "8")),
+        max_pending=int(os.getenv("TRANSCRIBE_QUEUE_SIZE", "100")),
+        lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+        poll_interval=float(os.getenv("JOB_POLL_INTERVAL", "0.2")),
+    )
@@ -0,0 +1,185 @@
+import os
+import threading
+
+import numpy as np
+
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = SAMPLE_RATE * 30 // 1000  # 30ms 一帧
+
+
+class VadConfig:
+    """
+    基于能量的语音活动检测参数
+
+    Args:
+        margin_db: 语音帧能量需高出背景噪声的分贝数
+        floor_db: 低于该能量（dBFS）的帧一律视为静音
+        min_silence_seconds: 短于该时长的停顿不作为分段点
+        padding_seconds: 每段语音前后保留的余量，避免截掉字头字尾
+        max_segment_seconds: 单段最长时长，需小于 Whisper 的 30 秒解码窗口
+    """
+
+    def __init__(self, margin_db=10.0, floor_db=-55.0, min_silence_seconds=0.5,
+                 padding_seconds=0.2, max_segment_seconds=25.0):
+        self.margin_db = margin_db
+        self.floor_db = floor_db
+        self.min_silence_frames = max(1, int(min_silence_seconds * SAMPLE_RATE / FRAME_SAMPLES))
+        self.padding_samples = int(padding_seconds * SAMPLE_RATE)
+        self.max_segment_samples = int(max_segment_seconds * SAMPLE_RATE)
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量创建配置：VAD_MARGIN_DB、VAD_MIN_SILENCE_SECONDS、VAD_MAX_SEGMENT_SECONDS"""
+        return cls(
+            margin_db=float(os.getenv("VAD_MARGIN_DB", "10")),
+            min_silence_seconds=float(os.getenv("VAD_MIN_SILENCE_SECONDS", "0.5")),
+            max_segment_seconds=float(os.getenv("VAD_MAX_SEGMENT_SECONDS", "25")),
+        )
+
+
+class VadStats:
+    """累计处理的音频时长与被跳过的静音时长"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clips = 0
+        self.segments = 0
+        self.silent_clips = 0
+        self.total_seconds = 0.0
+        self.skipped_seconds = 0.0
+
+    def record(self, total_samples, segments):
+        speech_samples = sum(end - start for start, end in segments)
+        with self._lock:
+            self.clips += 1
+            self.segments += len(segments)
+            if not segments:
+                self.silent_clips += 1
+            self.total_seconds += total_samples / SAMPLE_RATE
+            self.skipped_seconds += (total_samples - speech_samples) / SAMPLE_RATE
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "clips": self.clips,
+                "segments": self.segments,
+                "silent_clips": self.silent_clips,
+                "total_seconds": round(self.total_seconds, 1),
+                "skipped_seconds": round(self.skipped_seconds, 1),
+                "skipped_ratio": round(self.skipped_seconds / self.total_seconds, 3) if self.total_seconds else 0,
+            }
+
+
+def frame_energy_db(audio):
+    """按 30ms 分帧计算每帧能量（dBFS）"""
+    n_frames = len(audio) // FRAME_SAMPLES
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * FRAME_SAMPLES].reshape(n_frames, FRAME_SAMPLES)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    return (20 * np.log10(np.maximum(rms, 1e-10))).astype(np.float32)
+
+
+def speech_mask(energy, config):
+    """
+    判断每帧是否为语音
+
+    阈值取背景噪声（能量的第10百分位）加 margin_db，但不超过峰值以下 20dB，
+    以免整段都在说话时把语音误判为噪声。
+    """
+    if len(energy) == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = float(np.percentile(energy, 10))
+    peak = float(energy.max())
+    threshold = max(min(noise_floor + config.margin_db, peak - 20.0), config.floor_db)
+    return energy > threshold
+
+
+def _speech_regions(mask, config):
+    """将语音帧合并为区域，短于 min_silence_frames 的停顿不拆分，返回帧区间列表"""
+    regions = []
+    start = None
+    silence = 0
+    for i, is_speech in enumerate(mask):
+        if is_speech:
+            if start is None:
+                start = i
+            silence = 0
+        elif start is not None:
+            silence += 1
+            if silence >= config.min_silence_frames:
+                regions.append((start, i - silence + 1))
+                start = None
+                silence = 0
+    if start is not None:
+        regions.append((start, len(mask) - silence))
+    return regions
+
+
+def _split_long(start, end, energy, config):
+    """超长的连续语音在能量最低的帧处切开"""
+    pieces = []
+    max_frames = config.max_segment_samples // FRAME_SAMPLES
+    while end - start > max_frames:
+        # 在窗口后半段寻找最安静的帧作为切点
+        search_from = start + max_frames // 2
+        cut = search_from + int(np.argmin(energy[search_from:start + max_frames]))
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, end))
+    return pieces
+
+
+def segment_speech(audio, config):
+    """
+    去除首尾静音，并在停顿处把长回答切分为多个片段
+
+    相邻语音区域在不超过 max_segment_seconds 的前提下合并为一段：Whisper 会把
+    每段补齐到 30 秒再编码，片段越少编码次数越少。短回答通常只有一段，
+    长回答在停顿处切开，每段都能放入单个解码窗口。
+
+    Returns:
+        [(起始样本, 结束样本), ...]，没有检测到语音时返回空列表
+    """
+    energy = frame_energy_db(audio)
+    mask = speech_mask(energy, config)
+
+    regions = []
+    for start, end in _speech_regions(mask, config):
+        regions.extend(_split_long(start, end, energy, config))
+
+    segments = []
+    for start, end in regions:
+        start_sample = max(0, start * FRAME_SAMPLES - config.padding_samples)
+        end_sample = min(len(audio), end * FRAME_SAMPLES + config.padding_samples)
+        if segments and end_sample - segments[-1][0] <= config.max_segment_samples:
+            segments[-1] = (segments[-1][0], end_sample)
+        elif segments and start_sample < segments[-1][1]:
+            # 余量重叠时从两段的中点切开
+            middle = (start_sample + segments[-1][1]) // 2
+            segments[-1] = (segments[-1][0], middle)
+            segments.append((middle, end_sample))
+        else:
+            segments.append((start_sample, end_sample))
+    return segments
+
+
+def find_pause(audio, min_offset, config):
+    """
+    在 audio[min_offset:] 中寻找最后一个停顿，返回停顿中点的样本位置
+
+    用于分片上传时在停顿处切出可以转写的片段，找不到停顿时返回 None。
+    """
+    energy = frame_energy_db(audio)
+    mask = speech_mask(energy, config)
+    min_frame = min_offset // FRAME_SAMPLES
+    silence = 0
+    for i in range(len(mask) - 1, min_frame - 1, -1):
+        if not mask[i]:
+            silence += 1
+        else:
+            if silence >= config.min_silence_frames:
+                return (i + 1 + silence // 2) * FRAME_SAMPLES
+            silence = 0
+    return None